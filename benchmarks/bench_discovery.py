@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+# Same path trick as main.py so this runs from anywhere
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from src.discovery.manager import DiscoveryManager
+
+# Measures discovery over a synthetic machine with lots of profiles. Usage:
+#   python benchmarks/bench_discovery.py --profiles 100 --extensions 100
+
+def make_user_data(root: str, profiles: int, per_profile: int):
+    user_data = os.path.join(root, "Users", "bench", "AppData", "Local", "Google", "Chrome", "User Data")
+    for p in range(profiles):
+        extensions = os.path.join(user_data, "Default" if p == 0 else f"Profile {p}", "Extensions")
+        for i in range(per_profile):
+            # Fake 32 letter IDs from the a-p alphabet like the real ones
+            ext_id = "".join(chr(ord("a") + int(c, 16)) for c in f"{p:016x}{i:016x}")
+            for version in ("1.9.0_0", "1.10.0_0"):
+                ver_dir = os.path.join(extensions, ext_id, version)
+                os.makedirs(ver_dir)
+                with open(os.path.join(ver_dir, "manifest.json"), "w", encoding="utf-8") as f:
+                    json.dump({"name": ext_id, "version": version.split("_")[0], "permissions": ["tabs"]}, f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-profile discovery")
+    parser.add_argument("--profiles", type=int, default=100)
+    parser.add_argument("--extensions", type=int, default=100, help="Extensions per profile")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_user_data(root, args.profiles, args.extensions)
+        total = args.profiles * args.extensions
+        print(f"Corpus: {args.profiles} profiles, {total} extension folders")
+        for workers in args.workers:
+            manager = DiscoveryManager([root], workers=workers)
+            start = time.perf_counter()
+            found = manager.run_discovery()
+            elapsed = time.perf_counter() - start
+            newest = all(e.version == "1.10.0" for e in found)
+            print(f"  workers={workers:<3} {elapsed:6.2f}s  {len(found) / elapsed:9.0f} ext/s  "
+                  f"{'ok' if len(found) == total and newest else 'MISMATCH'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+# Same path trick as main.py so this runs from anywhere
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from benchmarks.corpus import PERMISSIONS, HOST_PATTERNS, extension_id, minified_bundle
+from src.discovery.chrome import ChromiumDiscovery
+from src.threat_intel.scanner import StaticScanner
+from src.report import extension_record
+
+# Measures how much memory the Extension records of a whole fleet take once
+# they've been discovered and scanned, which is what a fleet-wide aggregation
+# keeps alive until the report is written. Every host has its own copy of each
+# extension, so every install is parsed and scanned on its own. Usage:
+#   python benchmarks/bench_memory.py --distinct 200 --hosts 100
+
+
+def rich_manifest(rng: random.Random, i: int) -> dict:
+    # Store manifests carry a public key, icons, content scripts and so on,
+    # so they're a lot bigger than the fields the scanner actually reads
+    return {
+        "manifest_version": 3,
+        "name": f"Synthetic Extension {i}",
+        "version": "1.0.0",
+        "description": "Generated for benchmarking " * 4,
+        "key": "".join(rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/", k=392)),
+        "permissions": rng.sample(PERMISSIONS, rng.randint(2, 6)),
+        "host_permissions": rng.sample(HOST_PATTERNS, rng.randint(0, 2)),
+        "icons": {size: f"images/icon-{size}.png" for size in ("16", "32", "48", "128")},
+        "action": {"default_popup": "popup.html", "default_icon": {"16": "images/icon-16.png"}},
+        "background": {"service_worker": "bundle0.js"},
+        "content_scripts": [{"matches": ["https://*/*"], "js": [f"content{n}.js" for n in range(4)],
+                             "run_at": "document_idle"}],
+        "web_accessible_resources": [{"resources": [f"assets/{n}.svg" for n in range(12)],
+                                      "matches": ["<all_urls>"]}],
+        "update_url": "https://clients2.google.com/service/update2/crx",
+    }
+
+
+def make_extensions(root: str, distinct: int, seed: int):
+    rng = random.Random(seed)
+    extensions_dir = os.path.join(root, "Default", "Extensions")
+    apps = []
+    for i in range(distinct):
+        app_path = os.path.join(extensions_dir, extension_id(rng))
+        version_dir = os.path.join(app_path, "1.0.0_0")
+        os.makedirs(version_dir)
+        with open(os.path.join(version_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(rich_manifest(rng, i), f, indent=2)
+        with open(os.path.join(version_dir, "bundle0.js"), "w", encoding="utf-8") as f:
+            f.write(minified_bundle(rng, 2048, urls=25, ips=6))
+        apps.append(app_path)
+    return extensions_dir, apps
+
+
+def measure(extensions_dir: str, apps, hosts: int):
+    discovery = ChromiumDiscovery("Chrome", extensions_dir)
+    scanner = StaticScanner()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    fleet = []
+    for _ in range(hosts):
+        for app_path in apps:
+            ext = discovery.scan_app(app_path)
+            scanner.scan_extension(ext)
+            ext.risk_score = "Low"
+            ext.risk_summary = "Reads the page to show a popup, nothing leaves the browser."
+            fleet.append(ext)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    # Then write the report the way a default run does (every field, manifest_content
+    # included). Each manifest is read back for its own record and let go again, so
+    # what the fleet retains afterwards shouldn't move
+    with open(os.devnull, "w") as sink:
+        for ext in fleet:
+            json.dump(extension_record(ext), sink, default=str)
+    gc.collect()
+    after_report, report_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return fleet, current, max(peak, report_peak), after_report, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory the Extension records of a fleet take")
+    parser.add_argument("--distinct", type=int, default=200, help="Different extensions")
+    parser.add_argument("--hosts", type=int, default=100, help="Hosts that each have all of them installed")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        extensions_dir, apps = make_extensions(root, args.distinct, args.seed)
+        fleet, current, peak, after_report, elapsed = measure(extensions_dir, apps, args.hosts)
+        per_install = current / len(fleet)
+        print(f"Fleet: {args.hosts} hosts x {args.distinct} extensions = {len(fleet)} installs ({elapsed:.1f}s)")
+        print(f"  retained {current / (1024 * 1024):8.1f} MB  ({per_install:,.0f} bytes per install)")
+        print(f"  after writing the full report {after_report / (1024 * 1024):8.1f} MB")
+        print(f"  peak     {peak / (1024 * 1024):8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
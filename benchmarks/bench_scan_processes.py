@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import random
+import string
+import argparse
+import tempfile
+
+# Same path trick as main.py so this runs from anywhere
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from src.models import Extension
+from src.threat_intel.scanner import StaticScanner
+
+# Measures how static scanning scales with --scan-processes on a synthetic
+# corpus of unpacked extensions. Usage:
+#   python benchmarks/bench_scan_processes.py --extensions 200 --processes 1 2 4 8
+
+def make_corpus(root: str, count: int, files_per_ext: int, file_kb: int, seed: int = 42):
+    rng = random.Random(seed)
+    words = ["function", "return", "var", "const", "this", "window", "document", "=>", "{", "}", ";"]
+    paths = []
+    for i in range(count):
+        ext_dir = os.path.join(root, f"ext{i:05d}", "1.0.0")
+        os.makedirs(ext_dir)
+        for j in range(files_per_ext):
+            parts = []
+            size = 0
+            while size < file_kb * 1024:
+                if rng.random() < 0.01:
+                    host = "".join(rng.choices(string.ascii_lowercase, k=8))
+                    token = f'"https://{host}.example.com/api?id={rng.randint(0, 9999)}"'
+                elif rng.random() < 0.005:
+                    token = f'"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"'
+                else:
+                    token = rng.choice(words) + str(rng.randint(0, 99))
+                parts.append(token)
+                size += len(token) + 1
+            with open(os.path.join(ext_dir, f"bundle{j}.js"), "w", encoding="utf-8") as f:
+                f.write(" ".join(parts))
+        paths.append(ext_dir)
+    return paths
+
+def run(paths, processes: int):
+    scanner = StaticScanner(processes=processes if processes > 1 else None)
+    extensions = [Extension(id=os.path.basename(os.path.dirname(p)), install_path=p) for p in paths]
+    start = time.perf_counter()
+    try:
+        scanner.scan_all(extensions)
+    finally:
+        scanner.close()
+    return time.perf_counter() - start, extensions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StaticScanner process-pool scaling")
+    parser.add_argument("--extensions", type=int, default=200)
+    parser.add_argument("--files", type=int, default=5, help="Files per extension")
+    parser.add_argument("--file-kb", type=int, default=200, help="Size of each file in KB")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = make_corpus(root, args.extensions, args.files, args.file_kb)
+        total_mb = args.extensions * args.files * args.file_kb / 1024
+        print(f"Corpus: {args.extensions} extensions, {total_mb:.0f} MB, {os.cpu_count()} CPUs")
+
+        baseline, reference = None, None
+        for processes in sorted(set(args.processes)):
+            elapsed, extensions = run(paths, processes)
+            if baseline is None:
+                baseline, reference = elapsed, extensions
+            # Every mode has to give exactly the same answer
+            same = all(a.extracted_urls == b.extracted_urls and a.extracted_ips == b.extracted_ips
+                       for a, b in zip(reference, extensions))
+            print(f"  processes={processes:<3} {elapsed:7.2f}s  {total_mb / elapsed:7.1f} MB/s  "
+                  f"speedup x{baseline / elapsed:.2f}  {'ok' if same else 'MISMATCH'}")
+
+if __name__ == "__main__":
+    main()
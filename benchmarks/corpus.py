@@ -0,0 +1,106 @@
+import os
+import json
+import random
+import string
+from typing import Dict, List
+
+# Builds a synthetic browser profile full of unpacked extensions, laid out the
+# way Chrome does it: User Data/<profile>/Extensions/<id>/<version>_0/...
+# Everything comes from a seeded RNG so the same parameters always give the same corpus.
+
+PERMISSIONS = ["tabs", "storage", "activeTab", "cookies", "webRequest", "scripting",
+               "alarms", "notifications", "contextMenus", "history", "downloads"]
+HOST_PATTERNS = ["<all_urls>", "https://*/*", "https://*.example.com/*", "https://mail.example.org/*"]
+JS_WORDS = ["function", "return", "var", "const", "let", "this", "window", "document",
+            "typeof", "null", "void 0", "new", "Promise", "async", "await", "=>"]
+# A few well known hosts mixed in with random ones, like real bundles
+COMMON_HOSTS = ["www.google-analytics.com", "cdn.jsdelivr.net", "fonts.googleapis.com", "api.github.com"]
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def extension_id(rng: random.Random) -> str:
+    # Real Chrome IDs are 32 letters from a to p
+    return "".join(rng.choice("abcdefghijklmnop") for _ in range(32))
+
+
+def minified_bundle(rng: random.Random, size: int, urls: int, ips: int) -> str:
+    # One long line of minified-looking JavaScript with the URLs and IPs spread through it
+    embedded = []
+    for _ in range(urls):
+        if rng.random() < 0.3:
+            host = rng.choice(COMMON_HOSTS)
+        else:
+            host = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12))) + rng.choice([".com", ".net", ".io"])
+        scheme = "http" if rng.random() < 0.1 else "https"
+        embedded.append(f'"{scheme}://{host}/{rng.choice(["api", "v1", "collect", "static"])}?k={rng.randint(0, 99999)}"')
+    for _ in range(ips):
+        embedded.append(f'"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"')
+
+    # Picking from a pool of statements keeps generation fast even for big bundles
+    pool = []
+    for _ in range(256):
+        name = "".join(rng.choices(string.ascii_letters, k=rng.randint(1, 3)))
+        pool.append(f"{rng.choice(JS_WORDS)} {name}={name}.{rng.choice(string.ascii_lowercase)}({rng.randint(0, 999)});")
+    average = sum(map(len, pool)) / len(pool)
+    filler = rng.choices(pool, k=max(1, int(size / average)))
+
+    # Spread the endpoints evenly through the filler
+    step = max(1, len(filler) // (len(embedded) + 1))
+    parts = []
+    for index, statement in enumerate(filler):
+        parts.append(statement)
+        if embedded and index % step == step - 1:
+            parts.append(f"fetch({embedded.pop()});")
+    parts.extend(f"fetch({token});" for token in embedded)
+    return "".join(parts)
+
+
+def make_corpus(root: str, extensions: int = 50, versions: int = 2, bundles: int = 3,
+                bundle_kb: int = 100, urls: int = 20, ips: int = 2, profiles: int = 1,
+                seed: int = 42) -> Dict:
+    # Returns what was built so a benchmark can report it next to its timings.
+    # Every profile gets the same extensions (same bytes), like a fleet machine with several users
+    rng = random.Random(seed)
+    user_data = os.path.join(root, "User Data")
+    installs: List[str] = []
+    total_bytes = 0
+
+    for i in range(extensions):
+        ext_id = extension_id(rng)
+        manifest = {
+            "manifest_version": 3,
+            "name": f"Synthetic Extension {i}",
+            "description": "Generated for benchmarking",
+            "permissions": rng.sample(PERMISSIONS, rng.randint(0, 5)),
+            "host_permissions": rng.sample(HOST_PATTERNS, rng.randint(0, 2)),
+            "background": {"service_worker": "bundle0.js"},
+            "update_url": "https://clients2.google.com/service/update2/crx",
+        }
+        files = {f"bundle{b}.js": minified_bundle(rng, bundle_kb * 1024, urls, ips).encode() for b in range(bundles)}
+        files["icon.png"] = PNG_HEADER + bytes(rng.getrandbits(8) for _ in range(2048))
+
+        for v in range(versions):
+            version = f"1.{v}.0"
+            manifest_bytes = json.dumps(dict(manifest, version=version), indent=2).encode()
+            for p in range(profiles):
+                profile = "Default" if p == 0 else f"Profile {p}"
+                version_dir = os.path.join(user_data, profile, "Extensions", ext_id, f"{version}_0")
+                os.makedirs(version_dir)
+                with open(os.path.join(version_dir, "manifest.json"), "wb") as f:
+                    f.write(manifest_bytes)
+                for name, content in files.items():
+                    with open(os.path.join(version_dir, name), "wb") as f:
+                        f.write(content)
+                    total_bytes += len(content)
+                total_bytes += len(manifest_bytes)
+                if v == versions - 1:
+                    installs.append(version_dir)
+
+    return {
+        "user_data": user_data,
+        "installs": installs,
+        "extensions": extensions,
+        "versions": versions,
+        "profiles": profiles,
+        "total_mb": round(total_bytes / (1024 * 1024), 2),
+    }
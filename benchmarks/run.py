@@ -0,0 +1,257 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+import argparse
+import tempfile
+import statistics
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# Same path trick as main.py so this runs from anywhere
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from benchmarks.corpus import make_corpus
+from benchmarks.stubs import StubServices
+from src.discovery.chrome import ChromiumDiscovery
+from src.enrichment.meta_client import EnrichmentClient
+from src.llm.assessor import RiskAssessor
+from src.models import Extension
+from src.threat_intel.scanner import StaticScanner
+import src.main as bera
+
+# Times the hot paths on a synthetic corpus with local stand-ins for every
+# network service, and writes the timings as JSON so runs can be compared:
+#   python benchmarks/run.py --output bench-results.json
+#   python benchmarks/run.py --baseline benchmarks/baseline.json --fail-on-regression
+# Bump RESULTS_VERSION if the shape of the results file changes.
+
+RESULTS_VERSION = 1
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def measure(func: Callable[[], int], repeat: int) -> Dict:
+    # func does one full round and returns how many items it handled
+    runs = []
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = func()
+        runs.append(time.perf_counter() - start)
+    return _summary(runs, items)
+
+
+def import_seconds(module: str) -> float:
+    # What python -X importtime says importing module took, everything it pulls in included.
+    # A fresh interpreter every time, so nothing is imported already
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=project_root, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1e6
+    raise RuntimeError(f"python -X importtime didn't report {module}")
+
+
+def measure_import(module: str, repeat: int) -> Dict:
+    return _summary([import_seconds(module) for _ in range(repeat)], 1)
+
+
+def _summary(runs: List[float], items: int) -> Dict:
+    median = statistics.median(runs)
+    return {
+        "seconds": round(median, 6),
+        "min": round(min(runs), 6),
+        "max": round(max(runs), 6),
+        "repeat": len(runs),
+        "items": items,
+        "per_item_ms": round(median * 1000 / items, 4) if items else None,
+    }
+
+
+def run_benchmarks(params: Dict, only: Optional[List[str]] = None) -> Dict:
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="bera-bench-")
+    try:
+        corpus = make_corpus(os.path.join(workdir, "corpus"), extensions=params["extensions"],
+                             versions=params["versions"], bundles=params["bundles"],
+                             bundle_kb=params["bundle_kb"], urls=params["urls"], ips=params["ips"],
+                             profiles=params["profiles"], seed=params["seed"])
+        extensions_dir = os.path.join(corpus["user_data"], "Default", "Extensions")
+        discovered = ChromiumDiscovery("Chrome", extensions_dir).scan()
+        # The network benchmarks only use the first few so they don't just measure sleep()
+        sample = discovered[:params["network_items"]]
+
+        def wanted(name: str) -> bool:
+            return not only or any(name.startswith(prefix) for prefix in only)
+
+        def startup_help():
+            # A whole new process, like someone typing the command
+            subprocess.run([sys.executable, os.path.join(project_root, "src", "main.py"), "--help"],
+                           stdout=subprocess.DEVNULL, check=True)
+            return 1
+
+        def discovery():
+            return len(ChromiumDiscovery("Chrome", extensions_dir).scan())
+
+        def scan():
+            scanner = StaticScanner()
+            for ext in discovered:
+                scanner.scan_extension(Extension(id=ext.id, install_path=ext.install_path))
+            return len(discovered)
+
+        with StubServices(store_latency=params["store_latency"], llm_latency=params["llm_latency"]) as stubs:
+            def enrich():
+                client = EnrichmentClient(cws_url=stubs.cws_url, amo_url=stubs.amo_url,
+                                          requests_per_second=10000)
+                # Half of them pretend to be Firefox add-ons so AMO gets exercised too
+                for i, ext in enumerate(sample):
+                    client.enrich(Extension(id=ext.id, browser="Firefox" if i % 2 else "Chrome"))
+                return len(sample)
+
+            def assess():
+                assessor = RiskAssessor(base_url=stubs.llm_url, model="stub-model")
+                for ext in sample:
+                    assessor.assess(ext)
+                return len(sample)
+
+            def end_to_end(cache_dir: str):
+                argv = ["run", "--root", corpus["user_data"], "--cache-dir", cache_dir,
+                        "--output", os.path.join(workdir, "report.json"),
+                        "--cws-url", stubs.cws_url, "--amo-url", stubs.amo_url, "--enrich-rps", "10000",
+                        "--llm-base-url", stubs.llm_url, "--llm-model", "stub-model", "--no-triage",
+                        "--workers", str(params["workers"])]
+                with redirect_stdout(io.StringIO()):
+                    bera.main(argv)
+                return len(corpus["installs"])
+
+            def main_cold():
+                # Empty caches every time, like the very first run on a machine
+                cache_dir = tempfile.mkdtemp(dir=workdir)
+                try:
+                    return end_to_end(cache_dir)
+                finally:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+
+            warm_cache = os.path.join(workdir, "warm-cache")
+
+            def main_warm():
+                # Nothing changed since the last run, so the caches should answer everything
+                return end_to_end(warm_cache)
+
+            benchmarks = [
+                ("discovery.scan", discovery),
+                ("scanner.scan_extension", scan),
+                ("enrichment.enrich", enrich),
+                ("assessor.assess", assess),
+                ("main.cold", main_cold),
+                ("main.warm", main_warm),
+                ("startup.help", startup_help),
+                ("startup.import", None),
+            ]
+            for name, func in benchmarks:
+                if not wanted(name):
+                    continue
+                if name == "main.warm":
+                    end_to_end(warm_cache)
+                if name == "startup.import":
+                    results[name] = measure_import("src.main", params["repeat"])
+                else:
+                    results[name] = measure(func, params["repeat"])
+                print(f"  {name:<24} {results[name]['seconds']:8.3f}s  ({results[name]['items']} items)")
+
+            requests_made = dict(stubs.counter)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "corpus_mb": corpus["total_mb"],
+            "stub_requests": requests_made,
+        },
+        "params": params,
+        "benchmarks": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = 0.2) -> List[Dict]:
+    # A benchmark is "slower" when its median grew by more than tolerance
+    rows = []
+    for name, result in current["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base or not base.get("seconds"):
+            rows.append({"name": name, "baseline": None, "current": result["seconds"], "ratio": None, "status": "new"})
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        status = "slower" if ratio > 1 + tolerance else "faster" if ratio < 1 - tolerance else "ok"
+        rows.append({"name": name, "baseline": base["seconds"], "current": result["seconds"],
+                     "ratio": round(ratio, 3), "status": status})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BERA's hot paths against local stub services")
+    parser.add_argument("--extensions", type=int, default=50)
+    parser.add_argument("--versions", type=int, default=2, help="Versions of each extension left on disk")
+    parser.add_argument("--bundles", type=int, default=3, help="Minified JS bundles per version")
+    parser.add_argument("--bundle-kb", type=int, default=100)
+    parser.add_argument("--urls", type=int, default=20, help="URLs embedded in each bundle")
+    parser.add_argument("--ips", type=int, default=2, help="IPs embedded in each bundle")
+    parser.add_argument("--profiles", type=int, default=1, help="Profiles with identical copies of every extension")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--network-items", type=int, default=20, help="Extensions used for the enrich/assess benchmarks")
+    parser.add_argument("--store-latency", type=float, default=0.02, help="Seconds the store stubs wait before answering")
+    parser.add_argument("--llm-latency", type=float, default=0.1, help="Seconds the LLM stub waits before answering")
+    parser.add_argument("--workers", type=int, default=4, help="--workers for the end-to-end runs")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="Only run benchmarks whose name starts with one of these")
+    parser.add_argument("--output", default="bench-results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help=f"Results file to compare against (e.g. {os.path.relpath(DEFAULT_BASELINE)})")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a benchmark counts as slower")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with 1 if anything got slower")
+    args = parser.parse_args(argv)
+
+    params = {name: getattr(args, name) for name in (
+        "extensions", "versions", "bundles", "bundle_kb", "urls", "ips", "profiles", "seed",
+        "network_items", "store_latency", "llm_latency", "workers", "repeat")}
+    print(f"Running benchmarks ({args.extensions} extensions, {args.repeat} repeats)...")
+    results = run_benchmarks(params, args.only)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("params") != params:
+        print("  Warning: the baseline was recorded with different parameters, so the numbers may not be comparable")
+    if baseline.get("meta", {}).get("cpus") != results["meta"]["cpus"]:
+        print("  Warning: the baseline was recorded on a machine with a different CPU count")
+
+    rows = compare(results, baseline, args.tolerance)
+    print(f"\n{'benchmark':<24} {'baseline':>10} {'current':>10} {'ratio':>7}  status")
+    for row in rows:
+        base = f"{row['baseline']:.3f}s" if row["baseline"] is not None else "-"
+        ratio = f"x{row['ratio']:.2f}" if row["ratio"] is not None else "-"
+        print(f"{row['name']:<24} {base:>10} {row['current']:>9.3f}s {ratio:>7}  {row['status']}")
+
+    if args.fail_on_regression and any(row["status"] == "slower" for row in rows):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
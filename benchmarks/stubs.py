@@ -0,0 +1,116 @@
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+# Local stand-ins for the Chrome Web Store, AMO and an OpenAI-compatible
+# /chat/completions endpoint, so benchmarks measure BERA and not the internet.
+# Each one sleeps for its configured latency before answering.
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Set per server by StubServices
+    latency = 0.0
+    counter: Dict[str, int] = {}
+    counter_lock = threading.Lock()
+    # HTTP/1.1 so the clients can keep connections open, like a real server
+    protocol_version = "HTTP/1.1"
+
+    def _count(self, name: str):
+        with self.counter_lock:
+            self.counter[name] = self.counter.get(name, 0) + 1
+
+    def _send(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StoreHandler(_StubHandler):
+    def do_GET(self):
+        time.sleep(self.latency)
+        ext_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if self.path.startswith("/detail/"):
+            self._count("cws")
+            # Real store pages are big, so the parser gets some work too
+            filler = "".join(f"<div class='c{i}'><span>item {i}</span></div>" for i in range(200))
+            self._send(f"<html><head><title>x</title></head><body>{filler}<h1>Store {ext_id}</h1></body></html>".encode(),
+                       "text/html")
+        else:
+            self._count("amo")
+            self._send(json.dumps({
+                "name": {"en-US": f"Fox {ext_id}"},
+                "summary": {"en-US": "A synthetic Firefox add-on"},
+                "last_updated": "2024-01-01T00:00:00Z",
+                "authors": [{"name": "Bench Author"}],
+            }).encode(), "application/json")
+
+
+class LLMHandler(_StubHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        self._count("llm")
+        prompt = body["messages"][-1]["content"]
+        refs = re.findall(r"\[Extension (\d+)\]", prompt)
+        if refs:
+            content = json.dumps([{"id": ref, "risk": "Low", "reason": "stub"} for ref in refs])
+        else:
+            content = "Risk: Low\nReason: stub"
+        self._send(json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 10,
+                      "total_tokens": len(prompt) // 4 + 10},
+        }).encode(), "application/json")
+
+
+class StubServices:
+    # Starts both servers on free local ports. Use it as a context manager:
+    #   with StubServices(store_latency=0.02, llm_latency=0.1) as stubs:
+    #       EnrichmentClient(cws_url=stubs.cws_url, amo_url=stubs.amo_url)
+    def __init__(self, store_latency: float = 0.02, llm_latency: float = 0.1):
+        self.counter: Dict[str, int] = {}
+        self._servers = []
+        self._store = self._start(StoreHandler, store_latency)
+        self._llm = self._start(LLMHandler, llm_latency)
+
+    def _start(self, handler, latency: float) -> ThreadingHTTPServer:
+        # A subclass per server so the latency and counter aren't shared between instances
+        configured = type(handler.__name__, (handler,), {"latency": latency, "counter": self.counter})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), configured)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._servers.append(server)
+        return server
+
+    @property
+    def cws_url(self) -> str:
+        return f"http://127.0.0.1:{self._store.server_port}/detail/{{id}}"
+
+    @property
+    def amo_url(self) -> str:
+        return f"http://127.0.0.1:{self._store.server_port}/api/v5/addons/addon/{{id}}/"
+
+    @property
+    def llm_url(self) -> str:
+        return f"http://127.0.0.1:{self._llm.server_port}/v1"
+
+    def close(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,200 @@
+import os
+from typing import Callable, Dict, Optional, Tuple
+from src.models import Extension
+from src.metrics import Metrics
+from src.pipeline import Pipeline, Stage
+
+# Only what every command needs is imported up here. The stage modules pull in
+# requests, bs4 and openai, which take longer to import than a small scan takes
+# to run, so each one is imported when its stage is actually built.
+
+# The pipeline stages each command runs, in order
+COMMAND_STAGES = {
+    "inventory": (),
+    "scan": ("scan", "triage"),
+    "assess": ("scan", "triage", "assess"),
+    "run": ("enrich", "scan", "triage", "assess"),
+    "watch": ("enrich", "scan", "triage", "assess"),
+}
+
+
+def stages_for(args) -> Tuple[str, ...]:
+    # --offline drops web store enrichment. The assess stage stays, but only
+    # hands out cached verdicts
+    stages = COMMAND_STAGES.get(getattr(args, "command", None) or "run", COMMAND_STAGES["run"])
+    if getattr(args, "offline", False):
+        stages = tuple(stage for stage in stages if stage != "enrich")
+    return stages
+
+
+# Everything needed to analyse extensions, built once from the command line options.
+# "run" builds one per run. "watch" keeps one alive so the caches, the HTTP
+# connection pool and the LLM client stay warm between rounds.
+class Analyzer:
+    def __init__(self, args, metrics: Optional[Metrics] = None, stages: Optional[Tuple[str, ...]] = None,
+                 store=None):
+        self.args = args
+        self.metrics = metrics
+        # With a results store, versions that already have an LLM verdict there aren't assessed again
+        self.store = store
+        self.stages = stages_for(args) if stages is None else stages
+        self.enrich_workers = args.enrich_workers or args.workers
+        self.enricher = self.scanner = self.assessor = self.scorer = self.intel = None
+        # The scan index, shared with dedup so file digests are remembered too
+        self.index = None
+
+        if "enrich" in self.stages:
+            from src.enrichment.meta_client import EnrichmentClient
+            from src.enrichment.cache import EnrichmentCache
+            self.enricher = EnrichmentClient(
+                cws_url=args.cws_url,
+                amo_url=args.amo_url,
+                requests_per_second=args.enrich_rps,
+                per_host_limit=args.enrich_per_host,
+                pool_size=max(self.enrich_workers, args.enrich_per_host),
+                cache=EnrichmentCache(os.path.join(args.cache_dir, "enrichment.json"), ttl_seconds=args.enrichment_ttl * 3600),
+                refresh=args.refresh_enrichment,
+                metrics=metrics,
+            )
+        if "scan" in self.stages:
+            from src.threat_intel.scanner import StaticScanner
+            from src.threat_intel.scan_index import ScanIndex
+            from src.discovery.archive import ArchiveLimits
+            self.index = ScanIndex(os.path.join(args.cache_dir, "scan_index.json"))
+            self.scanner = StaticScanner(
+                index=self.index,
+                rescan=args.rescan,
+                max_file_bytes=int(args.max_file_mb * 1024 * 1024) or None,
+                max_extension_bytes=int(args.max_extension_mb * 1024 * 1024) or None,
+                processes=args.scan_processes,
+                metrics=metrics,
+                archive_limits=ArchiveLimits(max_ratio=args.archive_max_ratio),
+            )
+            self.intel = self._load_intel()
+        if "assess" in self.stages:
+            from src.llm.assessor import RiskAssessor
+            from src.llm.verdict_cache import VerdictCache
+            from src.ratelimit import RequestLimiter
+            self.assessor = RiskAssessor(
+                cache=VerdictCache(os.path.join(args.cache_dir, "verdicts.json"),
+                                   max_age_seconds=args.verdict_max_age * 86400 or None),
+                force=args.reassess,
+                base_url=args.llm_base_url,
+                model=args.llm_model,
+                batch_token_budget=args.assess_batch_tokens,
+                prompt_token_budget=args.prompt_tokens,
+                limiter=RequestLimiter(args.llm_rpm, args.llm_tpm, in_flight=args.llm_in_flight),
+                max_retries=args.llm_retries,
+                deadline=args.llm_deadline or None,
+                metrics=metrics,
+                offline=args.offline,
+            )
+        if "triage" in self.stages:
+            from src.triage.prescore import RiskScorer, TriageConfig
+            self.scorer = RiskScorer(TriageConfig(low_max=args.triage_low, high_min=args.triage_high))
+        # Kept for the report, which is written after close()
+        self.intel_info = {"path": self.intel.path, "created": self.intel.header.get("created"),
+                           "feeds": self.intel.header["feeds"]} if self.intel else None
+
+    def _load_intel(self):
+        # --intel, or whatever compile-intel left in the cache folder
+        path = self.args.intel or os.path.join(self.args.cache_dir, "intel.bin")
+        if not os.path.exists(path):
+            if self.args.intel:
+                print(f"  Threat intel file {path} doesn't exist, run compile-intel first")
+            return None
+        from src.threat_intel.intel import IntelIndex
+        try:
+            intel = IntelIndex(path)
+        except (OSError, ValueError) as e:
+            print(f"  Not using threat intel: {e}")
+            return None
+        print(f"  Threat intel: {intel.indicators} indicators from {len(intel.feeds)} feeds ({path})")
+        return intel
+
+    def scan(self, ext: Extension):
+        self.scanner.scan_extension(ext)
+        if self.intel:
+            hits = self.intel.annotate(ext)
+            if self.metrics and hits:
+                self.metrics.inc("intel_hits_total", len(hits))
+
+    def triage(self, ext: Extension):
+        # Always work out the pre-score (it's cheap and useful in the report),
+        # but only hand out a local verdict if triage is on
+        if self.args.no_triage:
+            ext.prescore, _ = self.scorer.score(ext)
+            ext.prescore_tier = self.scorer.tier(ext.prescore)
+        else:
+            self.scorer.triage(ext)
+
+    def from_store(self, ext: Extension) -> bool:
+        if not self.store or self.args.reassess:
+            return False
+        stored = self.store.stored_verdict(ext, self.assessor.model, self.assessor.prompt_version,
+                                           max_age_seconds=self.args.verdict_max_age * 86400 or None)
+        if not stored:
+            return False
+        ext.risk_score, ext.risk_summary = stored
+        ext.verdict_source = "store"
+        if self.metrics:
+            self.metrics.inc("store_verdicts_reused_total")
+        return True
+
+    def assess(self, ext: Extension):
+        if ext.verdict_source == "local" or self.from_store(ext):
+            return
+        ext.risk_score, ext.risk_summary = self.assessor.assess(ext)
+
+    def assess_batch(self, batch):
+        batch = [ext for ext in batch if ext.verdict_source != "local" and not self.from_store(ext)]
+        for ext, (score, reason) in zip(batch, self.assessor.assess_batch(batch)):
+            ext.risk_score, ext.risk_summary = score, reason
+
+    def pipeline(self, on_result: Optional[Callable[[Extension], None]] = None) -> Pipeline:
+        args = self.args
+        # The enrichment budget covers one pass over the extensions, so it starts again every time
+        if self.enricher:
+            self.enricher.set_time_budget(args.enrich_budget)
+        # Enrichment and the LLM are just waiting on the network, so they can have lots of workers.
+        # Scanning actually uses the CPU so there's no point going above the core count
+        scan_workers = args.scan_workers or min(args.workers, os.cpu_count() or 1)
+        if args.scan_processes:
+            # With a process pool the scan threads only hand work over, so I need enough of them to keep every process busy
+            scan_workers = max(scan_workers, args.scan_processes * 2)
+        stages = {
+            "enrich": lambda: Stage("enrich", self.enricher.enrich, self.enrich_workers),
+            "scan": lambda: Stage("scan", self.scan, scan_workers),
+            "triage": lambda: Stage("triage", self.triage, 1),
+            "assess": lambda: Stage("assess", self.assess_batch if args.assess_batch > 1 else self.assess,
+                                    args.assess_workers or max(args.workers, args.llm_in_flight),
+                                    batch_size=args.assess_batch),
+        }
+        return Pipeline([stages[name]() for name in self.stages], on_result=on_result, metrics=self.metrics)
+
+    def save(self):
+        if self.enricher:
+            self.enricher.save_cache()
+        if self.scanner:
+            self.scanner.index.save()
+        if self.assessor:
+            self.assessor.save_cache()
+
+    def close(self):
+        if self.scanner:
+            self.scanner.close()
+        if self.intel:
+            self.intel.close()
+            self.intel = None
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        # Only the parts this command built
+        stats = {}
+        if self.enricher:
+            stats["enrichment_cache"] = self.enricher.cache_stats()
+        if self.scanner:
+            stats["scan_index"] = dict(self.scanner.index.stats)
+            stats["threat_intel"] = self.intel_info
+        if self.assessor:
+            stats["verdict_cache"] = self.assessor.cache_stats()
+        return stats
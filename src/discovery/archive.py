@@ -0,0 +1,243 @@
+import os
+import json
+import struct
+import base64
+import hashlib
+import zlib
+import zipfile
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from src.models import Extension
+from src.discovery.chrome import manifest_fields
+from src.discovery.manager import EXTENSION_ID
+from src.threat_intel import engine
+from src.threat_intel.engine import FileScanResult
+
+# Packed extensions (.crx from the web store, or plain .zip) read in place.
+# When we vet extensions before rollout we download them in bulk, and unpacking
+# every one to disk just so the scanner can walk it was most of the run's I/O.
+# A CRX is a small header (magic, version, signature stuff) with an ordinary ZIP
+# after it, and zipfile copes with data in front of the ZIP on its own, so the
+# header is only read for the extension ID.
+
+CRX_MAGIC = b"Cr24"
+ARCHIVE_SUFFIXES = (".crx", ".zip")
+# CRX3 headers are a protobuf (CrxFileHeader). Field 10000 is the signed header
+# data, and field 1 inside that is the 16 byte crx_id the extension ID comes from
+CRX3_SIGNED_DATA = 10000
+CRX3_CRX_ID = 1
+# Real headers are a few KB. Anything this big isn't a CRX I want to trust
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+@dataclass
+class ArchiveLimits:
+    # Guards against zip bombs. Sizes in the ZIP's directory are what zipfile
+    # stops decompressing at, so they can be checked before anything is inflated
+    max_members: int = 10000
+    # A member that inflates more than this many times over is skipped...
+    max_ratio: float = 100.0
+    # ...unless it's small, minified JS full of repeats can compress 20-50x on its own
+    ratio_floor_bytes: int = 1024 * 1024
+    # Members bigger than this are skipped outright, whatever the scanner's budgets say
+    max_member_bytes: int = 512 * 1024 * 1024
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+
+def id_from_bytes(digest: bytes) -> str:
+    # Chrome IDs are the first 16 bytes of a SHA-256, written with a-p instead of 0-f
+    return "".join(chr(ord("a") + (byte >> 4)) + chr(ord("a") + (byte & 15)) for byte in digest[:16])
+
+
+def id_from_key(public_key: bytes) -> str:
+    return id_from_bytes(hashlib.sha256(public_key).digest())
+
+
+def _varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ArchiveError("truncated CRX header")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _proto_fields(data: bytes) -> Iterator[Tuple[int, Any]]:
+    # Just enough protobuf to walk a CRX3 header: varints and length-delimited fields
+    pos = 0
+    while pos < len(data):
+        tag, pos = _varint(data, pos)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type in (1, 5):
+            size = 8 if wire_type == 1 else 4
+            value, pos = data[pos:pos + size], pos + size
+        else:
+            raise ArchiveError(f"unsupported protobuf wire type {wire_type} in CRX header")
+        yield number, value
+
+
+def crx_id(path: str) -> Optional[str]:
+    # The extension ID recorded in a CRX header, or None for a plain ZIP
+    with open(path, "rb") as f:
+        head = f.read(16)
+        if not head.startswith(CRX_MAGIC):
+            return None
+        if len(head) < 12:
+            raise ArchiveError("truncated CRX header")
+        version = struct.unpack_from("<I", head, 4)[0]
+        if version == 2:
+            key_length, signature_length = struct.unpack_from("<II", head, 8)
+            if key_length > MAX_HEADER_BYTES or signature_length > MAX_HEADER_BYTES:
+                raise ArchiveError("CRX2 header is too big")
+            f.seek(16)
+            return id_from_key(f.read(key_length))
+        if version == 3:
+            header_length = struct.unpack_from("<I", head, 8)[0]
+            if header_length > MAX_HEADER_BYTES:
+                raise ArchiveError("CRX3 header is too big")
+            f.seek(12)
+            for number, value in _proto_fields(f.read(header_length)):
+                if number == CRX3_SIGNED_DATA:
+                    for inner, crx_id_bytes in _proto_fields(value):
+                        if inner == CRX3_CRX_ID and len(crx_id_bytes) == 16:
+                            return id_from_bytes(crx_id_bytes)
+            return None
+        raise ArchiveError(f"unknown CRX version {version}")
+
+
+def _manifest_from(archive: zipfile.ZipFile, limits: ArchiveLimits) -> Dict[str, Any]:
+    try:
+        info = archive.getinfo("manifest.json")
+    except KeyError:
+        raise ArchiveError("no manifest.json in archive")
+    if info.file_size > limits.ratio_floor_bytes:
+        # A real manifest is a few KB, a huge one is either broken or a bomb
+        raise ArchiveError(f"manifest.json is {info.file_size} bytes")
+    data = json.loads(archive.read(info).decode("utf-8", errors="ignore"))
+    if not isinstance(data, dict):
+        raise ArchiveError("manifest.json is not an object")
+    return data
+
+
+def read_archive_manifest(path: str, limits: Optional[ArchiveLimits] = None) -> Dict[str, Any]:
+    # The manifest of a packed extension, or {} if it can't be read (like models.read_manifest)
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return _manifest_from(archive, limits or ArchiveLimits())
+    except (OSError, ValueError, zipfile.BadZipFile, ArchiveError):
+        return {}
+
+
+def plan_members(archive: zipfile.ZipFile, limits: ArchiveLimits) -> Tuple[List[zipfile.ZipInfo], Dict[str, int]]:
+    # Which members are safe to inflate, plus how many were refused and why
+    members, refused = [], {"bomb": 0, "too_many": 0}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        if len(members) >= limits.max_members:
+            refused["too_many"] += 1
+            continue
+        ratio = info.file_size / max(1, info.compress_size)
+        if info.file_size > limits.max_member_bytes or (
+                info.file_size > limits.ratio_floor_bytes and ratio > limits.max_ratio):
+            refused["bomb"] += 1
+            continue
+        members.append(info)
+    return members, refused
+
+
+def scan_members(path: str, jobs: List[Tuple[str, Optional[int]]]) -> List[Optional[FileScanResult]]:
+    # Inflates and scans members straight from the archive, nothing touches the disk.
+    # Lives at module level (and opens the archive itself) so the scanner's process
+    # pool can run it, and so threads don't share one file position
+    results = []
+    with zipfile.ZipFile(path) as archive:
+        for name, limit in jobs:
+            try:
+                info = archive.getinfo(name)
+                with archive.open(info) as f:
+                    results.append(engine.scan_fileobj(f, info.file_size, limit))
+            except (OSError, KeyError, EOFError, RuntimeError, NotImplementedError,
+                    zipfile.BadZipFile, zlib.error):
+                # Encrypted, unsupported compression or just corrupt
+                results.append(None)
+    return results
+
+
+# This is my discoverer for packed extensions. It looks like a ChromiumDiscovery
+# to the DiscoveryManager, but every archive is one extension and its install
+# path is the archive file itself
+class ArchiveDiscovery:
+    def __init__(self, paths: List[str], browser_name: str = "Archive", limits: Optional[ArchiveLimits] = None):
+        self.paths = list(paths)
+        self.browser_name = browser_name
+        self.limits = limits or ArchiveLimits()
+        self.extensions_path = os.path.commonpath(self.paths) if self.paths else ""
+        self.profile = None
+        self.root = self.extensions_path
+
+    def archive_files(self) -> List[str]:
+        # A path can be an archive or a folder full of them (not recursive)
+        files = []
+        for path in self.paths:
+            path = os.path.expandvars(os.path.expanduser(path))
+            if os.path.isdir(path):
+                with os.scandir(path) as it:
+                    files.extend(entry.path for entry in it
+                                 if entry.is_file() and entry.name.lower().endswith(ARCHIVE_SUFFIXES))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                print(f"Archive not found: {path}")
+        return sorted(files)
+
+    def scan(self) -> List[Extension]:
+        extensions = []
+        for path in self.archive_files():
+            ext = self.scan_archive(path)
+            if ext:
+                extensions.append(ext)
+        return extensions
+
+    def scan_archive(self, path: str) -> Optional[Extension]:
+        try:
+            ext_id = crx_id(path)
+            with zipfile.ZipFile(path) as archive:
+                data = _manifest_from(archive, self.limits)
+        except (OSError, ValueError, zipfile.BadZipFile, ArchiveError) as e:
+            print(f"Error reading archive {path}: {e}")
+            return None
+
+        if not ext_id:
+            # A plain ZIP has no header, so the manifest key or the file name has to do
+            key = data.get("key")
+            stem = os.path.splitext(os.path.basename(path))[0]
+            try:
+                ext_id = id_from_key(base64.b64decode(key)) if isinstance(key, str) and key else None
+            except ValueError:
+                ext_id = None
+            ext_id = ext_id or (stem if EXTENSION_ID.match(stem) else stem.lower())
+
+        return Extension(
+            id=ext_id,
+            browser=self.browser_name,
+            install_path=path,
+            profile=self.profile,
+            **manifest_fields(data),
+        )
@@ -1,107 +1,116 @@
 import os
 import json
-import glob
-from typing import List, Dict, Any
+from typing import Any, Dict, List, Optional, Tuple
 from src.models import Extension
 
+def version_key(name: str) -> Tuple:
+    # Chrome names version folders like "1.10.2_0" (the _0 is the install count).
+    # A plain string sort thinks "1.9.0_0" is newer than "1.10.0_0", so I compare
+    # the numbers instead. Anything that isn't a version sorts below real versions
+    main, _, build = name.partition("_")
+    try:
+        return (1, tuple(int(part) for part in main.split(".")), int(build or 0), name)
+    except ValueError:
+        return (0, (), 0, name)
+
+def manifest_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Everything an Extension gets from its manifest.json. Unpacked folders and
+    # packed archives both go through here so the two can't drift apart
+    name = data.get('name', 'Unknown')
+    # Note: Sometimes the name is like "__MSG_appName__" which means it's localized
+    # I'm not handling that for now, maybe later
+
+    author = data.get('author', '')
+    # Sometimes author is a dict with an email field (Manifest V3)
+    if isinstance(author, dict):
+        author = author.get('email', '')
+
+    csp = data.get('content_security_policy', '')
+    # CSP can also be a dict in MV3, so I convert it to string
+    if isinstance(csp, dict):
+        csp = json.dumps(csp)
+
+    # host_permissions and every content script's matches are kept so triage and
+    # the prompt don't need the manifest again
+    matches = []
+    for script in data.get("content_scripts", []) or []:
+        if isinstance(script, dict):
+            matches.extend(str(m) for m in script.get("matches", []) or [])
+
+    return {
+        "name": name,
+        "version": data.get('version', '0.0.0'),
+        "author": str(author),
+        "description": data.get('description', ''),
+        "permissions": data.get('permissions', []),
+        "csp": str(csp),
+        "update_url": data.get('update_url', ''),
+        "host_permissions": [str(h) for h in data.get("host_permissions", []) or []],
+        "content_script_matches": matches,
+    }
+
+def _subdirs(path: str) -> List[os.DirEntry]:
+    # One scandir call per folder. DirEntry.is_dir() uses the type the OS already
+    # handed back, so there's no extra stat for every entry like os.path.isdir does
+    try:
+        with os.scandir(path) as it:
+            return [entry for entry in it if entry.is_dir()]
+    except OSError:
+        return []
+
 # This is my base class for scanning Chromium-based browsers
-# Chrome and Edge both use the same extension format, so I made a parent class
+# Chrome and Edge both use the same extension format, so I made a parent class.
+# One discoverer covers one Extensions folder, which means one browser profile
 class ChromiumDiscovery:
-    def __init__(self, browser_name: str, extensions_path: str):
+    def __init__(self, browser_name: str, extensions_path: str, profile: Optional[str] = None,
+                 root: Optional[str] = None):
         self.browser_name = browser_name
         # expandvars converts %LOCALAPPDATA% to the actual path
         self.extensions_path = os.path.expandvars(extensions_path)
+        self.profile = profile
+        # The root this profile was found under, so the manager can time each root
+        self.root = root or self.extensions_path
 
     def scan(self) -> List[Extension]:
         extensions = []
-        if not os.path.exists(self.extensions_path):
-            return extensions
 
         # Chrome stores extensions like: Extensions/<AppID>/<Version>/manifest.json
-        # I need to find all the AppID folders first
-        app_dirs = [d for d in glob.glob(os.path.join(self.extensions_path, "*")) if os.path.isdir(d)]
-        
+        # Sorted so the report comes out in the same order every time
+        app_dirs = sorted(_subdirs(self.extensions_path), key=lambda entry: entry.name)
+
         for app_dir in app_dirs:
-            app_id = os.path.basename(app_dir)
-            
-            # Each extension can have multiple versions, I want the latest
-            version_dirs = [d for d in glob.glob(os.path.join(app_dir, "*")) if os.path.isdir(d)]
-            if not version_dirs:
-                continue
-                
-            # Sort to get the newest version (this works most of the time)
-            version_dirs.sort(reverse=True)
-            latest_version_dir = version_dirs[0]
-            
-            manifest_path = os.path.join(latest_version_dir, "manifest.json")
-            if os.path.exists(manifest_path):
-                ext = self._parse_manifest(manifest_path, app_id, latest_version_dir)
-                if ext:
-                    extensions.append(ext)
-                    
+            ext = self.scan_app(app_dir.path)
+            if ext:
+                extensions.append(ext)
+
         return extensions
 
+    def scan_app(self, app_path: str) -> Optional[Extension]:
+        # Each extension can have multiple versions (Chrome keeps the old one
+        # around during an update), I want the latest one that has a manifest.
+        # Returns None when there's nothing installed (any more)
+        version_dirs = sorted(_subdirs(app_path), key=lambda entry: version_key(entry.name), reverse=True)
+        for version_dir in version_dirs:
+            manifest_path = os.path.join(version_dir.path, "manifest.json")
+            if not os.path.isfile(manifest_path):
+                continue
+            return self._parse_manifest(manifest_path, os.path.basename(app_path), version_dir.path)
+        return None
+
     def _parse_manifest(self, manifest_path: str, app_id: str, install_path: str) -> Extension:
         # This is where I read the manifest.json and extract all the info I need
         try:
             with open(manifest_path, 'r', encoding='utf-8', errors='ignore') as f:
                 data = json.load(f)
-                
-            name = data.get('name', 'Unknown')
-            # Note: Sometimes the name is like "__MSG_appName__" which means it's localized
-            # I'm not handling that for now, maybe later
-            
-            version = data.get('version', '0.0.0')
-            description = data.get('description', '')
-            author = data.get('author', '')
-            
-            # Sometimes author is a dict with an email field (Manifest V3)
-            if isinstance(author, dict):
-                author = author.get('email', '')
-            
-            permissions = data.get('permissions', [])
-            csp = data.get('content_security_policy', '')
-            
-            # CSP can also be a dict in MV3, so I convert it to string
-            if isinstance(csp, dict):
-                csp = json.dumps(csp)
-                
-            update_url = data.get('update_url', '')
-            
+
             return Extension(
                 id=app_id,
-                name=name,
-                version=version,
-                author=str(author),
-                description=description,
                 browser=self.browser_name,
                 install_path=install_path,
-                manifest_content=data,
-                permissions=permissions,
-                csp=str(csp),
-                update_url=update_url
+                profile=self.profile,
+                **manifest_fields(data)
             )
             
         except Exception as e:
             print(f"Error parsing {manifest_path}: {e}")
             return None
-
-# Chrome-specific discovery
-class ChromeDiscovery(ChromiumDiscovery):
-    def __init__(self):
-        # If I'm running in Docker, the extensions will be mounted at /data/extensions
-        # Otherwise I use the Windows default path
-        docker_path = "/data/extensions"
-        if os.path.exists(docker_path):
-            super().__init__("Chrome (Docker Volume)", docker_path)
-        else:
-            super().__init__("Chrome", r"%LOCALAPPDATA%\Google\Chrome\User Data\Default\Extensions")
-
-# Edge uses the same format as Chrome, just different path
-class EdgeDiscovery(ChromiumDiscovery):
-    def __init__(self):
-        docker_path = "/data/edge_extensions"
-        if os.path.exists(docker_path):
-            super().__init__("Edge (Docker Volume)", docker_path)
-        else:
-            super().__init__("Edge", r"%LOCALAPPDATA%\Microsoft\Edge\User Data\Default\Extensions")
@@ -0,0 +1,124 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields as dataclass_fields
+from typing import Dict, List, Optional, Tuple
+from src.models import Extension
+from src.threat_intel.scan_index import ScanIndex, file_stats
+
+# On a fleet the same extension version is installed in dozens of profiles and
+# in both Chrome and Edge. Enriching, scanning and asking the LLM about every
+# copy is wasted work, so I group identical copies, analyse one of each group
+# and copy the answers to the rest.
+
+# These describe where a copy is installed, everything else is about the extension itself
+LOCATION_FIELDS = {"browser", "install_path", "profile", "content_digest", "digest_mismatch"}
+READ_CHUNK = 1024 * 1024
+
+
+def content_digest(install_path: str, index: Optional[ScanIndex] = None) -> Optional[str]:
+    # SHA-256 over every file (relative path and the file's own SHA-256) in a stable
+    # order, so two copies only match if they really have the same contents.
+    # With a scan index, files whose size and mtime haven't changed aren't read again
+    if install_path and os.path.isfile(install_path):
+        # A packed extension: hashing the archive as it is means nothing gets
+        # inflated here (a zip bomb stays a small file)
+        return _cached_digest(install_path, index)
+    if not install_path or not os.path.isdir(install_path):
+        return None
+    digest = hashlib.sha256()
+    for relative, path, stat in file_stats(install_path):
+        # A file I can't read still counts, so the copy can't look identical to a readable one
+        file_digest = _cached_digest(path, index, stat) or "unreadable"
+        digest.update(f"{relative}\0{file_digest}\0".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+def _cached_digest(path: str, index: Optional[ScanIndex], stat: Optional[os.stat_result] = None) -> Optional[str]:
+    if index is None:
+        return _file_digest(path)
+    try:
+        stat = stat or os.stat(path)
+    except OSError:
+        return None
+    digest = index.get_digest(path, stat)
+    if digest is None:
+        digest = _file_digest(path)
+        if digest:
+            index.put_digest(path, stat, digest)
+    return digest
+
+
+def _file_digest(path: str) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class InstallGroups:
+    def __init__(self, extensions: List[Extension], workers: int = 4, index: Optional[ScanIndex] = None):
+        self.extensions = list(extensions)
+        self.workers = max(1, int(workers))
+        # Where per-file digests are remembered between runs (the scanner's index)
+        self.index = index
+        # (id, version, digest) -> every install with exactly those contents
+        self.groups: Dict[Tuple[str, str, Optional[str]], List[Extension]] = {}
+        # (id, version) -> {digest: [install paths]} for versions whose copies differ
+        self.mismatches: Dict[Tuple[str, str], Dict[Optional[str], List[str]]] = {}
+
+    def build(self) -> List[Extension]:
+        # Hashing is mostly waiting on the disk (and hashlib lets go of the GIL), so threads help
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bera-digest") as pool:
+            digests = list(pool.map(lambda ext: content_digest(ext.install_path, self.index), self.extensions))
+
+        by_version: Dict[Tuple[str, str], Dict[Optional[str], List[str]]] = {}
+        for ext, digest in zip(self.extensions, digests):
+            ext.content_digest = digest
+            self.groups.setdefault((ext.id, ext.version, digest), []).append(ext)
+            by_version.setdefault((ext.id, ext.version), {}).setdefault(digest, []).append(ext.install_path)
+
+        # Same ID and version but different bytes should never happen with store
+        # installs, so somebody changed the files after install
+        for (ext_id, version), variants in by_version.items():
+            if len(variants) > 1:
+                self.mismatches[(ext_id, version)] = variants
+                for digest in variants:
+                    for ext in self.groups[(ext_id, version, digest)]:
+                        ext.digest_mismatch = True
+                print(f"  WARNING: {ext_id} {version} has {len(variants)} different contents across installs")
+
+        # The first copy (in discovery order) of each group goes through the pipeline
+        return [members[0] for members in self.groups.values()]
+
+    def copies_of(self, representative: Extension) -> List[Extension]:
+        members = self.groups.get((representative.id, representative.version, representative.content_digest), [])
+        return [ext for ext in members if ext is not representative]
+
+    def fan_out(self, representative: Extension) -> List[Extension]:
+        # Copies get every analysis result, but keep their own location.
+        # Returns the representative followed by its copies
+        copies = self.copies_of(representative)
+        for ext in copies:
+            for f in dataclass_fields(Extension):
+                if f.name not in LOCATION_FIELDS:
+                    setattr(ext, f.name, getattr(representative, f.name))
+        return [representative] + copies
+
+    def stats(self) -> Dict:
+        return {
+            "installs": len(self.extensions),
+            "unique": len(self.groups),
+            "mismatched_versions": [
+                {"id": ext_id, "version": version,
+                 "variants": [{"digest": digest, "install_paths": paths} for digest, paths in variants.items()]}
+                for (ext_id, version), variants in self.mismatches.items()
+            ],
+        }
@@ -1,26 +1,185 @@
 import os
-import json
-from typing import List
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from src.models import Extension
-from src.discovery.chrome import ChromeDiscovery, EdgeDiscovery
+from src.discovery.chrome import ChromiumDiscovery, _subdirs
 
-# This class manages all my browser-specific discoverers
-# Right now I only have Chrome and Edge, but I can add more later
+# Where each browser keeps its "User Data" folder, relative to a home folder
+# (Windows, Linux, macOS)
+BROWSER_LAYOUTS = {
+    "Chrome": ("AppData/Local/Google/Chrome/User Data", ".config/google-chrome",
+               "Library/Application Support/Google/Chrome"),
+    "Edge": ("AppData/Local/Microsoft/Edge/User Data", ".config/microsoft-edge",
+             "Library/Application Support/Microsoft Edge"),
+    "Chromium": ("AppData/Local/Chromium/User Data", ".config/chromium",
+                 "Library/Application Support/Chromium"),
+}
+# Folder names that give the browser away when a root doesn't say which one it is
+BROWSER_FOLDERS = {
+    "edge": "Edge", "microsoft edge": "Edge", "microsoft-edge": "Edge", "microsoft-edge-beta": "Edge",
+    "microsoft-edge-dev": "Edge", "chrome": "Chrome", "google chrome": "Chrome", "google-chrome": "Chrome",
+    "google-chrome-beta": "Chrome", "google-chrome-unstable": "Chrome",
+}
+# Where the home folders are when a root is a whole machine (or a snapshot of one)
+HOME_PARENTS = ("Users", "home")
+# What Chromium names its profile folders
+PROFILE_NAME = re.compile(r"^(Default|Profile \d+|Guest Profile|System Profile)$")
+# Chrome extension IDs are 32 letters from a to p
+EXTENSION_ID = re.compile(r"^[a-p]{32}$")
+# The Docker image gets the extensions folders mounted here
+DOCKER_ROOTS = (("Chrome (Docker Volume)", "/data/extensions"),
+                ("Edge (Docker Volume)", "/data/edge_extensions"))
+
+Root = Union[str, Tuple[Optional[str], str]]
+
+
+def default_roots() -> List[Tuple[Optional[str], str]]:
+    # Without --root I look at the Docker mounts if they are there,
+    # otherwise at every profile of the current user
+    mounted = [(browser, path) for browser, path in DOCKER_ROOTS if os.path.isdir(path)]
+    return mounted or [(None, os.path.expanduser("~"))]
+
+
+def parse_root(spec: str) -> Tuple[Optional[str], str]:
+    # "--root Edge=/mnt/snap1" pins the browser name, a bare path lets me work it out
+    name, sep, path = spec.partition("=")
+    if sep and name and os.sep not in name and "/" not in name:
+        return name, path
+    return None, spec
+
+
+def guess_browser(path: str) -> str:
+    # Whole folder names only, so "/home/knowledge" isn't Edge and "chrome-tools" isn't Chrome.
+    # The innermost match wins
+    for part in reversed(re.split(r"[\\/]+", path.lower())):
+        if part in BROWSER_FOLDERS:
+            return BROWSER_FOLDERS[part]
+    return "Chromium"
+
+
+def looks_like_profile(path: str) -> bool:
+    # Every real profile has a Preferences file. The name check covers copies that lost it
+    return PROFILE_NAME.match(os.path.basename(path)) is not None or os.path.isfile(os.path.join(path, "Preferences"))
+
+
+def find_profiles(browser: str, user_data_dir: str, root: str,
+                  children: Optional[List[os.DirEntry]] = None, guessing: bool = False) -> List[ChromiumDiscovery]:
+    # Every profile (Default, Profile 1, Guest Profile...) has its own Extensions folder.
+    # When I'm only guessing that this is a User Data folder, a child also has to look
+    # like a profile: a home folder has ~/.vscode/extensions, and on Windows and macOS
+    # that's an "Extensions" folder as far as the filesystem is concerned
+    discoverers = []
+    for entry in sorted(children if children is not None else _subdirs(user_data_dir), key=lambda e: e.name):
+        extensions_path = os.path.join(entry.path, "Extensions")
+        if os.path.isdir(extensions_path) and (not guessing or looks_like_profile(entry.path)):
+            discoverers.append(ChromiumDiscovery(browser, extensions_path, profile=entry.name, root=root))
+    return discoverers
+
+
+def expand_root(path: str, browser: Optional[str] = None) -> List[ChromiumDiscovery]:
+    # A root can be any of these, and I work out which by looking at what's inside:
+    #   an Extensions folder, a single profile, a User Data folder,
+    #   a home folder, or a whole machine with Users/ or home/ in it
+    path = os.path.expandvars(os.path.expanduser(path))
+    if os.path.isdir(os.path.join(path, "Extensions")):
+        return [ChromiumDiscovery(browser or guess_browser(path), os.path.join(path, "Extensions"),
+                                  profile=os.path.basename(path.rstrip(os.sep)), root=path)]
+
+    children = _subdirs(path)
+    # Extension ID folders straight away means this is an Extensions folder already.
+    # Checking this first saves a stat on each of those (possibly thousands of) folders
+    if any(EXTENSION_ID.match(entry.name) for entry in children):
+        return [ChromiumDiscovery(browser or guess_browser(path), path, root=path)]
+
+    profiles = find_profiles(browser or guess_browser(path), path, path, children, guessing=True)
+    if profiles:
+        return profiles
+
+    homes = [path] + [entry.path for parent in HOME_PARENTS
+                      for entry in sorted(_subdirs(os.path.join(path, parent)), key=lambda e: e.name)]
+    found = []
+    for home in homes:
+        for name, layouts in BROWSER_LAYOUTS.items():
+            if browser and browser != name:
+                continue
+            for layout in layouts:
+                user_data_dir = os.path.join(home, *layout.split("/"))
+                if os.path.isdir(user_data_dir):
+                    found.extend(find_profiles(name, user_data_dir, path))
+    if found or not children:
+        return found
+
+    # Nothing I recognise. With the browser given (--root Chromium=PATH) I take the
+    # user's word that it's an Extensions folder with unusual IDs, otherwise reading
+    # some random folder (a home without browsers) as extensions would be nonsense
+    if browser:
+        return [ChromiumDiscovery(browser, path, root=path)]
+    print(f"  WARNING: no extensions or browser profiles found under {path} "
+          f"(use --root BROWSER={path} if it's an Extensions folder)")
+    return []
+
+
+# This class finds every extension under any number of roots.
+# Roots are expanded into one discoverer per profile, and all of those run
+# on a thread pool because on network mounts it's mostly waiting on the disk
 class DiscoveryManager:
-    def __init__(self):
-        self.discoverers = [
-            ChromeDiscovery(),
-            EdgeDiscovery()
-            # TODO: Add FirefoxDiscovery() when I get around to it
-        ]
+    def __init__(self, roots: Optional[Sequence[Root]] = None, workers: int = 8):
+        roots = roots if roots is not None else default_roots()
+        # dict.fromkeys drops repeated roots but keeps the order
+        self.roots = list(dict.fromkeys((None, root) if isinstance(root, str) else tuple(root) for root in roots))
+        self.workers = max(1, int(workers))
+        self.discoverers: List[ChromiumDiscovery] = []
+        # root path -> {"seconds", "profiles", "extensions"}
+        self.timings: Dict[str, Dict[str, float]] = {}
 
     def run_discovery(self) -> List[Extension]:
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bera-discovery") as pool:
+            # First work out every profile under every root
+            expanded = list(pool.map(lambda root: self._timed(expand_root, root[1], root[0]), self.roots))
+
+            # Overlapping roots (like a home folder and the machine it's on) would
+            # find the same profile twice, so the first root to reach it keeps it
+            seen = set()
+            self.discoverers = []
+            for (_, path), (discoverers, started, finished) in zip(self.roots, expanded):
+                self.timings[path] = {"seconds": finished - started, "profiles": 0, "extensions": 0}
+                for discoverer in discoverers:
+                    key = os.path.realpath(discoverer.extensions_path)
+                    if key not in seen:
+                        seen.add(key)
+                        discoverer.root = path
+                        self.discoverers.append(discoverer)
+
+            # Then read every profile at the same time
+            scanned = list(pool.map(lambda d: self._timed(self._scan, d), self.discoverers))
+
+        # Results stay in root order, then profile order, so reports don't shuffle around.
+        # A root's time is its expansion plus the window its profiles were being read in
         all_extensions = []
-        # I loop through each discoverer and combine the results
-        for discoverer in self.discoverers:
-            try:
-                found = discoverer.scan()
-                all_extensions.extend(found)
-            except Exception as e:
-                print(f"Error running discoverer {discoverer.browser_name}: {e}")
+        windows: Dict[str, List[float]] = {}
+        for discoverer, (found, started, finished) in zip(self.discoverers, scanned):
+            all_extensions.extend(found)
+            timing = self.timings[discoverer.root]
+            timing["profiles"] += 1
+            timing["extensions"] += len(found)
+            window = windows.setdefault(discoverer.root, [started, finished])
+            window[0] = min(window[0], started)
+            window[1] = max(window[1], finished)
+        for path, (started, finished) in windows.items():
+            self.timings[path]["seconds"] += finished - started
         return all_extensions
+
+    def _scan(self, discoverer: ChromiumDiscovery) -> List[Extension]:
+        try:
+            return discoverer.scan()
+        except Exception as e:
+            print(f"Error running discoverer {discoverer.browser_name} ({discoverer.extensions_path}): {e}")
+            return []
+
+    @staticmethod
+    def _timed(func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        return result, started, time.perf_counter()
@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, Optional
+
+# Store metadata barely changes day to day, so I keep what I scraped on disk
+# and only go back to the network when it's old. Entries remember the ETag /
+# Last-Modified headers so an old entry can be revalidated with a cheap 304.
+class EnrichmentCache:
+    def __init__(self, path: str, ttl_seconds: float = 24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except Exception as e:
+            # A broken cache file just means we start fresh
+            print(f"Ignoring unreadable enrichment cache {self.path}: {e}")
+            self._entries = {}
+
+    @staticmethod
+    def _key(store: str, ext_id: str) -> str:
+        return f"{store}:{ext_id}"
+
+    def get(self, store: str, ext_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(self._key(store, ext_id))
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get("fetched_at", 0) < self.ttl_seconds
+
+    def put(self, store: str, ext_id: str, fields: Dict[str, Any],
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        with self._lock:
+            self._entries[self._key(store, ext_id)] = {
+                "fetched_at": time.time(),
+                "etag": etag,
+                "last_modified": last_modified,
+                "fields": fields,
+            }
+            self._dirty = True
+
+    def touch(self, store: str, ext_id: str):
+        # The server said 304 Not Modified, so the entry is good for another TTL
+        with self._lock:
+            entry = self._entries.get(self._key(store, ext_id))
+            if entry:
+                entry["fetched_at"] = time.time()
+                self._dirty = True
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Write to a temp file first so a crash can't leave half a cache behind
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -1,81 +1,281 @@
 import requests
-import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from bs4 import BeautifulSoup
-from typing import Optional, Tuple
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, Dict, List, Optional
 from src.models import Extension
+from src.enrichment.cache import EnrichmentCache
+from src.discovery.manager import EXTENSION_ID
+from src.ratelimit import RETRY_STATUSES, TokenBucket, backoff_delay, parse_retry_after
+from src.metrics import Metrics
 
 # This module tries to get extra info about extensions from web stores
 # Like how old they are, who made them, etc.
 class EnrichmentClient:
-    def __init__(self):
+    CWS_URL = "https://chromewebstore.google.com/detail/{id}"
+    AMO_URL = "https://addons.mozilla.org/api/v5/addons/addon/{id}/"
+
+    def __init__(self, cws_url: Optional[str] = None, amo_url: Optional[str] = None,
+                 timeout: float = 5.0, max_retries: int = 3, backoff_base: float = 0.5,
+                 per_host_limit: int = 4, requests_per_second: float = 5.0,
+                 pool_size: int = 16, cache: Optional[EnrichmentCache] = None,
+                 refresh: bool = False, metrics: Optional[Metrics] = None, max_retry_after: float = 30.0):
+        # The store URLs can be swapped out so I can test against a local server
+        self.cws_url = cws_url or self.CWS_URL
+        self.amo_url = amo_url or self.AMO_URL
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        # A store asking for an hour's break shouldn't hang the whole run, so
+        # Retry-After is only followed up to the same cap as the backoff
+        self.max_retry_after = max_retry_after
+        self.per_host_limit = max(1, per_host_limit)
+        # With refresh=True I ignore what's cached and always go to the network
+        self.cache = cache
+        self.refresh = refresh
+        # Latency and status code of every request, per host
+        self.metrics = metrics
+
         self.session = requests.Session()
+        # One shared connection pool for every thread, big enough that workers
+        # don't have to wait for a free connection
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         # I pretend to be a real browser so websites don't block me
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
 
+        # A token bucket keeps us polite overall, and a semaphore per host stops
+        # one store from getting hammered by every worker at once
+        self._bucket = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+        self._host_slots: Dict[str, threading.Semaphore] = {}
+        self._host_lock = threading.Lock()
+        self._deadline: Optional[float] = None
+
+    def set_time_budget(self, seconds: Optional[float]):
+        # After the budget runs out every lookup is skipped instead of waiting on the network
+        self._deadline = time.monotonic() + seconds if seconds else None
+
+    def enrich_batch(self, extensions: List[Extension], max_workers: int = 8,
+                     time_budget: Optional[float] = None) -> List[Extension]:
+        # Looks up a whole list of extensions at once over the shared pool
+        if time_budget:
+            self.set_time_budget(time_budget)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="bera-enrich") as pool:
+                list(pool.map(self.enrich, extensions))
+        finally:
+            if time_budget:
+                self.set_time_budget(None)
+        return extensions
+
     def enrich(self, extension: Extension) -> Extension:
         # I check which browser the extension is from and call the right method
         if extension.browser in ["Chrome", "Edge", "Chromium"]:
             self._enrich_chrome(extension)
+        elif extension.browser == "Archive" and EXTENSION_ID.match(extension.id):
+            # A packed CRX is a Chrome Web Store extension like any other. A ZIP that
+            # only got its file name as an ID has nothing to look up
+            self._enrich_chrome(extension)
         elif extension.browser == "Firefox":
             self._enrich_firefox(extension)
         return extension
 
+    def _host_slot(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def _remaining(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return self._deadline - time.monotonic()
+
+    def cache_stats(self) -> Dict[str, int]:
+        return dict(self.cache.stats) if self.cache else {}
+
+    def save_cache(self):
+        if self.cache:
+            self.cache.save()
+
+    def _get(self, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[requests.Response]:
+        # GET with rate limiting and retries. Returns the last response we got
+        # (even if it's an error) or None if we never got one at all
+        resp = None
+        for attempt in range(self.max_retries + 1):
+            remaining = self._remaining()
+            if remaining is not None and remaining <= 0:
+                print(f"Enrichment time budget used up, skipping {url}")
+                return resp
+            host = urlparse(url).netloc
+            waited = time.perf_counter()
+            if not self._bucket.acquire(timeout=remaining):
+                print(f"Enrichment time budget used up, skipping {url}")
+                return resp
+
+            timeout = self.timeout if remaining is None else max(0.1, min(self.timeout, remaining))
+            retry_after = None
+            try:
+                with self._host_slot(url):
+                    started = time.perf_counter()
+                    response = None
+                    try:
+                        response = self.session.get(url, timeout=timeout, headers=headers)
+                    finally:
+                        self._record(host, started, waited, response.status_code if response is not None else None)
+                    resp = response
+                if resp.status_code not in RETRY_STATUSES:
+                    return resp
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+
+            if attempt == self.max_retries:
+                break
+            if retry_after is not None:
+                delay = min(retry_after, self.max_retry_after)
+            else:
+                delay = backoff_delay(attempt, self.backoff_base, cap=self.max_retry_after)
+            remaining = self._remaining()
+            if remaining is not None and delay > remaining:
+                break
+            if self.metrics:
+                self.metrics.inc("http_retries_total", labels={"host": host})
+            time.sleep(delay)
+        return resp
+
+    def _record(self, host: str, started: float, waited: float, status: Optional[int]):
+        if not self.metrics:
+            return
+        now = time.perf_counter()
+        self.metrics.observe("http_request_seconds", now - started, {"host": host})
+        # Time spent waiting on the token bucket and the per-host limit before sending
+        self.metrics.observe("http_throttle_seconds", started - waited, {"host": host})
+        self.metrics.inc("http_responses_total", labels={"host": host, "status": status or "error"})
+
+    def _lookup(self, store: str, ext_id: str, url: str,
+                parse: Callable[[requests.Response], Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # Returns the parsed store fields for one extension, from the cache if
+        # it's fresh enough, otherwise from the network (revalidating if I can)
+        entry = self.cache.get(store, ext_id) if self.cache else None
+        if entry and not self.refresh and self.cache.is_fresh(entry):
+            self.cache.record("hits")
+            return entry["fields"]
+
+        headers = {}
+        if entry and not self.refresh:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            resp = self._get(url, headers=headers or None)
+        except (requests.ConnectionError, requests.Timeout):
+            if entry:
+                # The network is down but old data beats no data
+                self.cache.record("stale")
+                return entry["fields"]
+            raise
+
+        if resp is None or resp.status_code in RETRY_STATUSES:
+            if entry:
+                self.cache.record("stale")
+                return entry["fields"]
+            if resp is None:
+                return None
+
+        if resp.status_code == 304 and entry:
+            self.cache.touch(store, ext_id)
+            self.cache.record("revalidated")
+            return entry["fields"]
+
+        if resp.status_code != 200:
+            print(f"Failed to fetch {store} data for {ext_id}: {resp.status_code}")
+            return None
+
+        fields = parse(resp)
+        if self.cache:
+            self.cache.record("misses")
+            self.cache.put(store, ext_id, fields,
+                           etag=resp.headers.get("ETag"),
+                           last_modified=resp.headers.get("Last-Modified"))
+        return fields
+
     def _enrich_chrome(self, extension: Extension):
         # Chrome Web Store doesn't have a nice API, so I have to scrape the page
         # This is kinda fragile and might break if Google changes their site
-        url = f"https://chromewebstore.google.com/detail/{extension.id}"
+        url = self.cws_url.format(id=extension.id)
         try:
-            resp = self.session.get(url, timeout=5)
-            if resp.status_code != 200:
-                print(f"Failed to fetch CWS page for {extension.id}: {resp.status_code}")
+            fields = self._lookup("chrome", extension.id, url, self._parse_chrome)
+            if not fields:
                 return
 
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            
             # Try to at least get the title if we don't have it
-            title_tag = soup.find('h1')
-            if title_tag:
-                web_title = title_tag.get_text().strip()
-                if extension.name == "Unknown":
-                    extension.name = web_title
-            
-            # TODO: I should try to extract more stuff like last updated date
-            # but Google's HTML is really messy
-            
+            if fields.get("name") and extension.name == "Unknown":
+                extension.name = fields["name"]
+
         except Exception as e:
             print(f"Error enriching {extension.id}: {e}")
 
+    def _parse_chrome(self, resp: requests.Response) -> Dict[str, Any]:
+        # bs4 is slow to import and only needed for store pages, so it's imported here
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(resp.text, 'html.parser')
+        fields = {}
+
+        title_tag = soup.find('h1')
+        if title_tag:
+            fields["name"] = title_tag.get_text().strip()
+
+        # TODO: I should try to extract more stuff like last updated date
+        # but Google's HTML is really messy
+        return fields
+
     def _enrich_firefox(self, extension: Extension):
         # Firefox actually has a proper API which is so much nicer!
-        url = f"https://addons.mozilla.org/api/v5/addons/addon/{extension.id}/"
+        url = self.amo_url.format(id=extension.id)
         try:
-            resp = self.session.get(url, timeout=5)
-            if resp.status_code == 200:
-                data = resp.json()
-                current_version = data.get('current_version', {})
-                
-                # Get the English name
-                extension.name = data.get('name', {}).get('en-US', extension.name)
-                extension.description = data.get('summary', {}).get('en-US', extension.description)
-                
-                # Calculate how old the extension is
-                last_updated = data.get('last_updated')
-                if last_updated:
-                    try:
-                        dt = datetime.fromisoformat(last_updated.replace('Z', '+00:00'))
-                        now = datetime.now(dt.tzinfo)
-                        age = (now - dt).days
-                        extension.age_days = age
-                    except:
-                        pass
-                
-                # Get the developer names
-                authors = data.get('authors', [])
-                if authors:
-                    extension.author = ", ".join([a.get('name') for a in authors])
+            fields = self._lookup("firefox", extension.id, url, self._parse_firefox)
+            if not fields:
+                return
+
+            # Get the English name
+            extension.name = fields.get("name") or extension.name
+            extension.description = fields.get("description") or extension.description
+
+            # Calculate how old the extension is
+            # (I cache the date instead of the age so the age stays correct)
+            last_updated = fields.get("last_updated")
+            if last_updated:
+                try:
+                    dt = datetime.fromisoformat(last_updated.replace('Z', '+00:00'))
+                    now = datetime.now(dt.tzinfo)
+                    age = (now - dt).days
+                    extension.age_days = age
+                except:
+                    pass
+
+            # Get the developer names
+            if fields.get("authors"):
+                extension.author = ", ".join(fields["authors"])
 
         except Exception as e:
             print(f"Error enriching Firefox extension {extension.id}: {e}")
+
+    def _parse_firefox(self, resp: requests.Response) -> Dict[str, Any]:
+        data = resp.json()
+        return {
+            "name": data.get('name', {}).get('en-US'),
+            "description": data.get('summary', {}).get('en-US'),
+            "last_updated": data.get('last_updated'),
+            "authors": [a.get('name') for a in data.get('authors', []) if a.get('name')],
+        }
@@ -1,84 +1,333 @@
 import os
+import re
+import sys
 import json
-from typing import Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 from src.models import Extension
+from src.llm.verdict_cache import VerdictCache, fingerprint
+from src.llm.evidence import compact_evidence, estimate_tokens, full_evidence_tokens
+from src.metrics import Metrics
+from src.ratelimit import RETRY_STATUSES, RequestLimiter, backoff_delay, rate_limit_wait
 
-# Try to import OpenAI - it might not be installed
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
+# Bump this whenever _build_prompt or the system prompt changes in a way that
+# could change the verdict. It's part of the cache fingerprint, so old verdicts stop matching
+PROMPT_VERSION = "3"
+
+SYSTEM_PROMPT = "You are an expert Security Analyst. You assess browser extensions for security risks."
+# Tokens set aside for the answer when working out what a request will cost against the TPM limit
+COMPLETION_ALLOWANCE = 200
+RISK_LEVELS = ("Low", "Medium", "High", "Critical")
 
 # This is my AI-powered risk assessor
 # I send extension info to an LLM and it tells me if it looks risky
 class RiskAssessor:
-    def __init__(self):
+    def __init__(self, cache: Optional[VerdictCache] = None, force: bool = False,
+                 base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None, batch_token_budget: int = 6000,
+                 max_retries: int = 2, backoff_base: float = 1.0, metrics: Optional[Metrics] = None,
+                 offline: bool = False, prompt_token_budget: int = 1200,
+                 limiter: Optional[RequestLimiter] = None, deadline: Optional[float] = None):
+        # With a cache, an extension whose inputs haven't changed gets its old verdict back
+        # instantly. force=True always asks the LLM again (and refreshes the cache)
+        self.cache = cache
+        self.force = force
+        # Roughly how many prompt tokens one batched request may use
+        self.batch_token_budget = batch_token_budget
+        # ...and how many one extension's evidence may use (see evidence.py).
+        # A different budget shows the LLM different evidence, so it's part of the
+        # prompt version that goes into the cache fingerprint and the results store
+        self.prompt_token_budget = prompt_token_budget
+        self.prompt_version = f"{PROMPT_VERSION}/{prompt_token_budget}"
+        # I do the retries myself (the client's own are turned off) so they can be counted
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        # Shared by every assess thread: requests/tokens per minute, in-flight cap and
+        # the server's Retry-After. deadline is how many seconds one request may take,
+        # waiting and retries included, before the extension gets UNKNOWN
+        self.limiter = limiter or RequestLimiter(in_flight=8)
+        self.deadline = deadline
+        self.metrics = metrics
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.groq_api_key = os.getenv("GROQ_API_KEY")
+        # offline=True never talks to the LLM, but cached verdicts are still used
+        self.offline = offline
         self.client = None
         self.model = "gpt-4"
 
+        settings = None
+        if base_url:
+            # Any OpenAI-compatible server works (a local one doesn't even need a real key)
+            settings = {"base_url": base_url, "api_key": api_key or self.groq_api_key or self.api_key or "not-needed"}
         # I prefer Groq because it's free! If that's not available I fall back to OpenAI
-        if self.groq_api_key and OpenAI:
-            self.client = OpenAI(
-                base_url="https://api.groq.com/openai/v1",
-                api_key=self.groq_api_key
-            )
+        elif self.groq_api_key:
+            settings = {"base_url": "https://api.groq.com/openai/v1", "api_key": self.groq_api_key}
             self.model = "llama-3.3-70b-versatile"
-        elif self.api_key and OpenAI:
-            self.client = OpenAI(api_key=self.api_key)
+        elif self.api_key:
+            settings = {"api_key": self.api_key}
+
+        if model:
+            self.model = model
+
+        # The model has to be known either way since it's part of the cache fingerprint,
+        # but openai itself (slow to import) is only loaded when there's an LLM to talk to
+        openai = _load_openai() if settings and not offline else None
+        if openai:
+            self.client = openai.OpenAI(**settings, max_retries=0)
 
     def assess(self, extension: Extension) -> Tuple[str, str]:
-        # If there's no API key, I can't do the assessment
+        key, cached = self._cached(extension)
+        if cached:
+            extension.verdict_source = "cache"
+            return cached
+        # If there's no API key (or we're offline), I can't do the assessment
         if not self.client:
+            extension.verdict_source = "skipped"
+            if self.offline:
+                return "UNKNOWN", "LLM Analysis skipped (offline)."
             return "UNKNOWN", "LLM Analysis skipped (No API Key or OpenAI lib)."
+        return self._assess_one(extension, key)
+
+    def _assess_one(self, extension: Extension, key: Optional[str], evidence: Optional[str] = None) -> Tuple[str, str]:
+        extension.verdict_source = "llm"
+        prompt = self._build_prompt(evidence or self._evidence(extension))
 
-        prompt = self._build_prompt(extension)
-        
         try:
             # Ask the AI to analyze the extension
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert Security Analyst. You assess browser extensions for security risks."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.0  # I want consistent answers, not random
-            )
-            content = response.choices[0].message.content
-            
+            content = self._chat(prompt, [extension])
+
             # Parse the response to get the risk level
             lines = content.strip().split('\n')
             score = "UNKNOWN"
             reason = content
-            
+
             for line in lines:
                 if line.lower().startswith("risk:"):
                     score = line.split(":", 1)[1].strip()
-                     
+
+            # Only keep real answers, an UNKNOWN should be retried next time
+            if key and score != "UNKNOWN":
+                self.cache.put(key, score, reason, self.model, self.prompt_version)
             return score, reason
-            
+
         except Exception as e:
             return "UNKNOWN", f"Error during LLM analysis: {e}"
 
-    def _build_prompt(self, extension: Extension) -> str:
+    def assess_batch(self, extensions: List[Extension]) -> List[Tuple[str, str]]:
+        # Same answers as calling assess() on each extension, but several extensions
+        # share one request so the system prompt and instructions are only sent once
+        if not self.client:
+            return [self.assess(ext) for ext in extensions]
+
+        results: List[Optional[Tuple[str, str]]] = [None] * len(extensions)
+        todo = []
+        for i, ext in enumerate(extensions):
+            key, cached = self._cached(ext)
+            if cached:
+                ext.verdict_source = "cache"
+                results[i] = cached
+            else:
+                # Built (and counted) once, the same text goes into the batch and any retry on its own
+                todo.append((i, ext, key, self._evidence(ext)))
+
+        for batch in self._pack(todo):
+            answers = {}
+            if len(batch) > 1:
+                try:
+                    exts = [ext for _, ext, _, _ in batch]
+                    prompt = self._build_batch_prompt([evidence for _, _, _, evidence in batch])
+                    answers = self._parse_batch(self._chat(prompt, exts), len(batch))
+                except Exception as e:
+                    print(f"  Batch assessment failed, falling back to one by one: {e}")
+
+            for ref, (i, ext, key, evidence) in enumerate(batch, start=1):
+                answer = answers.get(str(ref))
+                if answer is None:
+                    # Missing or broken entry, so this one gets its own request
+                    results[i] = self._assess_one(ext, key, evidence)
+                    continue
+                results[i] = answer
+                ext.verdict_source = "llm"
+                if key:
+                    self.cache.put(key, answer[0], answer[1], self.model, self.prompt_version)
+        return results
+
+    def cache_stats(self):
+        return dict(self.cache.stats) if self.cache else {}
+
+    def save_cache(self):
+        if self.cache:
+            self.cache.save()
+
+    def _cached(self, extension: Extension):
+        if not self.cache:
+            return None, None
+        key = fingerprint(extension, self.model, self.prompt_version)
+        if self.force:
+            return key, None
+        return key, self.cache.get(key)
+
+    def _chat(self, prompt: str, extensions: List[Extension] = ()) -> str:
+        # Retries (counted on every extension in the request) use jittered backoff,
+        # but never less than the server asked for, and all of it has to fit in the deadline
+        deadline = time.monotonic() + self.deadline if self.deadline else None
+        estimate = estimate_tokens(SYSTEM_PROMPT + prompt) + COMPLETION_ALLOWANCE
+        for attempt in range(self.max_retries + 1):
+            if not self.limiter.acquire(estimate, deadline):
+                raise TimeoutError(f"gave up waiting for the rate limit after {self.deadline:g}s")
+            started = time.perf_counter()
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.0,  # I want consistent answers, not random
+                    **({"timeout": max(1.0, deadline - time.monotonic())} if deadline else {})
+                )
+            except Exception as e:
+                # A failed request may still have counted against the limits, so its tokens stay taken
+                self.limiter.release(estimate)
+                status = getattr(e, "status_code", None)
+                self._record(started, status or type(e).__name__)
+                wait = rate_limit_wait(getattr(getattr(e, "response", None), "headers", None))
+                if status == 429:
+                    self.limiter.throttled(wait)
+                    if self.metrics:
+                        self.metrics.inc("llm_throttled_total", labels={"model": self.model})
+                if attempt == self.max_retries or not _retryable(e):
+                    raise
+                delay = max(wait or 0.0, backoff_delay(attempt, self.backoff_base))
+                if deadline and time.monotonic() + delay > deadline:
+                    raise
+                for ext in extensions:
+                    ext.llm_retries += 1
+                if self.metrics:
+                    self.metrics.inc("llm_retries_total", labels={"model": self.model})
+                time.sleep(delay)
+                continue
+            usage = getattr(response, "usage", None)
+            used = getattr(usage, "total_tokens", None)
+            self.limiter.release(estimate, used if isinstance(used, int) else None)
+            self.limiter.succeeded()
+            self._record(started, "ok", usage)
+            return response.choices[0].message.content
+
+    def _record(self, started: float, outcome, usage=None):
+        if not self.metrics:
+            return
+        labels = {"model": self.model}
+        self.metrics.observe("llm_request_seconds", time.perf_counter() - started, labels)
+        self.metrics.inc("llm_requests_total", labels={"model": self.model, "outcome": outcome})
+        for kind in ("prompt", "completion"):
+            tokens = getattr(usage, f"{kind}_tokens", None)
+            if isinstance(tokens, int):
+                self.metrics.inc("llm_tokens_total", tokens, {"model": self.model, "kind": kind})
+
+    def _pack(self, todo):
+        # Greedily fills batches up to the token budget
+        batches, current, used = [], [], 0
+        for item in todo:
+            cost = estimate_tokens(item[3])
+            if current and used + cost > self.batch_token_budget:
+                batches.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _parse_batch(self, content: str, count: int) -> Dict[str, Tuple[str, str]]:
+        # The model has to give back a JSON array of {"id", "risk", "reason"}.
+        # Anything that doesn't fit exactly is dropped and retried on its own
+        text = content.strip()
+        fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+        if fenced:
+            text = fenced.group(1)
+        data = json.loads(text)
+        if not isinstance(data, list):
+            raise ValueError("expected a JSON array")
+
+        answers: Dict[str, Tuple[str, str]] = {}
+        seen = set()
+        for item in data:
+            if not isinstance(item, dict) or set(item) != {"id", "risk", "reason"}:
+                continue
+            ref = str(item["id"]).strip()
+            risk = item["risk"]
+            reason = item["reason"]
+            if not ref.isdigit() or not 1 <= int(ref) <= count:
+                continue
+            ref = str(int(ref))
+            if not isinstance(risk, str) or risk.strip().capitalize() not in RISK_LEVELS:
+                continue
+            if not isinstance(reason, str) or not reason.strip():
+                continue
+            if ref in seen:
+                # The same id twice means I can't trust either answer
+                answers.pop(ref, None)
+                continue
+            seen.add(ref)
+            risk = risk.strip().capitalize()
+            # Same shape as a single answer so reports look the same either way
+            answers[ref] = (risk, f"Risk: {risk}\nReason: {reason.strip()}")
+        return answers
+
+    def _evidence(self, extension: Extension) -> str:
+        # The compacted evidence, counting what it would have cost uncompacted and
+        # what it costs now so the saving shows up in the metrics. Called once per extension
+        text = compact_evidence(extension, self.prompt_token_budget)
+        if self.metrics:
+            labels = {"model": self.model}
+            self.metrics.inc("llm_prompt_tokens_estimated_total", full_evidence_tokens(extension),
+                             {**labels, "prompt": "full"})
+            self.metrics.inc("llm_prompt_tokens_estimated_total", estimate_tokens(text),
+                             {**labels, "prompt": "compacted"})
+        return text
+
+    def _build_prompt(self, evidence: str) -> str:
         # I build a detailed prompt with all the info I gathered
         return f"""
 Analyze the risk of the following browser extension:
 
-Name: {extension.name}
-ID: {extension.id}
-Version: {extension.version}
-Author: {extension.author}
-Description: {extension.description}
-Permissions: {', '.join(extension.permissions)}
-CSP: {extension.csp}
-Extension Age (Days): {extension.age_days or 'Unknown'}
-Extracted URLs: {', '.join(extension.extracted_urls[:10])} ... ({len(extension.extracted_urls)} total)
-Extracted IPs: {', '.join(extension.extracted_ips[:10])} ... ({len(extension.extracted_ips)} total)
+{evidence}
 
 Determine the Risk Level (Low, Medium, High, Critical) and provide a justification.
 Format your response exactly as follows:
 Risk: <Level>
 Reason: <Short justification summary>
 """
+
+    def _build_batch_prompt(self, evidence: List[str]) -> str:
+        blocks = "\n\n".join(f"[Extension {ref}]\n{text}" for ref, text in enumerate(evidence, start=1))
+        return f"""
+Analyze the risk of each of the following {len(evidence)} browser extensions independently:
+
+{blocks}
+
+For each extension determine the Risk Level (Low, Medium, High, Critical) and provide a short justification.
+Respond with ONLY a JSON array, one object per extension, in this exact format:
+[{{"id": "<extension number>", "risk": "<Level>", "reason": "<Short justification summary>"}}]
+"""
+
+
+def _load_openai():
+    # openai might not be installed
+    try:
+        import openai
+    except ImportError:
+        return None
+    return openai
+
+
+def _retryable(error: Exception) -> bool:
+    # Rate limits, server errors and dropped connections are worth another go,
+    # a bad request or a wrong key isn't. An openai error means openai is already imported
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return False
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUSES
+    return isinstance(error, openai.APIConnectionError)
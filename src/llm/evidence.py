@@ -0,0 +1,307 @@
+import json
+import ipaddress
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from src.models import Extension
+from src.triage.prescore import ALL_HOSTS, PERMISSION_WEIGHTS
+
+# Turns what we know about an extension into the evidence part of the prompt.
+# Dumping the first 10 URLs/IPs (in whatever order they came) and the whole
+# description buried the signal for extensions with thousands of endpoints,
+# and long prompts are slow and cost money for nothing. So the evidence is
+# compacted: URLs grouped by domain with counts, the riskiest and least
+# familiar domains first, CDN/analytics noise left out, permissions and CSP
+# summarised the same way every time, and all of it cut to a token budget.
+
+# ~4 characters per token is close enough for English-ish text (same guess as batching)
+CHARS_PER_TOKEN = 4
+
+# Second-level labels that are really part of the suffix ("example.co.uk" is
+# the registrable domain, not "co.uk"). Not the full public suffix list, just
+# the ones that turn up in extensions
+MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "co.jp", "ne.jp", "or.jp",
+    "co.kr", "or.kr", "com.br", "com.cn", "net.cn", "org.cn", "com.tw", "com.hk", "co.in", "co.nz",
+    "com.mx", "com.tr", "com.ru", "co.za", "com.sg", "com.ua", "github.io", "herokuapp.com",
+    "appspot.com", "blogspot.com", "azurewebsites.net", "cloudfront.net", "workers.dev", "pages.dev",
+    "vercel.app", "netlify.app", "firebaseapp.com", "web.app", "glitch.me", "repl.co",
+}
+
+# Libraries, fonts, analytics and spec URLs that show up in half of all bundles.
+# They say nothing about what the extension does with your data, so they're only
+# counted, unless a threat intel feed flags them. github.com, githubusercontent.com
+# and google.com aren't in here on purpose: raw files, gists and Apps Script are
+# how extensions pull remote code and push data out
+NOISE_DOMAINS = {
+    "googleapis.com", "gstatic.com", "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "googlesyndication.com", "youtube.com", "cloudflare.com", "jsdelivr.net", "unpkg.com",
+    "bootstrapcdn.com", "jquery.com", "fontawesome.com", "typekit.net", "w3.org", "whatwg.org",
+    "mozilla.org", "chromium.org", "chrome.com", "schema.org", "ogp.me", "reactjs.org", "react.dev",
+    "vuejs.org", "angular.io", "npmjs.org", "npmjs.com", "stackoverflow.com", "wikipedia.org", "apache.org", "opensource.org", "sentry.io", "segment.io",
+    "segment.com", "mixpanel.com", "amplitude.com", "hotjar.com", "facebook.net", "example.com",
+    "example.org", "localhost",
+}
+
+# Places that are handy for moving data out without running a server. Matched
+# against the end of the host, since some of them (workers.dev, glitch.me, ...)
+# are also suffixes above and never show up as a registrable domain
+EXFIL_DOMAINS = {
+    "pastebin.com", "hastebin.com", "ngrok.io", "ngrok-free.app", "ngrok.app", "requestbin.net",
+    "pipedream.net", "webhook.site", "discord.com", "discordapp.com", "telegram.org", "t.me",
+    "duckdns.org", "no-ip.com", "ddns.net", "trycloudflare.com", "workers.dev", "glitch.me", "repl.co",
+    "script.google.com", "raw.githubusercontent.com", "gist.githubusercontent.com",
+}
+SUSPICIOUS_TLDS = {"xyz", "top", "tk", "ml", "ga", "cf", "gq", "ru", "cn", "su", "pw", "cc", "click",
+                   "live", "icu", "monster", "rest", "cyou", "buzz", "zip", "mov"}
+CSP_RELAXATIONS = ("'unsafe-eval'", "'unsafe-inline'", "'wasm-unsafe-eval'", "data:", "blob:", "*", "http:")
+
+DESCRIPTION_CHARS = 300
+MAX_EXAMPLE_CHARS = 120
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def registrable_domain(host: str) -> str:
+    # "a.b.example.co.uk" -> "example.co.uk". IPs stay as they are
+    host = host.strip(".").lower()
+    labels = host.split(".")
+    if len(labels) <= 2 or _is_ip(host):
+        return host
+    if ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _host(url: str) -> str:
+    try:
+        return (urlsplit(url).hostname or "").strip(".").lower()
+    except ValueError:
+        return ""
+
+
+def is_exfil_host(host: str) -> bool:
+    # "abc.workers.dev" and "workers.dev" both count, "notworkers.dev" doesn't
+    labels = host.split(".")
+    return any(".".join(labels[i:]) in EXFIL_DOMAINS for i in range(len(labels)))
+
+
+def _is_ip(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value.strip("[]"))
+    except ValueError:
+        return False
+    return True
+
+
+def _is_public_ip(value: str) -> bool:
+    try:
+        return ipaddress.ip_address(value.strip("[]")).is_global
+    except ValueError:
+        return False
+
+
+@dataclass
+class DomainGroup:
+    domain: str
+    urls: int = 0
+    example: str = ""
+    score: int = 0
+    # Why it ranked where it did, shown to the LLM as well
+    flags: Tuple[str, ...] = ()
+
+
+def _flags(domain: str, urls: List[str], flagged: bool) -> Tuple[int, Tuple[str, ...]]:
+    score, flags = 0, []
+    if flagged:
+        score += 100
+        flags.append("on threat intel feed")
+    if _is_ip(domain):
+        if _is_public_ip(domain):
+            score += 30
+            flags.append("raw public IP")
+    elif domain.rsplit(".", 1)[-1] in SUSPICIOUS_TLDS:
+        score += 15
+        flags.append("suspicious TLD")
+    if any(is_exfil_host(_host(url)) for url in urls):
+        score += 25
+        flags.append("paste/webhook/tunnel service")
+    if any(label.startswith("xn--") for label in domain.split(".")):
+        score += 10
+        flags.append("punycode")
+    if any(url.startswith("http://") for url in urls):
+        score += 10
+        flags.append("plain http")
+    if any(_port(url) for url in urls):
+        score += 10
+        flags.append("non-standard port")
+    # Unfamiliar domains beat familiar ones, and a domain used once or twice is
+    # more likely to be "the" backend than one with hundreds of asset URLs
+    if domain not in NOISE_DOMAINS:
+        score += 5 if len(urls) <= 3 else 2
+    return score, tuple(flags)
+
+
+def _port(url: str) -> Optional[int]:
+    try:
+        port = urlsplit(url).port
+    except ValueError:
+        return None
+    return port if port not in (None, 80, 443) else None
+
+
+def group_urls(urls: List[str], flagged: set) -> Tuple[List[DomainGroup], int]:
+    # Domain groups, riskiest first, plus how many noise URLs were left out
+    by_domain: Dict[str, List[str]] = {}
+    for url in urls:
+        host = _host(url)
+        by_domain.setdefault(registrable_domain(host) if host else "(unparsed)", []).append(url)
+
+    groups, noise = [], 0
+    for domain, members in by_domain.items():
+        hit = any(url in flagged for url in members)
+        if domain in NOISE_DOMAINS and not hit:
+            noise += len(members)
+            continue
+        score, flags = _flags(domain, members, hit)
+        # The example is a flagged URL if there is one, else the shortest (usually the most telling)
+        example = min((u for u in members if u in flagged), default=None, key=len) or min(members, key=len)
+        groups.append(DomainGroup(domain, len(members), example[:MAX_EXAMPLE_CHARS], score, flags))
+    groups.sort(key=lambda g: (-g.score, g.domain))
+    return groups, noise
+
+
+def summarise_permissions(extension: Extension) -> Tuple[str, str]:
+    # The same permissions always come out the same way, sensitive ones first
+    api, hosts = set(), set()
+    for perm in extension.permissions or []:
+        perm = str(perm)
+        (hosts if "://" in perm or perm == "<all_urls>" else api).add(perm)
+    hosts.update(extension.host_permissions)
+    hosts.update(extension.content_script_matches)
+
+    sensitive = sorted((p for p in api if PERMISSION_WEIGHTS.get(p)), key=lambda p: (-PERMISSION_WEIGHTS[p], p))
+    other = sorted(p for p in api if not PERMISSION_WEIGHTS.get(p))
+    parts = []
+    if sensitive:
+        parts.append("sensitive: " + ", ".join(sensitive))
+    if other:
+        parts.append("other: " + ", ".join(other))
+    permissions = "; ".join(parts) or "none"
+
+    if any(h in ALL_HOSTS for h in hosts):
+        host_access = "all sites"
+    elif hosts:
+        shown = sorted(hosts)[:8]
+        host_access = ", ".join(shown) + (f" (+{len(hosts) - len(shown)} more)" if len(hosts) > len(shown) else "")
+    else:
+        host_access = "none"
+    return permissions, host_access
+
+
+def summarise_csp(csp: str) -> str:
+    # MV3 puts the CSP in a dict (stored as JSON), MV2 has one string.
+    # Directives come out sorted with duplicate sources dropped, relaxations called out
+    if not csp:
+        return "not set (browser default)"
+    policies = [csp]
+    try:
+        data = json.loads(csp)
+        if isinstance(data, dict):
+            policies = [str(v) for _, v in sorted(data.items())]
+    except ValueError:
+        pass
+
+    directives: Dict[str, List[str]] = {}
+    for policy in policies:
+        for directive in policy.split(";"):
+            tokens = directive.split()
+            if tokens:
+                sources = directives.setdefault(tokens[0].lower(), [])
+                sources.extend(t for t in tokens[1:] if t not in sources)
+    text = "; ".join(f"{name} {' '.join(sources)}".strip() for name, sources in sorted(directives.items()))
+    relaxed = sorted({t for sources in directives.values() for t in sources if t in CSP_RELAXATIONS})
+    if relaxed:
+        text += f" [relaxed: {', '.join(relaxed)}]"
+    return text
+
+
+def _describe_intel(extension: Extension) -> str:
+    # Every hit goes in, they're rare and they're the most important thing to see
+    if not extension.intel_hits:
+        return "None"
+    return "; ".join(f"{hit['endpoint']} ({hit['rule']} on {', '.join(hit['feeds'])})" for hit in extension.intel_hits)
+
+
+def full_evidence_tokens(extension: Extension) -> int:
+    # Roughly what the evidence would cost with every endpoint and the whole
+    # description in it, without building that string
+    chars = len(extension.description or "") + len(extension.csp or "")
+    chars += sum(len(str(p)) + 2 for p in extension.permissions or [])
+    chars += sum(len(u) + 2 for u in extension.extracted_urls) + sum(len(ip) + 2 for ip in extension.extracted_ips)
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def compact_evidence(extension: Extension, token_budget: int = 1200) -> str:
+    # The facts that always go in come first, then domains and IPs (riskiest
+    # first) until the budget runs out, then a line saying what was left out
+    flagged = {hit["endpoint"] for hit in extension.intel_hits}
+    permissions, host_access = summarise_permissions(extension)
+    description = " ".join((extension.description or "").split())
+    if len(description) > DESCRIPTION_CHARS:
+        description = description[:DESCRIPTION_CHARS].rsplit(" ", 1)[0] + " ..."
+
+    header = f"""Name: {extension.name}
+ID: {extension.id}
+Version: {extension.version}
+Author: {extension.author}
+Description: {description}
+Permissions: {permissions}
+Host Access: {host_access}
+CSP: {summarise_csp(extension.csp)}
+Extension Age (Days): {extension.age_days or 'Unknown'}
+Threat Intel Matches: {_describe_intel(extension)}"""
+
+    groups, noise = group_urls(list(extension.extracted_urls), flagged)
+    ips = sorted(extension.extracted_ips, key=lambda ip: (ip not in flagged, not _is_public_ip(ip), ip))
+    summary = (f"Endpoints: {len(extension.extracted_urls)} URLs on {len(groups)} domains, "
+               f"{len(ips)} IPs; {noise} CDN/analytics URLs not listed")
+    if extension.scan_truncated:
+        summary += " (scan was cut short, there may be more)"
+
+    # Room is kept for the "... more" line, and a quarter of what's left for IPs
+    # so thousands of domains can't crowd them out (unused room goes back to the IPs)
+    budget = token_budget * CHARS_PER_TOKEN - len(header) - len(summary) - 80
+    domain_budget = budget * 3 // 4 if ips else budget
+    lines, shown_domains = [], 0
+    for group in groups:
+        line = f"- {group.domain} ({group.urls} URL{'s' if group.urls != 1 else ''}"
+        line += f"; {', '.join(group.flags)}" if group.flags else ""
+        line += f") e.g. {group.example}"
+        if len(line) + 1 > domain_budget and shown_domains:
+            break
+        lines.append(line)
+        domain_budget -= len(line) + 1
+        budget -= len(line) + 1
+        shown_domains += 1
+
+    shown_ips = []
+    for ip in ips:
+        text = ip + (" (on threat intel feed)" if ip in flagged else "" if _is_public_ip(ip) else " (private)")
+        if len(text) + 2 > budget and shown_ips:
+            break
+        shown_ips.append(text)
+        budget -= len(text) + 2
+    if shown_ips:
+        lines.append("- IPs: " + ", ".join(shown_ips))
+
+    left_out = []
+    if shown_domains < len(groups):
+        left_out.append(f"{len(groups) - shown_domains} lower-ranked domains")
+    if len(shown_ips) < len(ips):
+        left_out.append(f"{len(ips) - len(shown_ips)} IPs")
+    if left_out:
+        lines.append(f"- ... and {' and '.join(left_out)} not shown")
+    return "\n".join([header, summary] + lines)
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+from src.models import Extension
+
+# The LLM call is the slowest and most expensive step, and the answer only
+# depends on what we send it. So I remember each verdict under a fingerprint of
+# the inputs and reuse it until any of those inputs (or the model/prompt) change.
+def fingerprint(extension: Extension, model: str, prompt_version: str) -> str:
+    inputs = {
+        "id": extension.id,
+        "version": extension.version,
+        "permissions": sorted(str(p) for p in extension.permissions),
+        "csp": extension.csp or "",
+        "urls": sorted(extension.extracted_urls),
+        "ips": sorted(extension.extracted_ips),
+        # A feed update can change the hits without the extension changing
+        "intel": sorted(f"{hit['endpoint']} {','.join(hit['feeds'])}" for hit in extension.intel_hits),
+        "model": model,
+        "prompt_version": prompt_version,
+    }
+    # sort_keys + fixed separators so the same inputs always hash the same
+    canonical = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    def __init__(self, path: str, max_age_seconds: Optional[float] = None):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"hits": 0, "misses": 0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable verdict cache {self.path}: {e}")
+            self._entries = {}
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return self.max_age_seconds is not None and time.time() - entry.get("created_at", 0) > self.max_age_seconds
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not self._expired(entry):
+                self.stats["hits"] += 1
+                return entry["risk_score"], entry["risk_summary"]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, risk_score: str, risk_summary: str, model: str, prompt_version: str):
+        with self._lock:
+            self._entries[key] = {
+                "risk_score": risk_score,
+                "risk_summary": risk_summary,
+                "model": model,
+                "prompt_version": prompt_version,
+                "created_at": time.time(),
+            }
+            self._dirty = True
+
+    def save(self):
+        # The model and prompt version are part of the fingerprint, so verdicts from
+        # another model never get mixed in and can stay around for when someone
+        # switches back. Only age throws entries out
+        with self._lock:
+            for key in list(self._entries):
+                if self._expired(self._entries[key]):
+                    del self._entries[key]
+                    self._dirty = True
+            if not self._dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
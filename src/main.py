@@ -1,5 +1,10 @@
 import sys
 import os
+import time
+import uuid
+import signal
+import socket
+import threading
 import json
 import argparse
 from datetime import datetime
@@ -10,85 +15,400 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 sys.path.append(os.getcwd())
 
-# Importing all my modules
-from src.discovery.manager import DiscoveryManager
-from src.enrichment.meta_client import EnrichmentClient
-from src.threat_intel.scanner import StaticScanner
-from src.llm.assessor import RiskAssessor
-from src.models import Extension, RiskReport
+# Importing all my modules. Only the light ones are imported up here, the rest
+# are imported by the command that needs them so "--help" or an inventory doesn't
+# wait for requests/openai to load (python -X importtime src/main.py --help shows it)
+from src.discovery.manager import DiscoveryManager, parse_root
+from src.discovery.dedup import InstallGroups
+from src.models import Extension
+from src.report import NdjsonReportWriter, json_report, resolve_fields, write_json_report
+from src.metrics import Metrics, RunProfiler
 
-def main():
-    # Setting up command line arguments
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bera")
+
+# These are the things you can ask BERA to do. If you don't name one, I assume "run"
+# so the old "python src/main.py --output report.json" still works
+COMMANDS = ("run", "inventory", "scan", "assess", "watch", "diff", "query", "compact-index", "compile-intel")
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="BERA Agent - Browser Extension Risk Assessment")
-    parser.add_argument("--output", help="Path to save the JSON report", default="report.json")
-    args = parser.parse_args()
+    commands = parser.add_subparsers(dest="command")
+
+    # run and watch share every analysis option
+    run = argparse.ArgumentParser(add_help=False)
+    run.add_argument("--output", help="Path to save the JSON report", default="report.json")
+    run.add_argument("--format", choices=("json", "ndjson"), default="json",
+                     help="json: one report at the end. ndjson: one line per extension as soon as it's done")
+    run.add_argument("--gzip", action="store_true", help="Gzip the NDJSON report")
+    run.add_argument("--fields", help="Comma separated extension fields to write, or 'all' (NDJSON leaves out manifest_content by default)")
+    run.add_argument("--no-summary", action="store_true", help="Don't write the summary line at the end of an NDJSON report")
+    run.add_argument("--resume", metavar="PATH", help="Carry on an interrupted NDJSON report, skipping extensions already in it")
+    run.add_argument("--metrics-textfile", metavar="PATH",
+                     help="Also write the run's metrics in Prometheus text format (for node_exporter's textfile collector)")
+    run.add_argument("--profile", metavar="PATH", help="Profile the whole run with cProfile and save the stats to PATH")
+    run.add_argument("--root", action="append", metavar="[BROWSER=]PATH",
+                     help="Look for extensions under PATH (an Extensions folder, a profile, User Data, a home folder "
+                          "or a whole machine snapshot). Repeat for more roots")
+    run.add_argument("--archive", action="append", metavar="PATH",
+                     help="Also scan packed extensions: a .crx/.zip file or a folder of them, read in place without "
+                          "unpacking. Without --root only the archives are scanned. Repeat for more")
+    run.add_argument("--archive-max-ratio", type=float, default=100,
+                     help="Skip archive members (over 1 MB) that inflate more than N times over, as zip bombs")
+    run.add_argument("--discovery-workers", type=int, default=8, help="Threads used to read profiles during discovery")
+    run.add_argument("--no-dedup", action="store_true", help="Analyse every install separately, even identical copies")
+    run.add_argument("--workers", type=int, default=4, help="Default number of workers for every pipeline stage")
+    run.add_argument("--enrich-workers", type=int, help="Workers for web store enrichment (defaults to --workers)")
+    run.add_argument("--scan-workers", type=int, help="Workers for static scanning (defaults to --workers, capped at CPU count)")
+    run.add_argument("--assess-workers", type=int, help="Workers for LLM assessment (defaults to --workers or --llm-in-flight, whichever is more)")
+    run.add_argument("--enrich-rps", type=float, default=5.0, help="Max web store requests per second (token bucket)")
+    run.add_argument("--enrich-per-host", type=int, default=4, help="Max concurrent requests to a single web store")
+    run.add_argument("--enrich-budget", type=float, help="Total seconds enrichment is allowed to take for the whole run")
+    run.add_argument("--cws-url", help="Chrome Web Store detail URL template with {id} (for mirrors and testing)")
+    run.add_argument("--amo-url", help="addons.mozilla.org API URL template with {id} (for mirrors and testing)")
+    run.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Where BERA keeps its caches between runs")
+    run.add_argument("--enrichment-ttl", type=float, default=24, help="Hours before cached web store data is revalidated")
+    run.add_argument("--refresh-enrichment", action="store_true", help="Ignore cached web store data and fetch everything again")
+    run.add_argument("--rescan", action="store_true", help="Read every file again instead of trusting the scan index")
+    run.add_argument("--llm-base-url", help="Use any OpenAI-compatible endpoint instead of Groq/OpenAI")
+    run.add_argument("--llm-model", help="Model name to ask (defaults to the provider's default)")
+    run.add_argument("--llm-in-flight", type=int, default=4, help="Max LLM requests in flight at once")
+    run.add_argument("--llm-rpm", type=float, default=0, help="LLM requests per minute allowed by your plan (0 = no limit)")
+    run.add_argument("--llm-tpm", type=float, default=0, help="LLM tokens per minute allowed by your plan (0 = no limit)")
+    run.add_argument("--llm-retries", type=int, default=4, help="Retries for rate limited or failed LLM requests")
+    run.add_argument("--llm-deadline", type=float, default=300,
+                     help="Seconds one LLM request may take, rate limit waits and retries included (0 = no limit)")
+    run.add_argument("--assess-batch", type=int, default=1, help="Assess up to N extensions per LLM request")
+    run.add_argument("--assess-batch-tokens", type=int, default=6000, help="Approximate prompt token budget for one batched request")
+    run.add_argument("--prompt-tokens", type=int, default=1200,
+                     help="Approximate token budget for one extension's evidence in the prompt (riskiest endpoints first)")
+    run.add_argument("--triage-low", type=int, default=10, help="Pre-scores at or below this are called Low without the LLM")
+    run.add_argument("--triage-high", type=int, default=90, help="Pre-scores at or above this are called High without the LLM")
+    run.add_argument("--no-triage", action="store_true", help="Send every extension to the LLM")
+    run.add_argument("--verdict-max-age", type=float, default=30, help="Days a cached LLM verdict stays valid (0 = forever)")
+    run.add_argument("--reassess", action="store_true", help="Ask the LLM again even if a cached verdict exists")
+    run.add_argument("--scan-processes", type=int, default=0, help="Scan files in a pool of N processes to use more than one core")
+    run.add_argument("--max-file-mb", type=float, default=32, help="Only scan the first N MB of each file (0 = no limit)")
+    run.add_argument("--max-extension-mb", type=float, default=256, help="Stop scanning an extension after N MB (0 = no limit)")
+    run.add_argument("--store", metavar="PATH", help="SQLite results store (defaults to results.db in --cache-dir)")
+    run.add_argument("--no-store", action="store_true", help="Don't record this run in the results store")
+    run.add_argument("--host", default=socket.gethostname(), help="Machine name this run is recorded under in the results store")
+    run.add_argument("--offline", action="store_true",
+                     help="Never touch the network: no web store lookups, and only cached LLM verdicts")
+    run.add_argument("--intel", metavar="PATH", help="Compiled threat intel file (defaults to intel.bin in --cache-dir if it exists)")
+
+    commands.add_parser("run", parents=[run], help="Discover, enrich, scan and assess extensions (the default)")
+    commands.add_parser("inventory", parents=[run], help="Only list the installed extensions, nothing is analysed")
+    commands.add_parser("scan", parents=[run], help="Scan and pre-score extensions locally, without the web stores or the LLM")
+    commands.add_parser("assess", parents=[run], help="Scan, pre-score and ask the LLM, without the web stores")
+
+    watch = commands.add_parser("watch", parents=[run],
+                                help="Keep running and only re-assess extensions that are installed, updated or removed")
+    watch.add_argument("--debounce", type=float, default=2.0, help="Seconds to wait for a burst of changes to settle")
+    watch.add_argument("--polling", action="store_true", help="Poll for changes instead of using inotify")
+    watch.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between polls when polling")
+    watch.add_argument("--rediscover-minutes", type=float, default=60,
+                       help="Run a full discovery this often to pick up new profiles (0 = never)")
+
+    # diff and query only read the results store
+    stored = argparse.ArgumentParser(add_help=False)
+    stored.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Where BERA keeps its caches between runs")
+    stored.add_argument("--store", metavar="PATH", help="SQLite results store (defaults to results.db in --cache-dir)")
+    stored.add_argument("--host", help="Only this machine")
+    stored.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+
+    diff = commands.add_parser("diff", parents=[stored], help="What changed between two runs (by default the last two)")
+    diff.add_argument("--from", dest="from_run", metavar="RUN_ID", help="The older run (defaults to the run before --to)")
+    diff.add_argument("--to", dest="to_run", metavar="RUN_ID", help="The newer run (defaults to the latest run)")
+
+    query = commands.add_parser("query", parents=[stored], help="Find installs in the results store")
+    query.add_argument("--id", dest="ext_id", help="Extension ID")
+    query.add_argument("--name", help="Part of the extension name")
+    query.add_argument("--risk", nargs="+", metavar="LEVEL", help="Only these risk levels (Low, Medium, High, Critical)")
+    query.add_argument("--endpoint", help="Domain (subdomains included) or IP the extension talks to")
+    query.add_argument("--all-runs", action="store_true", help="Search every run, not just each host's latest one with verdicts")
+    query.add_argument("--limit", type=int, default=200, help="Max rows (0 = no limit)")
+
+    compact = commands.add_parser("compact-index", help="Drop scan index entries for extension versions that were uninstalled")
+    compact.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Where BERA keeps its caches between runs")
+
+    intel = commands.add_parser("compile-intel", help="Compile threat intel feeds (domains, suffix rules, IPs/CIDRs) for fast lookups")
+    intel.add_argument("--feed", action="append", required=True, metavar="[NAME=]PATH",
+                       help="A feed file: domains, hosts file, adblock ||domain^ rules, *.suffix rules, URLs, IPs or CIDRs. Repeat for more feeds")
+    intel.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Where BERA keeps its caches between runs")
+    intel.add_argument("--output", help="Where to write the compiled file (defaults to intel.bin in --cache-dir)")
+
+    return parser
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help")):
+        argv.insert(0, "run")
+    args = build_parser().parse_args(argv)
+
+    if args.command == "compact-index":
+        return compact_index(args)
+    if args.command == "compile-intel":
+        return compile_intel(args)
+    if args.command == "diff":
+        return run_diff(args)
+    if args.command == "query":
+        return run_query(args)
+    command = run_watch if args.command == "watch" else run_scan
+    if args.profile:
+        with RunProfiler() as profiler:
+            result = command(args)
+        profiler.dump(args.profile)
+        return result
+    return command(args)
+
+def compact_index(args):
+    from src.threat_intel.scan_index import ScanIndex
+    index = ScanIndex(os.path.join(args.cache_dir, "scan_index.json"))
+    versions, files = index.compact()
+    index.save()
+    print(f"Removed {versions} uninstalled extension versions and {files} missing files from the scan index.")
+
+def open_store(args):
+    from src.store import ResultsStore
+    return ResultsStore(args.store or os.path.join(args.cache_dir, "results.db"))
+
+def print_table(rows, columns):
+    # Plain aligned columns, wide enough for the longest value
+    widths = [max([len(column)] + [len(str(row.get(column) or "-")) for row in rows]) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)).rstrip())
+    for row in rows:
+        print("  ".join(str(row.get(column) or "-").ljust(width) for column, width in zip(columns, widths)).rstrip())
+
+def run_diff(args):
+    store = open_store(args)
+    try:
+        to_run = args.to_run
+        if not to_run:
+            latest = store.runs(host=args.host, limit=1)
+            if not latest:
+                print("The results store has no runs yet")
+                return 1
+            to_run = latest[0]["run_id"]
+        from_run = args.from_run or store.previous_run(to_run)
+        if not from_run:
+            print(f"There's no earlier run to compare {to_run} with")
+            return 1
+        changes = store.diff(from_run, to_run)
+    finally:
+        store.close()
+
+    if args.json:
+        print(json.dumps({"from": from_run, "to": to_run, **changes}, indent=2))
+        return
+    print(f"Changes from run {from_run} to {to_run}:")
+    for kind, columns in (("added", ["id", "name", "version", "risk_score", "location"]),
+                          ("removed", ["id", "name", "version", "location"]),
+                          ("updated", ["id", "name", "old_version", "version", "old_risk_score", "risk_score", "location"]),
+                          ("risk_changed", ["id", "name", "version", "old_risk_score", "risk_score", "location"])):
+        print(f"\n{kind.replace('_', ' ').capitalize()} ({len(changes[kind])})")
+        if changes[kind]:
+            print_table(changes[kind], columns)
+
+def run_query(args):
+    store = open_store(args)
+    try:
+        rows = store.query(ext_id=args.ext_id, name=args.name, risks=args.risk, endpoint=args.endpoint,
+                           host=args.host, all_runs=args.all_runs, limit=args.limit or None)
+    finally:
+        store.close()
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print_table(rows, ["host", "run_id", "browser", "profile", "ext_id", "name", "version", "risk_score"])
+    print(f"\n{len(rows)} installs")
+
+def compile_intel(args):
+    from src.threat_intel.intel import compile_feeds
+    feeds = []
+    for spec in args.feed:
+        name, _, path = spec.rpartition("=")
+        if not os.path.isfile(path):
+            print(f"Feed {path} doesn't exist")
+            return 2
+        feeds.append((name or os.path.splitext(os.path.basename(path))[0], path))
+    output = args.output or os.path.join(args.cache_dir, "intel.bin")
+    start = time.time()
+    header = compile_feeds(feeds, output)
+    for feed in header["feeds"]:
+        print(f"  {feed['name']}: {feed['indicators']} indicators ({feed['skipped']} lines not understood)")
+    counts = header["counts"]
+    print(f"Compiled {counts['domains']} domain rules, {counts['v4_ranges']} IPv4 and {counts['v6_ranges']} IPv6 ranges "
+          f"to {output} in {time.time() - start:.1f}s.")
+
+def run_watch(args):
+    if args.format != "json" or args.resume:
+        print("watch keeps a JSON report up to date, so --format ndjson and --resume don't apply")
+        return 2
+    from src.watch import WatchSession
+    session = WatchSession(args)
+    stop = threading.Event()
+    # Stop cleanly (caches saved) when the service manager asks
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        session.run(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.close()
+    print("Stopped watching.")
+
+def output_path_for(output: str, run_id: str, extension: str) -> str:
+    # If they used the default name, I add the run ID to make it unique
+    if output == "report.json" or output == "/app/output/report.json":
+        directory = os.path.dirname(output)
+        filename = f"report_{run_id}{extension}"
+        return os.path.join(directory, filename) if directory else filename
+    return output
+
+def run_scan(args):
+    # Generate a unique run ID so I don't overwrite old reports
+    run_id = uuid.uuid4().hex[:8]
+    timestamp = datetime.now().isoformat()
+
+    streaming = args.format == "ndjson" or bool(args.resume)
+    try:
+        fields = resolve_fields(args.fields, slim=streaming)
+    except ValueError as e:
+        print(e)
+        return 2
+
+    # In streaming mode every finished extension is written straight away,
+    # and --resume picks up a report that was cut short
+    writer = None
+    if streaming:
+        output_path = args.resume or output_path_for(args.output, run_id, ".ndjson.gz" if args.gzip else ".ndjson")
+        writer = NdjsonReportWriter(output_path, run_id, timestamp, fields).open(resume=bool(args.resume))
+        run_id, timestamp = writer.run_id, writer.timestamp
+
+    # Everything that does real work records into this, and it ends up in the report
+    metrics = Metrics()
+    phase_started = time.perf_counter()
+
+    def end_phase(name: str):
+        nonlocal phase_started
+        now = time.perf_counter()
+        metrics.set("run_phase_seconds", round(now - phase_started, 4), {"phase": name})
+        phase_started = now
 
     # Step 1: Find all the extensions on the system
     print("Step 1: Discovery...")
-    manager = DiscoveryManager()
+    roots = [parse_root(root) for root in args.root] if args.root else None
+    # With only --archive given, the installed browsers are left alone
+    manager = DiscoveryManager([] if args.archive and not roots else roots, workers=args.discovery_workers)
     extensions = manager.run_discovery()
+    for root, timing in manager.timings.items():
+        print(f"  {root}: {timing['extensions']} extensions in {timing['profiles']} profiles ({timing['seconds']:.2f}s)")
+        metrics.set("discovery_root_seconds", round(timing["seconds"], 4), {"root": root})
+    if args.archive:
+        from src.discovery.archive import ArchiveDiscovery
+        started = time.perf_counter()
+        packed = ArchiveDiscovery(args.archive).scan()
+        extensions.extend(packed)
+        seconds = time.perf_counter() - started
+        print(f"  archives: {len(packed)} extensions ({seconds:.2f}s)")
+        metrics.set("discovery_root_seconds", round(seconds, 4), {"root": "archives"})
+    end_phase("discovery")
     print(f"  -> Found {len(extensions)} extensions.")
+    if writer and writer.done_keys:
+        before = len(extensions)
+        extensions = [ext for ext in extensions if not writer.is_done(ext)]
+        print(f"  -> {before - len(extensions)} already in {writer.path}, resuming with {len(extensions)}.")
 
     # Creating instances of my other modules
-    enricher = EnrichmentClient()
-    scanner = StaticScanner()
-    assessor = RiskAssessor()
-
-    processed_extensions = []
-
-    # Step 2: Process each extension through my pipeline
-    print("Step 2: Analysis (Enrichment + Threat Intel)...")
-    for ext in extensions:
-        print(f"  Processing: {ext.name} ({ext.id})")
-        
-        # Try to get more info from web stores
-        enricher.enrich(ext)
-        
-        # Scan for suspicious URLs and IPs
-        scanner.scan_extension(ext)
-        
-        # Ask the AI what it thinks
-        score, reason = assessor.assess(ext)
-        ext.risk_score = score
-        ext.risk_summary = reason
-        
-        processed_extensions.append(ext)
+    # Every run goes into the results store too (for diff and query), and it
+    # remembers verdicts so versions seen before don't need the LLM again
+    store = None if args.no_store else open_store(args)
 
-    # Generate a unique run ID so I don't overwrite old reports
-    import uuid
-    run_id = uuid.uuid4().hex[:8]
-    timestamp = datetime.now().isoformat()
-    
-    # Create my final report
-    report = RiskReport(
-        run_id=run_id,
-        timestamp=timestamp,
-        total_extensions=len(processed_extensions),
-        high_risk_count=0,  # TODO: I should actually count these
-        extensions=processed_extensions
-    )
-    
-    # Convert to a dictionary so I can save it as JSON
-    report_dict = {
-        "run_id": report.run_id,
-        "timestamp": report.timestamp,
-        "total": report.total_extensions,
-        "extensions": [e.__dict__ for e in report.extensions]
+    from src.analysis import Analyzer
+    analyzer = Analyzer(args, metrics, store=store)
+    end_phase("setup")
+
+    # The same extension version is often installed in lots of profiles and browsers.
+    # Copies with identical bytes are analysed once and the results copied to the rest.
+    # Digests of files that haven't changed come out of the scan index.
+    # An inventory has no stages, so there's nothing to save by hashing every file
+    dedup = bool(analyzer.stages) and not args.no_dedup
+    groups = InstallGroups(extensions, workers=args.discovery_workers, index=analyzer.index)
+    unique = extensions
+    if dedup:
+        unique = groups.build()
+        print(f"  -> {len(unique)} unique extension versions to analyse.")
+    end_phase("dedup")
+
+    def report_progress(ext: Extension):
+        print(f"  Done: {ext.name} ({ext.id}) -> {ext.risk_score}")
+        for install in groups.fan_out(ext):
+            if writer:
+                writer.write(install)
+
+    # Step 2: Push every extension through my pipeline
+    pipeline = analyzer.pipeline(on_result=report_progress)
+
+    print(f"Step 2: Analysis ({' + '.join(analyzer.stages) or 'nothing, inventory only'})...")
+    pipeline.run(unique)
+    end_phase("analysis")
+    compaction = metrics.snapshot()["counters"].get("llm_prompt_tokens_estimated_total", {})
+    full = sum(v for k, v in compaction.items() if "prompt=full" in k)
+    compacted = sum(v for k, v in compaction.items() if "prompt=compacted" in k)
+    if full:
+        print(f"  Prompt evidence: ~{full:,.0f} tokens compacted to ~{compacted:,.0f} ({1 - compacted / full:.0%} smaller)")
+    # Every install is in the report, not just the ones that went through the pipeline
+    processed_extensions = extensions
+    analyzer.close()
+    analyzer.save()
+    end_phase("save_caches")
+    metrics.set("extensions", len(processed_extensions), {"kind": "installs"})
+    metrics.set("extensions", len(unique), {"kind": "analysed"})
+
+    run_stats = {
+        **analyzer.cache_stats(),
+        "dedup": groups.stats() if dedup else {},
+        "metrics": metrics.snapshot(),
+        "errors": [
+            {"id": ext_id, "stage": stage, "error": message}
+            for ext_id, stage, message in pipeline.errors
+        ]
     }
-    
-    # Figure out the output filename
-    # If they used the default name, I add the run ID to make it unique
-    output_path = args.output
-    if args.output == "report.json" or args.output == "/app/output/report.json":
-        directory = os.path.dirname(args.output)
-        filename = f"report_{run_id}.json"
-        output_path = os.path.join(directory, filename) if directory else filename
-
-    # Save the report!
-    with open(output_path, "w", encoding='utf-8') as f:
-        json.dump(report_dict, f, indent=2, default=str)
-        
+
+    if store:
+        from src.llm.assessor import PROMPT_VERSION
+        from src.store import RECORDED_FIELDS
+        # A resumed run only analysed what was left, the rest comes back from the report.
+        # Recording just the remainder would make diff call everything else "removed"
+        recorded = processed_extensions + (writer.resumed if writer else [])
+        missing = [name for name in RECORDED_FIELDS if writer and writer.resumed and writer.fields is not None
+                   and name not in writer.fields]
+        if missing:
+            print(f"Not recording the resumed run in {store.path}, the report has no {', '.join(missing)}")
+        else:
+            assessor = analyzer.assessor
+            store.record_run(run_id, args.host, timestamp, args.command or "run", recorded, run_stats,
+                             model=assessor.model if assessor else None,
+                             prompt_version=assessor.prompt_version if assessor else PROMPT_VERSION)
+            print(f"Results recorded in {store.path}")
+        store.close()
+
+    if args.metrics_textfile:
+        metrics.write_textfile(args.metrics_textfile)
+        print(f"Metrics saved to {args.metrics_textfile}")
+
+    if writer:
+        # The summary line at the end also covers extensions from before a --resume
+        if not args.no_summary:
+            writer.write_summary(run_stats)
+        writer.close()
+        print(f"\nReport saved to {writer.path} (Run ID: {run_id})")
+        return
+
+    # Figure out the output filename and save the report!
+    output_path = output_path_for(args.output, run_id, ".json")
+    write_json_report(output_path, json_report(run_id, timestamp, processed_extensions, run_stats, fields))
     print(f"\nReport saved to {output_path} (Run ID: {run_id})")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Counters, gauges and histograms for finding out where a run spends its time.
+# Every module that does real work takes an optional Metrics object (like the
+# caches) and records into it. At the end main() puts a snapshot in the report
+# and can write the same numbers as a Prometheus textfile.
+
+# Seconds. Covers a fast local file (ms) up to a slow LLM call (a minute)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, object]]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in (labels or {}).items()))
+
+
+def _label_text(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+
+def _prometheus_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> List[int]:
+        # Prometheus buckets count everything at or below the bound
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class Metrics:
+    def __init__(self, prefix: str = "bera"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, object]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, object]] = None):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, object]] = None,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, object]] = None):
+        # with metrics.timer("stage_seconds", {"stage": "scan"}): ...
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def snapshot(self) -> Dict:
+        # Plain dicts for the JSON report. Series are keyed by "label=value,..." ("" without labels)
+        with self._lock:
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = {
+                    _label_text(labels): {
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "min": round(h.min, 6) if h.min is not None else None,
+                        "max": round(h.max, 6) if h.max is not None else None,
+                        "mean": round(h.sum / h.count, 6) if h.count else None,
+                        "buckets": {str(bound): count for bound, count in zip(h.buckets, h.cumulative())},
+                    }
+                    for labels, h in sorted(series.items())
+                }
+            return {
+                "counters": {name: {_label_text(labels): value for labels, value in sorted(series.items())}
+                             for name, series in sorted(self._counters.items())},
+                "gauges": {name: {_label_text(labels): value for labels, value in sorted(series.items())}
+                           for name, series in sorted(self._gauges.items())},
+                "histograms": dict(sorted(histograms.items())),
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(metrics.items()):
+                    full = f"{self.prefix}_{name}"
+                    lines.append(f"# TYPE {full} {kind}")
+                    for labels, value in sorted(series.items()):
+                        lines.append(f"{full}{_prometheus_labels(labels)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                full = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {full} histogram")
+                for labels, h in sorted(series.items()):
+                    for bound, count in zip(h.buckets, h.cumulative()):
+                        lines.append(f"{full}_bucket{_prometheus_labels(labels, ('le', str(bound)))} {count}")
+                    lines.append(f"{full}_bucket{_prometheus_labels(labels, ('le', '+Inf'))} {h.count}")
+                    lines.append(f"{full}_sum{_prometheus_labels(labels)} {h.sum}")
+                    lines.append(f"{full}_count{_prometheus_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        # The node_exporter textfile collector can read the file at any moment,
+        # so it's written to a temp file and swapped in
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+class RunProfiler:
+    # cProfile only sees the thread that turned it on (before Python 3.12), but most
+    # of a run happens in the pipeline's thread pools. So every thread started while
+    # this is active gets its own profiler, and they're all merged at the end.
+    # From 3.12 cProfile sees every thread by itself, and a second one can't be on at once.
+    # Work done in --scan-processes worker processes isn't included.
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        self._profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, *args):
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        # This replaces the hook that called us, from here on cProfile gets the events
+        profiler.enable()
+
+    def __enter__(self):
+        if self.PER_THREAD:
+            threading.setprofile(self._start_thread)
+        self._start_thread()
+        return self
+
+    def __exit__(self, *exc):
+        if self.PER_THREAD:
+            threading.setprofile(None)
+        self._profilers[0].disable()
+
+    def dump(self, path: str, top: int = 25):
+        stats = None
+        for profiler in self._profilers:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError:
+                # A thread that never ran any Python code has nothing to add
+                continue
+        if stats is None:
+            return
+        stats.dump_stats(path)
+        print(f"\nProfile saved to {path} (open it with: python -m pstats {path})")
+        stats.sort_stats("cumulative").print_stats(top)
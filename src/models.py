@@ -1,9 +1,85 @@
+import os
+import sys
+import json
+import ipaddress
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, field
-from typing import List, Optional, Dict, Any
+from typing import Iterable, List, Optional, Dict, Any
+
+# Fields that hold the same few strings over and over across a fleet (every host
+# has "Chrome", the same IDs, the same permission names...). I intern them so
+# all those copies are one string in memory
+INTERNED_FIELDS = ("id", "name", "version", "author", "description", "browser", "profile", "csp", "update_url")
+
+
+def read_manifest(install_path: str) -> Dict[str, Any]:
+    # The manifest.json of an unpacked extension, or {} if it can't be read.
+    # Packed extensions (a .crx or .zip as the install path) are read from the archive
+    if install_path and os.path.isfile(install_path):
+        from src.discovery.archive import read_archive_manifest
+        return read_archive_manifest(install_path)
+    try:
+        with open(os.path.join(install_path, "manifest.json"), 'r', encoding='utf-8', errors='ignore') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class PackedIPs(Sequence):
+    # A read-only list of IP strings. IPv4 addresses (nearly all of them) are
+    # packed into 4 byte ints instead of a ~60 byte string each, anything else is
+    # kept as it is. IPv4 addresses come first, each group keeps its own order
+    __slots__ = ("_v4", "_other")
+
+    def __init__(self, ips: Iterable[str] = ()):
+        self._v4 = array("I")
+        other = []
+        for ip in ips:
+            try:
+                packed = int(ipaddress.IPv4Address(ip))
+            except ValueError:
+                other.append(sys.intern(str(ip)))
+                continue
+            self._v4.append(packed)
+        self._other = tuple(other)
+
+    def __len__(self):
+        return len(self._v4) + len(self._other)
+
+    def __iter__(self):
+        for packed in self._v4:
+            yield str(ipaddress.IPv4Address(packed))
+        yield from self._other
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PackedIPs index out of range")
+        if index < len(self._v4):
+            return str(ipaddress.IPv4Address(self._v4[index]))
+        return self._other[index - len(self._v4)]
+
+    def __eq__(self, other):
+        if isinstance(other, (PackedIPs, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"PackedIPs({list(self)!r})"
+
 
 # This is my main data structure for storing extension info
-# I'm using dataclass because it saves me from writing __init__ manually
-@dataclass
+# I'm using dataclass because it saves me from writing __init__ manually.
+# A fleet run keeps one of these alive per install until the report is written,
+# so it's slotted (no per-object __dict__) and keeps as little as it can in memory
+@dataclass(slots=True)
 class Extension:
     id: str  # The unique ID Chrome gives each extension
     name: str = "Unknown"
@@ -12,10 +88,19 @@ class Extension:
     description: Optional[str] = None
     browser: str = "Unknown"  # Could be Chrome, Edge, or Firefox
     install_path: str = ""  # Where the extension lives on disk
-    manifest_content: Dict[str, Any] = field(default_factory=dict)  # The raw manifest.json
+    profile: Optional[str] = None  # Browser profile folder, like "Default" or "Profile 1"
+    content_digest: Optional[str] = None  # SHA-256 of every file, identical copies share one analysis
+    digest_mismatch: bool = False  # Another install of the same ID and version has different bytes
+    # The raw manifest.json. Discovery leaves it as None and manifest() reads it
+    # from install_path when the report is written, so it isn't kept in memory
+    manifest_content: Optional[Dict[str, Any]] = None
     permissions: List[str] = field(default_factory=list)  # What the extension can do
     csp: Optional[str] = None  # Content Security Policy stuff
     update_url: Optional[str] = None
+    # The bits of the manifest triage and the LLM prompt need besides the above,
+    # taken out at discovery so nothing has to read the manifest again
+    host_permissions: List[str] = field(default_factory=list)
+    content_script_matches: List[str] = field(default_factory=list)  # Where its content scripts run
     
     # These get filled in later by my enrichment module
     age_days: Optional[int] = None
@@ -23,12 +108,46 @@ class Extension:
     
     # My threat intel scanner fills these
     extracted_urls: List[str] = field(default_factory=list)
-    extracted_ips: List[str] = field(default_factory=list)
+    extracted_ips: PackedIPs = field(default_factory=PackedIPs)
+    scan_truncated: bool = False  # True if the byte budget ran out before every file was read
+    # Extracted URLs/IPs found on the local threat intel feeds: {"endpoint", "rule", "feeds"}
+    intel_hits: List[Dict[str, Any]] = field(default_factory=list)
     
     # And the AI fills these at the end
     risk_score: str = "UNKNOWN"  # Low, Medium, High, Critical
     risk_summary: str = ""
 
+    # The local pre-scorer fills these, and verdict_source says where the verdict came from
+    # ("local", "cache", "llm" or "skipped")
+    prescore: Optional[int] = None
+    prescore_tier: Optional[str] = None
+    verdict_source: Optional[str] = None
+    # How many times the LLM request for this extension had to be retried
+    llm_retries: int = 0
+
+    # Seconds spent in each pipeline stage, plus "total" from start to finish
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for name in INTERNED_FIELDS:
+            value = getattr(self, name)
+            if type(value) is str:
+                setattr(self, name, sys.intern(value))
+        self.permissions = [sys.intern(p) if type(p) is str else p for p in self.permissions]
+        self.host_permissions = [sys.intern(str(h)) for h in self.host_permissions]
+        self.content_script_matches = [sys.intern(str(m)) for m in self.content_script_matches]
+        self.set_endpoints(self.extracted_urls, self.extracted_ips)
+
+    def set_endpoints(self, urls: Iterable[str], ips: Iterable[str]):
+        # The same URLs show up in every copy of an extension across a fleet, so they're interned too
+        self.extracted_urls = [sys.intern(u) for u in urls]
+        self.extracted_ips = ips if isinstance(ips, PackedIPs) else PackedIPs(ips)
+
+    def manifest(self) -> Dict[str, Any]:
+        if self.manifest_content is not None:
+            return self.manifest_content
+        return read_manifest(self.install_path) if self.install_path else {}
+
 # This is what I save to the JSON file at the end
 @dataclass
 class RiskReport:
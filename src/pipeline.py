@@ -0,0 +1,131 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from src.models import Extension
+from src.metrics import Metrics
+
+# A stage is one step of the analysis (enrichment, scanning, LLM...)
+# Each stage gets its own thread pool so a slow network stage doesn't
+# hold up the CPU stage and the other way round.
+# With batch_size > 1, func gets a list of up to batch_size extensions instead of one
+class Stage:
+    def __init__(self, name: str, func: Callable, workers: int = 1, batch_size: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+
+
+# This runs every extension through the stages like an assembly line.
+# As soon as an extension leaves one stage it is queued for the next one,
+# so extension #2 can be enriched while extension #1 is still waiting on the LLM.
+class Pipeline:
+    def __init__(self, stages: List[Stage], on_result: Optional[Callable[[Extension], None]] = None,
+                 metrics: Optional[Metrics] = None):
+        self.stages = stages
+        self.on_result = on_result
+        # With metrics, every stage records how long it took and how long extensions
+        # sat in its queue, so a slow run shows which stage is the problem
+        self.metrics = metrics
+        self.errors = []  # (extension id, stage name, error message)
+        self._lock = threading.Lock()
+
+    def run(self, extensions: List[Extension]) -> List[Extension]:
+        extensions = list(extensions)
+        if not extensions:
+            return []
+
+        pools = [
+            ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=f"bera-{stage.name}")
+            for stage in self.stages
+        ]
+        remaining = [len(extensions)]
+        all_done = threading.Event()
+        # For batched stages: extensions waiting for a full batch, and how many have shown up so far
+        waiting = [[] for _ in self.stages]
+        arrived = [0] * len(self.stages)
+        # When each extension entered the pipeline and joined its current stage's queue
+        started: Dict[int, float] = {}
+        queued: Dict[int, float] = {}
+
+        def finish(ext: Extension):
+            total = time.perf_counter() - started[id(ext)]
+            ext.timings["total"] = round(total, 4)
+            if self.metrics:
+                self.metrics.observe("extension_seconds", total)
+            if self.on_result:
+                try:
+                    self.on_result(ext)
+                except Exception as e:
+                    print(f"  Error in result callback for {ext.id}: {e}")
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    all_done.set()
+
+        def advance(ext: Extension, stage_index: int):
+            if stage_index >= len(self.stages):
+                finish(ext)
+                return
+            stage = self.stages[stage_index]
+            queued[id(ext)] = time.perf_counter()
+            if stage.batch_size == 1:
+                pools[stage_index].submit(run_stage, [ext], stage_index)
+                return
+
+            # Hold on to extensions until the batch is full, or until nothing
+            # else can arrive because every extension has reached this stage
+            with self._lock:
+                waiting[stage_index].append(ext)
+                arrived[stage_index] += 1
+                batches = []
+                while len(waiting[stage_index]) >= stage.batch_size:
+                    batches.append(waiting[stage_index][:stage.batch_size])
+                    del waiting[stage_index][:stage.batch_size]
+                if arrived[stage_index] == len(extensions) and waiting[stage_index]:
+                    batches.append(waiting[stage_index])
+                    waiting[stage_index] = []
+            for batch in batches:
+                pools[stage_index].submit(run_stage, batch, stage_index)
+
+        def run_stage(batch: List[Extension], stage_index: int):
+            stage = self.stages[stage_index]
+            start = time.perf_counter()
+            try:
+                if stage.batch_size == 1:
+                    stage.func(batch[0])
+                else:
+                    stage.func(batch)
+            except Exception as e:
+                # One broken extension shouldn't stop the rest, so I just
+                # remember the error and keep pushing it down the line
+                for ext in batch:
+                    print(f"  Error in {stage.name} for {ext.id}: {e}")
+                    with self._lock:
+                        self.errors.append((ext.id, stage.name, str(e)))
+                if self.metrics:
+                    self.metrics.inc("stage_errors_total", len(batch), {"stage": stage.name})
+            duration = time.perf_counter() - start
+            if self.metrics:
+                self.metrics.observe("stage_seconds", duration, {"stage": stage.name})
+            for ext in batch:
+                # A batched stage counts the whole batch's time for each extension in it
+                ext.timings[stage.name] = round(duration, 4)
+                if self.metrics:
+                    self.metrics.observe("stage_wait_seconds", start - queued[id(ext)], {"stage": stage.name})
+            for ext in batch:
+                advance(ext, stage_index + 1)
+
+        try:
+            for ext in extensions:
+                started[id(ext)] = time.perf_counter()
+                advance(ext, 0)
+            all_done.wait()
+        finally:
+            for pool in pools:
+                pool.shutdown(wait=True)
+
+        # The stages finish in whatever order the network decides, but I return
+        # the extensions in discovery order so reports are always the same
+        return extensions
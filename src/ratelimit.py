@@ -0,0 +1,172 @@
+import re
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+# These status codes usually mean "try again in a bit", so I retry them
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Classic token bucket: tokens drip in at `rate` per second up to `capacity`,
+# and every request has to take one (or more) out before it's allowed to go
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        # Blocks until there are enough tokens. Returns False if that would take
+        # longer than `timeout` seconds so the caller can give up instead
+        if self.rate <= 0:
+            return True
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def adjust(self, tokens: float):
+        # Takes out (or puts back, if negative) tokens without waiting, for when the
+        # real cost is only known afterwards. The bucket can go below zero, which
+        # just makes the next acquire wait longer
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - tokens)
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    # Exponential backoff with "full jitter" so a bunch of threads that all got
+    # a 429 at the same moment don't all retry at the same moment too
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Go-style durations the OpenAI and Groq rate limit headers use: "1s", "6m0s", "20ms", "7.66s"
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parts = DURATION_PART.findall(value.strip())
+    if not parts:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def rate_limit_wait(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    # How long the server asked us to back off, from Retry-After (retry-after-ms
+    # is more precise when it's there) or from the x-ratelimit-* headers when a
+    # limit has run out. None when the headers don't say
+    if not headers:
+        return None
+    wait = parse_duration(headers.get("retry-after-ms"))
+    if wait is not None:
+        return wait / 1000
+    wait = parse_retry_after(headers.get("retry-after"))
+    if wait is not None:
+        return wait
+    waits = [parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+             for kind in ("requests", "tokens") if headers.get(f"x-ratelimit-remaining-{kind}") == "0"]
+    waits = [w for w in waits if w is not None]
+    return max(waits) if waits else None
+
+
+# Paces calls to an API with per-minute request and token limits (Groq/OpenAI).
+# Every thread shares one of these, so when the server says "slow down" they
+# all wait instead of each finding out with its own 429. The rates start at what
+# was configured, get halved on every 429 and creep back up while calls succeed
+class RequestLimiter:
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, in_flight: int = 4):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # A few seconds' worth of burst, so a run doesn't start with a whole minute's quota at once
+        self.requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 6)) \
+            if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1.0, tokens_per_minute / 6)) \
+            if tokens_per_minute > 0 else None
+        self._slots = threading.BoundedSemaphore(max(1, in_flight))
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._scale = 1.0
+
+    def acquire(self, tokens: float, deadline: Optional[float] = None) -> bool:
+        # Waits for a pause to end, both buckets and an in-flight slot.
+        # False if that can't happen before deadline (time.monotonic())
+        with self._lock:
+            pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            if deadline is not None and time.monotonic() + pause > deadline:
+                return False
+            time.sleep(pause)
+        for bucket, amount in ((self.requests, 1.0), (self.tokens, tokens)):
+            if bucket and not bucket.acquire(amount, None if deadline is None else max(0.0, deadline - time.monotonic())):
+                return False
+        return self._slots.acquire(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def release(self, estimated: float, used: Optional[float] = None):
+        # used is what the response says the request really cost
+        self._slots.release()
+        if self.tokens and used is not None:
+            self.tokens.adjust(used - estimated)
+
+    def succeeded(self):
+        self._rescale(min(1.0, self._scale * 1.05))
+
+    def throttled(self, wait: Optional[float]):
+        # A 429: everyone waits out what the server asked for, and the rates drop
+        if wait:
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        self._rescale(max(0.05, self._scale / 2))
+
+    def _rescale(self, scale: float):
+        with self._lock:
+            if scale == self._scale:
+                return
+            self._scale = scale
+        if self.requests:
+            self.requests.set_rate(self.requests_per_minute / 60 * scale)
+        if self.tokens:
+            self.tokens.set_rate(self.tokens_per_minute / 60 * scale)
@@ -0,0 +1,223 @@
+import os
+import json
+import gzip
+import threading
+from dataclasses import fields as dataclass_fields
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from src.models import Extension, RiskReport
+
+# Everything to do with writing reports lives here.
+# The classic report is one big JSON document written at the end. The streaming
+# report is NDJSON: one small JSON object per line, written as soon as each
+# extension is done, so a crash near the end doesn't lose the whole run.
+
+# The raw manifest (keys, themes, icons...) is huge and rarely useful in a report
+SLIM_EXCLUDED_FIELDS = {"manifest_content"}
+HIGH_RISK_LEVELS = {"high", "critical"}
+
+
+def extension_fields() -> List[str]:
+    return [f.name for f in dataclass_fields(Extension)]
+
+
+def extension_record(extension: Extension, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    # A plain dict of the chosen fields, in the same order as the dataclass
+    wanted = set(fields) if fields is not None else None
+    return {name: _field_value(extension, name) for name in extension_fields()
+            if wanted is None or name in wanted}
+
+
+def _field_value(extension: Extension, name: str) -> Any:
+    # The manifest isn't kept in memory and IPs are packed, so both are turned
+    # back into what the report has always had. The manifest is read once, right
+    # here, for the report. Triage and the prompt use the fields discovery took out of it
+    if name == "manifest_content":
+        return extension.manifest()
+    if name == "extracted_ips":
+        return list(extension.extracted_ips)
+    return getattr(extension, name)
+
+
+def resolve_fields(spec: Optional[str], slim: bool) -> Optional[List[str]]:
+    # --fields takes a comma separated list, or "all". Without it the streaming
+    # report leaves out the raw manifest and the JSON report keeps everything
+    if spec and spec.strip().lower() != "all":
+        known = set(extension_fields())
+        chosen = [name.strip() for name in spec.split(",") if name.strip()]
+        unknown = [name for name in chosen if name not in known]
+        if unknown:
+            raise ValueError(f"Unknown report fields: {', '.join(unknown)}")
+        # id, version and install_path are what --resume matches on, so they always stay
+        key_fields = ["id", "version", "install_path"]
+        return key_fields + [name for name in chosen if name not in key_fields]
+    if spec or not slim:
+        return None
+    return [name for name in extension_fields() if name not in SLIM_EXCLUDED_FIELDS]
+
+
+def extension_from_record(record: Dict[str, Any]) -> Extension:
+    # The way back from extension_record. Fields the report left out keep their defaults
+    known = set(extension_fields())
+    return Extension(**{name: value for name, value in record.items() if name in known})
+
+
+def record_key(record: Dict[str, Any]) -> Tuple[str, str, str]:
+    return (record.get("id", ""), record.get("version", ""), record.get("install_path", ""))
+
+
+def is_high_risk(risk_score: Optional[str]) -> bool:
+    return (risk_score or "").strip().lower() in HIGH_RISK_LEVELS
+
+
+def summarize(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    by_risk: Dict[str, int] = {}
+    by_source: Dict[str, int] = {}
+    total = 0
+    high = 0
+    for record in records:
+        total += 1
+        risk = record.get("risk_score") or "UNKNOWN"
+        by_risk[risk] = by_risk.get(risk, 0) + 1
+        source = record.get("verdict_source") or "none"
+        by_source[source] = by_source.get(source, 0) + 1
+        if is_high_risk(risk):
+            high += 1
+    return {"total": total, "high_risk_count": high, "by_risk": by_risk, "by_verdict_source": by_source}
+
+
+def json_report(run_id: str, timestamp: str, extensions: List[Extension], run_stats: Dict[str, Any],
+                fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    # The classic report: the run's stats and every extension in one JSON document
+    report = RiskReport(
+        run_id=run_id,
+        timestamp=timestamp,
+        total_extensions=len(extensions),
+        high_risk_count=sum(1 for e in extensions if is_high_risk(e.risk_score)),
+        extensions=extensions
+    )
+    return {
+        "run_id": report.run_id,
+        "timestamp": report.timestamp,
+        "total": report.total_extensions,
+        "high_risk_count": report.high_risk_count,
+        **{key: value for key, value in run_stats.items() if key != "errors"},
+        "extensions": [extension_record(e, fields) for e in report.extensions],
+        "errors": run_stats.get("errors", []),
+    }
+
+
+def write_json_report(path: str, report: Dict[str, Any]):
+    # Written next to the old one and swapped in, so a reader (or watch mode
+    # rewriting it) never sees half a report
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_ndjson(path: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    # Reads back a (possibly half-written) streaming report.
+    # Returns the run header and the extension records; a cut-off last line
+    # or a cut-off gzip stream just ends the list early
+    header = None
+    records = []
+    try:
+        with _open(path, "r") as f:
+            for line in f:
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    break
+                if "_run" in obj:
+                    header = header or obj["_run"]
+                elif "_summary" in obj:
+                    continue
+                else:
+                    records.append(obj)
+    except (EOFError, OSError) as e:
+        print(f"  Stopped reading {path} early: {e}")
+    return header, records
+
+
+class NdjsonReportWriter:
+    def __init__(self, path: str, run_id: str, timestamp: str, fields: Optional[List[str]] = None):
+        self.path = path
+        self.run_id = run_id
+        self.timestamp = timestamp
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._file = None
+        self._summary_records: List[Dict[str, Any]] = []
+        self.done_keys: Set[Tuple[str, str, str]] = set()
+        # Installs read back on a --resume, so the results store still gets the whole run
+        self.resumed: List[Extension] = []
+
+    def open(self, resume: bool = False):
+        previous = []
+        if resume and os.path.exists(self.path):
+            header, previous = read_ndjson(self.path)
+            if header:
+                self.run_id = header.get("run_id", self.run_id)
+                self.timestamp = header.get("timestamp", self.timestamp)
+
+        # I always rewrite the file from what could be read back. That drops a
+        # half-written last line (or a broken gzip tail) and any old summary.
+        # It goes through a temp file so a crash right here can't lose the old results
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp" + (".gz" if self.path.endswith(".gz") else "")
+        self._file = _open(tmp_path, "w")
+        self._write_line({"_run": {"run_id": self.run_id, "timestamp": self.timestamp}})
+        for record in previous:
+            self._remember(record)
+            self._write_line(record)
+            self.resumed.append(extension_from_record(record))
+        self._file.close()
+        os.replace(tmp_path, self.path)
+
+        # New records get appended (for .gz that's a new gzip member, which readers handle fine)
+        self._file = _open(self.path, "a")
+        return self
+
+    def _remember(self, record: Dict[str, Any]):
+        self.done_keys.add(record_key(record))
+        self._summary_records.append({"risk_score": record.get("risk_score"),
+                                      "verdict_source": record.get("verdict_source")})
+
+    def _write_line(self, obj: Dict[str, Any]):
+        self._file.write(json.dumps(obj, default=str, separators=(",", ":")) + "\n")
+
+    def is_done(self, extension: Extension) -> bool:
+        return (extension.id, extension.version, extension.install_path) in self.done_keys
+
+    def write(self, extension: Extension):
+        record = extension_record(extension, self.fields)
+        with self._lock:
+            self._write_line(record)
+            # Flush every line so a crash loses at most the extension in flight
+            self._file.flush()
+            self._remember(extension_record(extension, ("id", "version", "install_path", "risk_score", "verdict_source")))
+
+    def write_summary(self, extra: Optional[Dict[str, Any]] = None):
+        summary = summarize(self._summary_records)
+        summary.update(extra or {})
+        with self._lock:
+            self._write_line({"_summary": summary})
+            self._file.flush()
+        return summary
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,309 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+from src.models import Extension
+from src.llm.assessor import RISK_LEVELS
+from src.threat_intel.intel import domain_key
+from src.discovery.archive import ARCHIVE_SUFFIXES
+
+# Every run's results in one SQLite file, so "what changed since yesterday" or
+# "which hosts have extension X at High" is an indexed query instead of loading
+# every old report. One row per extension version (ID + version + content digest)
+# holds what's the same everywhere, installs say where a version was seen in a run,
+# and verdicts are per run so the history is kept.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    started TEXT NOT NULL,
+    command TEXT,
+    total INTEGER,
+    high_risk_count INTEGER,
+    stats TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_host ON runs (host, started);
+
+CREATE TABLE IF NOT EXISTS versions (
+    version_pk INTEGER PRIMARY KEY,
+    ext_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    name TEXT,
+    author TEXT,
+    description TEXT,
+    permissions TEXT,
+    csp TEXT,
+    update_url TEXT,
+    UNIQUE (ext_id, version, digest)
+);
+
+CREATE TABLE IF NOT EXISTS installs (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    install_path TEXT NOT NULL,
+    version_pk INTEGER NOT NULL REFERENCES versions (version_pk),
+    browser TEXT,
+    profile TEXT,
+    PRIMARY KEY (run_id, install_path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS installs_by_version ON installs (version_pk, run_id);
+
+-- rhost is the URL's host with its labels reversed ("com.evil.cdn"), so every
+-- subdomain of a domain is one index range
+CREATE TABLE IF NOT EXISTS endpoints (
+    version_pk INTEGER NOT NULL REFERENCES versions (version_pk),
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    rhost TEXT,
+    PRIMARY KEY (version_pk, kind, value)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS endpoints_by_host ON endpoints (rhost);
+
+CREATE TABLE IF NOT EXISTS verdicts (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    version_pk INTEGER NOT NULL REFERENCES versions (version_pk),
+    risk_score TEXT,
+    risk_summary TEXT,
+    verdict_source TEXT,
+    prescore INTEGER,
+    prescore_tier TEXT,
+    intel_hits TEXT,
+    model TEXT,
+    prompt_version TEXT,
+    assessed TEXT,
+    PRIMARY KEY (run_id, version_pk)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS verdicts_by_version ON verdicts (version_pk, assessed);
+CREATE INDEX IF NOT EXISTS verdicts_by_risk ON verdicts (risk_score, run_id);
+"""
+
+HIGH_RISK_LEVELS = ("High", "Critical")
+# What record_run reads from each extension. A --resume rebuilds the earlier
+# installs from the report, which only works if the report kept all of these
+RECORDED_FIELDS = ("id", "version", "content_digest", "name", "author", "description", "permissions", "csp",
+                   "update_url", "install_path", "browser", "profile", "extracted_urls", "extracted_ips",
+                   "risk_score", "risk_summary", "verdict_source", "prescore", "prescore_tier", "intel_hits")
+
+
+def reversed_host(endpoint: str) -> Optional[str]:
+    # "https://cdn.Evil.com:8443/x" -> "com.evil.cdn", an IP stays as it is
+    host = endpoint
+    if "://" in endpoint:
+        try:
+            host = urlsplit(endpoint).hostname or ""
+        except ValueError:
+            return None
+    if host.replace(".", "").isdigit() or ":" in host:
+        return host
+    return domain_key(host)
+
+
+def risk_level(risk_score: Optional[str]) -> Optional[str]:
+    # The LLM's spelling varies ("high", "HIGH"), the store always says "High" so the index works
+    if not risk_score:
+        return None
+    level = risk_score.strip().capitalize()
+    return level if level in RISK_LEVELS else risk_score
+
+
+def _location(row) -> str:
+    # Where an install lives, without its version: the extension's folder for an
+    # unpacked install. Packed ones share a folder of downloads, so they go by ID
+    path = row["install_path"]
+    if path.lower().endswith(ARCHIVE_SUFFIXES):
+        return os.path.join(os.path.dirname(path), row["ext_id"])
+    return os.path.dirname(path)
+
+
+class ResultsStore:
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Pipeline threads look up stored verdicts, so one connection is shared behind a lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stored_verdict(self, extension: Extension, model: str, prompt_version: str,
+                       max_age_seconds: Optional[float] = None) -> Optional[Tuple[str, str]]:
+        # The newest LLM verdict for exactly this version (same files), asked with the same model and prompt.
+        # Only rows the LLM actually answered count: a run that reused a verdict records it
+        # again with its own time, and matching those would keep an old verdict alive forever
+        query = """
+            SELECT d.risk_score, d.risk_summary FROM verdicts d
+            JOIN versions v ON v.version_pk = d.version_pk
+            WHERE v.ext_id = ? AND v.version = ? AND v.digest = ?
+              AND d.model = ? AND d.prompt_version = ?
+              AND d.verdict_source = 'llm' AND d.risk_score != 'UNKNOWN'
+        """
+        params: List[Any] = [extension.id, extension.version, extension.content_digest or "", model, prompt_version]
+        if max_age_seconds:
+            query += " AND d.assessed >= ?"
+            params.append((datetime.now() - timedelta(seconds=max_age_seconds)).isoformat())
+        query += " ORDER BY d.assessed DESC LIMIT 1"
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+        return (row["risk_score"], row["risk_summary"]) if row else None
+
+    def record_run(self, run_id: str, host: str, started: str, command: str,
+                   extensions: List[Extension], stats: Dict[str, Any],
+                   model: Optional[str] = None, prompt_version: Optional[str] = None):
+        # Everything for one run goes in as one transaction, so a crash can't leave half a run.
+        # Recording the same run again (a --resume) adds to it
+        assessed = datetime.now().isoformat()
+        with self._lock, self._db:
+            db = self._db
+            db.execute("INSERT INTO runs (run_id, host, started, command, stats) VALUES (?, ?, ?, ?, ?)"
+                       " ON CONFLICT (run_id) DO UPDATE SET stats = excluded.stats",
+                       (run_id, host, started, command, json.dumps(stats, default=str)))
+
+            versions: Dict[Tuple[str, str, str], Extension] = {}
+            for ext in extensions:
+                versions.setdefault((ext.id, ext.version, ext.content_digest or ""), ext)
+            db.executemany(
+                "INSERT OR IGNORE INTO versions (ext_id, version, digest, name, author, description, permissions, csp, update_url)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(key[0], key[1], key[2], ext.name, ext.author, ext.description, json.dumps(list(ext.permissions)),
+                  ext.csp, ext.update_url) for key, ext in versions.items()])
+            version_pks = self._version_pks(versions)
+
+            db.executemany("INSERT OR REPLACE INTO installs VALUES (?, ?, ?, ?, ?)",
+                           [(run_id, ext.install_path, version_pks[(ext.id, ext.version, ext.content_digest or "")],
+                             ext.browser, ext.profile) for ext in extensions])
+            endpoints = []
+            verdicts = []
+            for key, ext in versions.items():
+                pk = version_pks[key]
+                endpoints.extend((pk, "url", url, reversed_host(url)) for url in ext.extracted_urls)
+                endpoints.extend((pk, "ip", ip, ip) for ip in ext.extracted_ips)
+                verdicts.append((run_id, pk, risk_level(ext.risk_score), ext.risk_summary, ext.verdict_source, ext.prescore,
+                                 ext.prescore_tier, json.dumps(ext.intel_hits) if ext.intel_hits else None,
+                                 model, prompt_version, assessed))
+            db.executemany("INSERT OR IGNORE INTO endpoints VALUES (?, ?, ?, ?)", endpoints)
+            db.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", verdicts)
+            db.execute(
+                "UPDATE runs SET total = (SELECT COUNT(*) FROM installs WHERE run_id = ?1),"
+                " high_risk_count = (SELECT COUNT(*) FROM installs i JOIN verdicts d"
+                "   ON d.run_id = i.run_id AND d.version_pk = i.version_pk"
+                "   WHERE i.run_id = ?1 AND d.risk_score IN (?2, ?3))"
+                " WHERE run_id = ?1", (run_id, *HIGH_RISK_LEVELS))
+
+    def _version_pks(self, keys: Iterable[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], int]:
+        wanted = set(keys)
+        pks = {}
+        for ext_id in {key[0] for key in wanted}:
+            for row in self._db.execute("SELECT version_pk, ext_id, version, digest FROM versions WHERE ext_id = ?", (ext_id,)):
+                key = (row["ext_id"], row["version"], row["digest"])
+                if key in wanted:
+                    pks[key] = row["version_pk"]
+        return pks
+
+    def runs(self, host: Optional[str] = None, limit: int = 20) -> List[sqlite3.Row]:
+        query = "SELECT run_id, host, started, command, total, high_risk_count FROM runs"
+        params: List[Any] = []
+        if host:
+            query += " WHERE host = ?"
+            params.append(host)
+        query += " ORDER BY started DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def previous_run(self, run_id: str) -> Optional[str]:
+        # The run of the same command on the same host just before this one. An inventory
+        # run has no verdicts, so diffing a scan against it would make every risk "change"
+        with self._lock:
+            row = self._db.execute(
+                "SELECT p.run_id FROM runs r JOIN runs p"
+                " ON p.host = r.host AND p.command = r.command AND p.started < r.started"
+                " WHERE r.run_id = ? ORDER BY p.started DESC LIMIT 1", (run_id,)).fetchone()
+        return row["run_id"] if row else None
+
+    def _installs(self, run_id: str) -> Dict[str, sqlite3.Row]:
+        # Keyed by location, so an update shows up as the same install with a new version
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT i.install_path, i.browser, i.profile, v.ext_id, v.name, v.version, d.risk_score"
+                " FROM installs i JOIN versions v ON v.version_pk = i.version_pk"
+                " LEFT JOIN verdicts d ON d.run_id = i.run_id AND d.version_pk = i.version_pk"
+                " WHERE i.run_id = ?", (run_id,)).fetchall()
+        return {_location(row): row for row in rows}
+
+    def diff(self, old_run: str, new_run: str) -> Dict[str, List[Dict[str, Any]]]:
+        old, new = self._installs(old_run), self._installs(new_run)
+
+        def describe(row, **extra):
+            return {"id": row["ext_id"], "name": row["name"], "browser": row["browser"], "profile": row["profile"],
+                    "location": location, "version": row["version"], "risk_score": row["risk_score"], **extra}
+
+        changes = {"added": [], "removed": [], "updated": [], "risk_changed": []}
+        for location in sorted(set(old) | set(new)):
+            before, after = old.get(location), new.get(location)
+            if before is None:
+                changes["added"].append(describe(after))
+            elif after is None:
+                changes["removed"].append(describe(before))
+            elif before["version"] != after["version"]:
+                changes["updated"].append(describe(after, old_version=before["version"], old_risk_score=before["risk_score"]))
+            elif (before["risk_score"] or "UNKNOWN") != (after["risk_score"] or "UNKNOWN"):
+                changes["risk_changed"].append(describe(after, old_risk_score=before["risk_score"]))
+        return changes
+
+    def query(self, ext_id: Optional[str] = None, name: Optional[str] = None, risks: Optional[List[str]] = None,
+              endpoint: Optional[str] = None, host: Optional[str] = None, all_runs: bool = False,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Installs matching every filter given. Only each host's latest run counts unless all_runs.
+        # "Latest" skips runs without a single real verdict (an inventory is all UNKNOWN),
+        # the same reason previous_run only pairs runs of the same command
+        query = """
+            SELECT r.host, r.run_id, r.started, i.browser, i.profile, i.install_path,
+                   v.ext_id, v.name, v.version, d.risk_score, d.verdict_source
+            FROM installs i
+            JOIN runs r ON r.run_id = i.run_id
+            JOIN versions v ON v.version_pk = i.version_pk
+            LEFT JOIN verdicts d ON d.run_id = i.run_id AND d.version_pk = i.version_pk
+            WHERE 1 = 1
+        """
+        params: List[Any] = []
+        if not all_runs:
+            query += (" AND r.started = (SELECT MAX(started) FROM runs latest WHERE latest.host = r.host"
+                      "   AND EXISTS (SELECT 1 FROM verdicts lv WHERE lv.run_id = latest.run_id"
+                      "   AND lv.risk_score != 'UNKNOWN'))")
+        if ext_id:
+            query += " AND v.ext_id = ?"
+            params.append(ext_id)
+        if name:
+            query += " AND v.name LIKE ?"
+            params.append(f"%{name}%")
+        if risks:
+            query += f" AND d.risk_score IN ({', '.join('?' * len(risks))})"
+            params.extend(risk_level(risk) for risk in risks)
+        if host:
+            query += " AND r.host = ?"
+            params.append(host)
+        if endpoint:
+            # The domain itself or any subdomain (an IP matches exactly), straight off the index
+            key = reversed_host(endpoint) or endpoint
+            query += (" AND i.version_pk IN (SELECT version_pk FROM endpoints"
+                      " WHERE rhost = ? OR (rhost >= ? AND rhost < ?))")
+            params.extend([key, key + ".", key + "/"])
+        query += " ORDER BY r.host, r.started DESC, v.ext_id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, params)]
@@ -0,0 +1,168 @@
+import os
+import re
+import mmap
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+# This is the low-level part of the scanner. It works on raw bytes (mmap'd
+# where possible) instead of decoding every file into a Python string first.
+
+# I cap how long a URL can get so that a match is never longer than the
+# overlap between chunks (see scan_stream below).
+# \x80-\xff lets UTF-8 hostnames through like the old str pattern did
+MAX_HOST_LENGTH = 256
+MAX_URL_TAIL = 2048
+URL_PATTERN = re.compile(
+    rb'https?://(?:[-\w.\x80-\xff]|%%[\da-fA-F]{2}){1,%d}[^\s\'"<>]{0,%d}' % (MAX_HOST_LENGTH, MAX_URL_TAIL)
+)
+IP_PATTERN = re.compile(rb'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b')
+
+# I tried folding both patterns into one alternation, but CPython's re then
+# can't use the literal "http" prefix to skip ahead and the single pass came
+# out ~2x slower than two passes over the same (uncopied) buffer
+PATTERNS = (URL_PATTERN, IP_PATTERN)
+
+# These IPs are localhost so I ignore them
+IGNORED_IPS = {'127.0.0.1', '0.0.0.0', '::1'}
+
+# Every match fits inside this many bytes, so carrying it over between chunks
+# means nothing gets cut in half at a chunk boundary
+CHUNK_OVERLAP = 4096
+SNIFF_BYTES = 8192
+
+# Magic numbers for file types that can't contain code (images, fonts, media)
+BINARY_SIGNATURES = (
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'\x00\x00\x01\x00',
+    b'RIFF', b'wOFF', b'wOF2', b'OTTO', b'\x00\x01\x00\x00', b'ID3',
+    b'OggS', b'fLaC', b'\x1aE\xdf\xa3', b'%PDF',
+)
+# WebAssembly is binary but its data section is full of strings, so I still scan it
+WASM_SIGNATURE = b'\x00asm'
+
+
+@dataclass
+class FileScanResult:
+    urls: List[str] = field(default_factory=list)
+    ips: List[str] = field(default_factory=list)
+    bytes_scanned: int = 0
+    truncated: bool = False  # hit the byte budget before the end of the file
+    binary: bool = False
+
+
+def looks_binary(head: bytes) -> bool:
+    # I sniff the first few KB instead of trusting the file extension,
+    # because a ".png" can hide JavaScript and a ".js" can be an image
+    if head.startswith(WASM_SIGNATURE):
+        return False
+    if head.startswith(BINARY_SIGNATURES) or head[4:8] == b'ftyp':
+        return True
+    return b'\x00' in head
+
+
+def _collect(pattern, match_bytes: bytes, urls: Set[str], ips: Set[str]):
+    if pattern is URL_PATTERN:
+        # Clean up trailing punctuation
+        urls.add(match_bytes.decode('utf-8', errors='ignore').rstrip(".,;)'\""))
+    else:
+        ip = match_bytes.decode('ascii')
+        if ip not in IGNORED_IPS:
+            ips.add(ip)
+
+
+def scan_buffer(buffer, urls: Set[str], ips: Set[str], end: Optional[int] = None):
+    # Works on anything that supports the buffer protocol (bytes, mmap...)
+    end = len(buffer) if end is None else end
+    for pattern in PATTERNS:
+        for match in pattern.finditer(buffer, 0, end):
+            _collect(pattern, match.group(), urls, ips)
+
+
+def scan_stream(f, limit: int, urls: Set[str], ips: Set[str], chunk_size: int = 8 * 1024 * 1024,
+                head: bytes = b"") -> int:
+    # For really big files I read fixed-size chunks instead of mapping everything.
+    # Matches that start in the last CHUNK_OVERLAP bytes of a chunk are left for
+    # the next round, where the rest of them has been read in.
+    # head is whatever was already read from f (like the sniffed bytes)
+    chunk_size = max(chunk_size, CHUNK_OVERLAP * 2)
+    buf = head
+    positions = [0] * len(PATTERNS)  # where each pattern carries on from in buf
+    total = len(head)
+    while True:
+        data = f.read(min(chunk_size, limit - total))
+        total += len(data)
+        buf += data
+        eof = not data or total >= limit
+
+        for i, pattern in enumerate(PATTERNS):
+            pos = positions[i]
+            safe = len(buf) if eof else max(pos, len(buf) - CHUNK_OVERLAP)
+            last_end = pos
+            for match in pattern.finditer(buf, pos):
+                if not eof and match.start() >= safe:
+                    break
+                _collect(pattern, match.group(), urls, ips)
+                last_end = match.end()
+            positions[i] = max(safe, last_end)
+        if eof:
+            return total
+
+        # Keep one byte before the restart point so \b still sees what came before it
+        keep_from = max(0, min(positions) - 1)
+        buf = buf[keep_from:]
+        positions = [p - keep_from for p in positions]
+
+
+def scan_fileobj(f, size: int, max_bytes: Optional[int] = None) -> FileScanResult:
+    # Like scan_file, for things that can only be read front to back
+    # (a member of a ZIP being inflated). size is how big it says it is
+    head = f.read(SNIFF_BYTES)
+    if looks_binary(head):
+        return FileScanResult(binary=True)
+
+    limit = size if max_bytes is None else min(size, max_bytes)
+    result = FileScanResult(truncated=limit < size)
+    urls, ips = set(), set()
+    if limit <= len(head):
+        scan_buffer(head, urls, ips, max(0, limit))
+        result.bytes_scanned = min(len(head), max(0, limit))
+    else:
+        result.bytes_scanned = scan_stream(f, limit, urls, ips, head=head)
+    result.urls = sorted(urls)
+    result.ips = sorted(ips)
+    return result
+
+
+def scan_file(path: str, max_bytes: Optional[int] = None,
+              stream_threshold: int = 64 * 1024 * 1024) -> Optional[FileScanResult]:
+    # Scans one file and returns None if it couldn't be read at all
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+            if looks_binary(head):
+                return FileScanResult(binary=True)
+
+            limit = size if max_bytes is None else min(size, max_bytes)
+            result = FileScanResult(truncated=limit < size)
+            urls, ips = set(), set()
+            if limit <= 0:
+                pass
+            elif limit <= len(head):
+                # Small file, it's already in memory
+                scan_buffer(head, urls, ips, limit)
+                result.bytes_scanned = limit
+            elif limit <= stream_threshold:
+                # Let the OS page the file in, no copy into a Python string
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    scan_buffer(mm, urls, ips, limit)
+                result.bytes_scanned = limit
+            else:
+                f.seek(0)
+                result.bytes_scanned = scan_stream(f, limit, urls, ips)
+
+            result.urls = sorted(urls)
+            result.ips = sorted(ips)
+            return result
+    except (OSError, ValueError):
+        # Some files might be locked or vanish halfway, just skip them
+        return None
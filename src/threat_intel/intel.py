@@ -0,0 +1,336 @@
+import os
+import re
+import sys
+import mmap
+import json
+import struct
+import bisect
+import hashlib
+import ipaddress
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+from src.models import Extension
+
+# Local threat intel. The scanner only collects URLs and IPs, this checks every
+# one of them against offline feeds (domain blocklists, CIDR lists, suffix rules).
+#
+# Feeds are plain text and can be huge, so "compile-intel" turns them into one
+# compact file once and every run just memory-maps it:
+#   - domains are stored under their labels reversed ("evil.com" -> "com.evil"),
+#     like a reversed-label trie, but flattened: each key is a 64 bit hash in a
+#     sorted array. A host matches if any of its label prefixes ("com.evil",
+#     "com.evil.cdn") is in there, and each check is a binary search that runs in C
+#   - CIDR ranges are split into sorted ranges that don't overlap, one array
+#     for IPv4 and one for IPv6, so an IP is one binary search too
+# Loading doesn't parse anything, so millions of indicators load instantly and
+# the OS shares the pages between processes.
+
+MAGIC = b"BERAINTL"
+FORMAT_VERSION = 1
+ALIGN = 8
+
+# A domain entry matches the domain and every subdomain, a suffix rule ("*.evil.com")
+# only the subdomains
+DOMAIN = 0
+SUFFIX = 1
+
+# Leading tokens that mean "this is a hosts file line", like "0.0.0.0 evil.com"
+HOSTS_ADDRESSES = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+HOSTNAME = re.compile(r"[a-z0-9_-]+(?:\.[a-z0-9_-]+)*")
+
+
+def parse_indicator(line: str) -> Optional[Tuple[str, Any]]:
+    # One line of a feed -> ("domain" | "suffix", reversed key) or ("net", ip_network).
+    # Understands plain domains, hosts files, adblock "||domain^" rules, URLs,
+    # "*.domain" / ".domain" suffix rules, IPs and CIDRs. Anything else is None
+    line = line.split("#", 1)[0].strip()
+    if not line or line.startswith("!"):
+        return None
+    tokens = line.split()
+    if len(tokens) > 1 and tokens[0] in HOSTS_ADDRESSES:
+        token = tokens[1]
+    else:
+        token = tokens[0]
+
+    if token.startswith("||"):
+        token = token[2:].split("^", 1)[0]
+    elif "://" in token:
+        try:
+            token = urlsplit(token).hostname or ""
+        except ValueError:
+            return None
+
+    # Only worth trying when it could be an address, exceptions are slow over millions of lines
+    if token[:1].isdigit() or ":" in token:
+        try:
+            return ("net", ipaddress.ip_network(token, strict=False))
+        except ValueError:
+            pass
+
+    kind = "domain"
+    if token.startswith("*."):
+        kind, token = "suffix", token[2:]
+    elif token.startswith("."):
+        kind, token = "suffix", token[1:]
+    key = domain_key(token)
+    return (kind, key) if key else None
+
+
+def domain_key(host: str) -> Optional[str]:
+    # "Sub.Evil.com." -> "com.evil.sub", or None if it isn't a hostname
+    host = host.strip().rstrip(".").lower()
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    if not HOSTNAME.fullmatch(host):
+        return None
+    return ".".join(reversed(host.split(".")))
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("ascii"), digest_size=8).digest(), "little")
+
+
+def _ranges(segments: List[Tuple[int, int, int]]) -> List[Tuple[int, int, Tuple[int, ...]]]:
+    # (start, end, feed) ranges that may overlap -> sorted ranges that don't,
+    # each with every feed that covers it. Neighbours with the same feeds are merged
+    events = []
+    for start, end, feed in segments:
+        events.append((start, 1, feed))
+        events.append((end + 1, -1, feed))
+    events.sort()
+    result = []
+    active: Dict[int, int] = {}
+    position = None
+    i = 0
+    while i < len(events):
+        point = events[i][0]
+        if active and position is not None and point > position:
+            feeds = tuple(sorted(active))
+            if result and result[-1][2] == feeds and result[-1][1] == position - 1:
+                result[-1] = (result[-1][0], point - 1, feeds)
+            else:
+                result.append((position, point - 1, feeds))
+        # Apply every event at this point before starting the next range
+        while i < len(events) and events[i][0] == point:
+            _, change, feed = events[i]
+            active[feed] = active.get(feed, 0) + change
+            if not active[feed]:
+                del active[feed]
+            i += 1
+        position = point
+    return result
+
+
+def compile_feeds(feeds: List[Tuple[str, str]], output: str) -> Dict[str, Any]:
+    # feeds is [(name, path)]. Writes the compiled file and returns its header
+    domains: Dict[Tuple[str, int], set] = {}
+    networks = {4: [], 6: []}
+    feed_info = []
+    for feed_id, (name, path) in enumerate(feeds):
+        counts = {"indicators": 0, "skipped": 0}
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                parsed = parse_indicator(line)
+                if parsed is None:
+                    if line.strip() and not line.lstrip().startswith(("#", "!")):
+                        counts["skipped"] += 1
+                    continue
+                kind, value = parsed
+                if kind == "net":
+                    networks[value.version].append((int(value.network_address), int(value.broadcast_address), feed_id))
+                else:
+                    domains.setdefault((value, DOMAIN if kind == "domain" else SUFFIX), set()).add(feed_id)
+                counts["indicators"] += 1
+        feed_info.append({"name": name, "path": os.path.abspath(path), **counts})
+
+    # Feed sets are stored once and referred to by number
+    labels: Dict[Tuple[int, ...], int] = {}
+
+    def label(feeds_: Iterable[int]) -> int:
+        return labels.setdefault(tuple(sorted(feeds_)), len(labels))
+
+    # (hash, kind, feeds), sorted so lookups can binary search the hashes
+    keys = sorted((key_hash(key), kind, feeds_) for (key, kind), feeds_ in domains.items())
+    v4 = _ranges(networks[4])
+    v6 = _ranges(networks[6])
+
+    sections = {
+        "domain_hashes": _pack("Q", [hashed for hashed, _, _ in keys]),
+        "domain_kinds": bytes(kind for _, kind, _ in keys),
+        "domain_labels": _pack("I", [label(feeds_) for _, _, feeds_ in keys]),
+        "v4_starts": _pack("I", [start for start, _, _ in v4]),
+        "v4_ends": _pack("I", [end for _, end, _ in v4]),
+        "v4_labels": _pack("I", [label(feeds_) for _, _, feeds_ in v4]),
+        "v6_starts": b"".join(start.to_bytes(16, "big") for start, _, _ in v6),
+        "v6_ends": b"".join(end.to_bytes(16, "big") for _, end, _ in v6),
+        "v6_labels": _pack("I", [label(feeds_) for _, _, feeds_ in v6]),
+    }
+    header = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "created": datetime.now().isoformat(),
+        "feeds": feed_info,
+        "labels": [list(feeds_) for feeds_ in labels],
+        "counts": {"domains": len(keys), "v4_ranges": len(v4), "v6_ranges": len(v6)},
+        "sections": {},
+    }
+
+    # The header goes first and says where each section starts (counted from the end of
+    # the header). Sections start on an 8 byte boundary so the arrays can be read straight
+    # out of the mapping
+    position = 0
+    for name, data in sections.items():
+        header["sections"][name] = [position, len(data)]
+        position = _aligned(position + len(data))
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        data_start = _aligned(f.tell())
+        for name, data in sections.items():
+            f.write(b"\0" * (data_start + header["sections"][name][0] - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, output)
+    return header
+
+
+def _pack(fmt: str, values: List[int]) -> bytes:
+    return struct.pack(f"={len(values)}{fmt}", *values)
+
+
+def _aligned(position: int) -> int:
+    return (position + ALIGN - 1) // ALIGN * ALIGN
+
+
+class _Fixed:
+    # Lets bisect search the 16 byte IPv6 values in the mapping
+    def __init__(self, blob: memoryview, width: int):
+        self.blob = blob
+        self.width = width
+
+    def __len__(self):
+        return len(self.blob) // self.width
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blob[i * self.width:(i + 1) * self.width])
+
+
+class IntelIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._views: List[memoryview] = []
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can't be mapped
+            self._file.close()
+            raise ValueError(f"{path} is not a compiled threat intel file")
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a compiled threat intel file")
+        (size,) = struct.unpack_from("<I", self._map, len(MAGIC))
+        self.header = json.loads(self._map[len(MAGIC) + 4:len(MAGIC) + 4 + size])
+        if self.header.get("version") != FORMAT_VERSION or self.header.get("byteorder") != sys.byteorder:
+            self.close()
+            raise ValueError(f"{path} was compiled by a different version or on a different machine, run compile-intel again")
+        data_start = _aligned(len(MAGIC) + 4 + size)
+
+        def section(name: str, fmt: Optional[str] = None) -> memoryview:
+            start, length = self.header["sections"][name]
+            data = memoryview(self._map)[data_start + start:data_start + start + length]
+            self._views.append(data)
+            if fmt:
+                data = data.cast(fmt)
+                self._views.append(data)
+            return data
+
+        self.feeds = [feed["name"] for feed in self.header["feeds"]]
+        self.labels = [tuple(self.feeds[i] for i in feeds) for feeds in self.header["labels"]]
+        self._domain_hashes = section("domain_hashes", "Q")
+        self._domain_kinds = section("domain_kinds")
+        self._domain_labels = section("domain_labels", "I")
+        self._v4_starts = section("v4_starts", "I")
+        self._v4_ends = section("v4_ends", "I")
+        self._v4_labels = section("v4_labels", "I")
+        self._v6_starts = _Fixed(section("v6_starts"), 16)
+        self._v6_ends = _Fixed(section("v6_ends"), 16)
+        self._v6_labels = section("v6_labels", "I")
+
+    @property
+    def indicators(self) -> int:
+        return sum(feed["indicators"] for feed in self.header["feeds"])
+
+    def match_host(self, host: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        # Returns (the rule that matched, feeds) for the most specific match, or None
+        try:
+            return self.match_ip(str(ipaddress.ip_address(host.strip("[]"))))
+        except ValueError:
+            pass
+        key = domain_key(host)
+        if not key:
+            return None
+        labels = key.split(".")
+        # Most specific first: "com.evil.cdn" before "com.evil"
+        for depth in range(len(labels), 0, -1):
+            candidate = key_hash(".".join(labels[:depth]))
+            i = bisect.bisect_left(self._domain_hashes, candidate)
+            while i < len(self._domain_hashes) and self._domain_hashes[i] == candidate:
+                kind = self._domain_kinds[i]
+                if kind == DOMAIN or depth < len(labels):
+                    rule = ".".join(reversed(labels[:depth]))
+                    return ("*." + rule if kind == SUFFIX else rule), self.labels[self._domain_labels[i]]
+                i += 1
+        return None
+
+    def match_ip(self, ip: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 4:
+            value, starts, ends, labels = int(address), self._v4_starts, self._v4_ends, self._v4_labels
+        else:
+            value, starts, ends, labels = address.packed, self._v6_starts, self._v6_ends, self._v6_labels
+        i = bisect.bisect_right(starts, value) - 1
+        if i < 0 or ends[i] < value:
+            return None
+        start, end = starts[i], ends[i]
+        if address.version == 6:
+            start, end = int.from_bytes(start, "big"), int.from_bytes(end, "big")
+        cls = ipaddress.IPv4Address if address.version == 4 else ipaddress.IPv6Address
+        return f"{cls(start)}-{cls(end)}", self.labels[labels[i]]
+
+    def match_url(self, url: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        try:
+            host = urlsplit(url).hostname
+        except ValueError:
+            return None
+        return self.match_host(host) if host else None
+
+    def annotate(self, extension: Extension) -> List[Dict[str, Any]]:
+        # Checks every extracted endpoint (not just the first few) and puts the hits on the extension
+        hits = []
+        for endpoints, match in ((extension.extracted_urls, self.match_url), (extension.extracted_ips, self.match_ip)):
+            for endpoint in endpoints:
+                found = match(endpoint)
+                if found:
+                    hits.append({"endpoint": endpoint, "rule": found[0], "feeds": list(found[1])})
+        extension.intel_hits = hits
+        return hits
+
+    def close(self):
+        # The mapping can only be closed once nothing points into it
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+        self._file.close()
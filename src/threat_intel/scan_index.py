@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def file_stats(install_path: str) -> List[Tuple[str, str, os.stat_result]]:
+    # (relative path, path, stat) of every file under install_path, in a stable order.
+    # Files that vanish halfway are left out
+    found = []
+    for root, dirs, names in os.walk(install_path):
+        dirs.sort()
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((os.path.relpath(path, install_path).replace(os.sep, "/"), path, stat))
+    found.sort(key=lambda item: item[0])
+    return found
+
+# Extension folders are versioned (<id>/<version>/) and basically never change
+# once Chrome unpacks them, so re-reading every file on every run is wasted work.
+# This index remembers what the scanner found in each file (keyed by path + size + mtime)
+# and what it found in each whole extension version. It also keeps the SHA-256 of
+# each file for dedup, keyed the same way, so only files that changed get hashed again.
+class ScanIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._versions: Dict[str, Dict[str, Any]] = {}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._digests: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"versions_skipped": 0, "files_reused": 0, "files_scanned": 0,
+                      "digests_reused": 0, "digests_computed": 0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._versions = data.get("versions", {})
+            self._files = data.get("files", {})
+            self._digests = data.get("digests", {})
+        except Exception as e:
+            print(f"Ignoring unreadable scan index {self.path}: {e}")
+
+    @staticmethod
+    def version_signature(install_path: str) -> Optional[str]:
+        # "Has anything in this version changed?" The folder and manifest mtimes
+        # aren't enough: rewriting a file in place (or anything in a subfolder)
+        # changes neither, and that's exactly the tampering we're looking for.
+        # So it's the path, size and mtime of every file, which is one walk of
+        # stats and no reads. A packed extension is one file, so its own stat is enough
+        try:
+            if os.path.isfile(install_path):
+                stat = os.stat(install_path)
+                return f"{stat.st_mtime_ns}:{stat.st_size}"
+        except OSError:
+            return None
+        if not os.path.isdir(install_path):
+            return None
+        digest = hashlib.sha256()
+        for relative, _, stat in file_stats(install_path):
+            digest.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8", "surrogateescape"))
+        return digest.hexdigest()
+
+    def get_version(self, install_path: str, signature: Optional[str]) -> Optional[Tuple[List[str], List[str]]]:
+        if signature is None:
+            return None
+        with self._lock:
+            entry = self._versions.get(install_path)
+            if entry and entry["signature"] == signature:
+                self.stats["versions_skipped"] += 1
+                return entry["urls"], entry["ips"]
+        return None
+
+    def put_version(self, install_path: str, signature: Optional[str], urls: List[str], ips: List[str]):
+        if signature is None:
+            return
+        with self._lock:
+            self._versions[install_path] = {"signature": signature, "urls": urls, "ips": ips}
+            self._dirty = True
+
+    def get_file(self, path: str, stat: os.stat_result) -> Optional[Tuple[List[str], List[str]]]:
+        with self._lock:
+            entry = self._files.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self.stats["files_reused"] += 1
+                return entry["urls"], entry["ips"]
+        return None
+
+    def put_file(self, path: str, stat: os.stat_result, urls: List[str], ips: List[str]):
+        with self._lock:
+            self.stats["files_scanned"] += 1
+            self._files[path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "urls": urls,
+                "ips": ips,
+            }
+            self._dirty = True
+
+    def get_digest(self, path: str, stat: os.stat_result) -> Optional[str]:
+        with self._lock:
+            entry = self._digests.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self.stats["digests_reused"] += 1
+                return entry["sha256"]
+        return None
+
+    def put_digest(self, path: str, stat: os.stat_result, sha256: str):
+        with self._lock:
+            self.stats["digests_computed"] += 1
+            self._digests[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+            self._dirty = True
+
+    def compact(self) -> Tuple[int, int]:
+        # Drops everything that belongs to extension versions that aren't on disk anymore
+        # (Chrome deletes the old version folder when an extension updates)
+        with self._lock:
+            gone_versions = [p for p in self._versions if not os.path.exists(p)]
+            for p in gone_versions:
+                del self._versions[p]
+            gone_files = [p for p in self._files if not os.path.isfile(p)]
+            for p in gone_files:
+                del self._files[p]
+            gone_digests = [p for p in self._digests if not os.path.isfile(p)]
+            for p in gone_digests:
+                del self._digests[p]
+            if gone_versions or gone_files or gone_digests:
+                self._dirty = True
+        return len(gone_versions), len(gone_files)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"versions": self._versions, "files": self._files, "digests": self._digests}, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
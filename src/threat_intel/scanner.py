@@ -1,56 +1,297 @@
 import os
-import re
-from typing import List, Set
+import zipfile
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
 from src.models import Extension
+from src.threat_intel import engine
+from src.threat_intel.engine import FileScanResult
+from src.threat_intel.scan_index import ScanIndex
+from src.metrics import Metrics
+from src.discovery import archive
+from src.discovery.archive import ArchiveLimits
 
 # This scans extension files for suspicious URLs and IP addresses
 # It's basically looking for any network stuff embedded in the code
 class StaticScanner:
-    # My regex patterns for finding URLs and IPs
-    URL_PATTERN = re.compile(r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+[^\s\'"<>]*')
-    IP_PATTERN = re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}\b')
-    
-    # I skip these file types because they're not code
-    IGNORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.ico', '.woff', '.woff2', '.ttf', '.eot', '.mp3', '.mp4'}
-    
-    # These IPs are localhost so I ignore them
-    IGNORED_IPS = {'127.0.0.1', '0.0.0.0', '::1'}
+    # The actual matching lives in engine.py, which works on raw bytes
+    # and sniffs file contents to skip images/fonts/media
+    IGNORED_IPS = engine.IGNORED_IPS
+
+    def __init__(self, index: Optional[ScanIndex] = None, rescan: bool = False,
+                 max_file_bytes: Optional[int] = 32 * 1024 * 1024,
+                 max_extension_bytes: Optional[int] = 256 * 1024 * 1024,
+                 processes: Optional[int] = None, split_bytes: int = 8 * 1024 * 1024,
+                 metrics: Optional[Metrics] = None, archive_limits: Optional[ArchiveLimits] = None,
+                 archive_threads: int = 4):
+        # With an index, files (and whole extension versions) that haven't changed
+        # since the last run are not read again. rescan=True ignores what's indexed.
+        self.index = index
+        self.rescan = rescan
+        # Byte budgets so one giant bundle or source map can't eat the whole run.
+        # None means no limit
+        self.max_file_bytes = max_file_bytes
+        self.max_extension_bytes = max_extension_bytes
+        # Regex scanning is CPU-bound and the GIL keeps it on one core, so with
+        # processes > 1 the files are read in a process pool instead. Extensions
+        # bigger than split_bytes are split across the pool file by file.
+        self.processes = processes
+        self.split_bytes = split_bytes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # Counts files and bytes read (and skipped) when given
+        self.metrics = metrics
+        # Packed extensions (.crx/.zip) are scanned in place, within these zip bomb limits.
+        # Big ones are inflated on archive_threads threads when there's no process pool
+        self.archive_limits = archive_limits or ArchiveLimits()
+        self.archive_threads = max(1, archive_threads)
+        self._member_threads: Optional[ThreadPoolExecutor] = None
 
     def scan_extension(self, extension: Extension):
         if not extension.install_path or not os.path.exists(extension.install_path):
             return
 
+        signature = None
+        if self.index:
+            signature = self.index.version_signature(extension.install_path)
+            if not self.rescan:
+                cached = self.index.get_version(extension.install_path, signature)
+                if cached:
+                    extension.set_endpoints(cached[0], cached[1])
+                    if self.metrics:
+                        self.metrics.inc("scan_versions_skipped_total")
+                    return
+
+        if os.path.isfile(extension.install_path):
+            urls, ips, truncated = self._scan_archive(extension.install_path)
+        else:
+            urls, ips, truncated = self._scan_folder(extension.install_path)
+
+        # Sorted so two reports of the same extension are identical
+        extension.set_endpoints(sorted(urls), sorted(ips))
+        extension.scan_truncated = truncated
+        # A truncated scan isn't the full picture, so I don't let it skip the next run
+        if self.index and not truncated:
+            self.index.put_version(extension.install_path, signature,
+                                   extension.extracted_urls, list(extension.extracted_ips))
+
+    def _scan_folder(self, install_path: str) -> Tuple[Set[str], Set[str], bool]:
         urls = set()  # Using a set so I don't get duplicates
         ips = set()
+        pending = []  # (path, stat, byte limit, limited by the extension budget?)
+        budget = self.max_extension_bytes
+        truncated = False
+        # Files by what happened to them: read, reused from the index, binary (sniffed and skipped),
+        # over_budget or failed
+        counts = {"read": 0, "index": 0, "binary": 0, "over_budget": 0, "failed": 0}
+        bytes_read = 0
 
-        # Walk through every file in the extension folder
-        for root, _, files in os.walk(extension.install_path):
+        # Walk through every file in the extension folder and work out what actually needs reading
+        for root, _, files in os.walk(install_path):
             for file in files:
-                _, ext = os.path.splitext(file)
-                if ext.lower() in self.IGNORED_EXTENSIONS:
-                    continue
-                
                 path = os.path.join(root, file)
                 try:
-                    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                        
-                        # Find all URLs in the file
-                        found_urls = self.URL_PATTERN.findall(content)
-                        for u in found_urls:
-                            # Clean up trailing punctuation
-                            u = u.rstrip(".,;)'\"")
-                            urls.add(u)
-                        
-                        # Find all IPs in the file
-                        found_ips = self.IP_PATTERN.findall(content)
-                        for ip in found_ips:
-                            if ip not in self.IGNORED_IPS:
-                                ips.add(ip)
-                                
-                except Exception as e:
-                    # Some files might be binary or locked, just skip them
-                    pass
-        
-        extension.extracted_urls = list(urls)
-        extension.extracted_ips = list(ips)
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                cached = self.index.get_file(path, stat) if self.index and not self.rescan else None
+                if cached:
+                    urls.update(cached[0])
+                    ips.update(cached[1])
+                    counts["index"] += 1
+                    continue
+
+                if budget is not None and budget <= 0:
+                    truncated = True
+                    counts["over_budget"] += 1
+                    continue
+
+                # The extension budget is shared out by file size up front, so the
+                # result is the same whether the files are read here or in a process pool
+                limited_by_budget = budget is not None and (self.max_file_bytes is None or budget < self.max_file_bytes)
+                limit = budget if limited_by_budget else self.max_file_bytes
+                if budget is not None:
+                    budget -= stat.st_size if limit is None else min(stat.st_size, limit)
+                pending.append((path, stat, limit, limited_by_budget))
+
+        for (path, stat, limit, limited_by_budget), result in zip(pending, self._scan_files(pending)):
+            if result is None:
+                # Couldn't read it this time, so don't remember it either
+                counts["failed"] += 1
+                continue
+            counts["binary" if result.binary else "read"] += 1
+            bytes_read += result.bytes_scanned
+            urls.update(result.urls)
+            ips.update(result.ips)
+            if result.truncated:
+                truncated = True
+                # Cut short by the extension budget? Then the next run should read it again
+                if limited_by_budget:
+                    continue
+            if self.index:
+                self.index.put_file(path, stat, result.urls, result.ips)
+
+        self._count(counts, bytes_read)
+        return urls, ips, truncated
+
+    def _scan_archive(self, path: str) -> Tuple[Set[str], Set[str], bool]:
+        # Packed extensions are read straight out of the ZIP, nothing is written to disk.
+        # The per-file index is skipped (members have no stat of their own), the
+        # version index above already covers an archive that hasn't changed
+        urls, ips = set(), set()
+        counts = {"read": 0, "binary": 0, "over_budget": 0, "failed": 0, "bomb": 0}
+        bytes_read = 0
+        try:
+            with zipfile.ZipFile(path) as zf:
+                members, refused = archive.plan_members(zf, self.archive_limits)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Error opening archive {path}: {e}")
+            counts["failed"] += 1
+            self._count(counts, bytes_read)
+            return urls, ips, True
+
+        # Zip bombs and members past max_members are left out and make the scan count as truncated
+        counts["bomb"] += refused["bomb"]
+        counts["over_budget"] += refused["too_many"]
+        truncated = bool(refused["bomb"] or refused["too_many"])
+
+        # Same budget sharing as for a folder, going by the sizes in the ZIP's directory
+        jobs, sizes = [], []
+        budget = self.max_extension_bytes
+        for info in members:
+            if budget is not None and budget <= 0:
+                truncated = True
+                counts["over_budget"] += 1
+                continue
+            limited_by_budget = budget is not None and (self.max_file_bytes is None or budget < self.max_file_bytes)
+            limit = budget if limited_by_budget else self.max_file_bytes
+            if budget is not None:
+                budget -= info.file_size if limit is None else min(info.file_size, limit)
+            jobs.append((info.filename, limit))
+            sizes.append(info.file_size if limit is None else min(info.file_size, limit))
+
+        for result in self._scan_members(path, jobs, sizes):
+            if result is None:
+                counts["failed"] += 1
+                continue
+            counts["binary" if result.binary else "read"] += 1
+            bytes_read += result.bytes_scanned
+            urls.update(result.urls)
+            ips.update(result.ips)
+            truncated = truncated or result.truncated
+
+        self._count(counts, bytes_read)
+        return urls, ips, truncated
+
+    def _scan_members(self, path: str, jobs, sizes) -> List[Optional[FileScanResult]]:
+        # Big archives are inflated in parallel: zlib lets go of the GIL, and every
+        # batch opens the archive itself so they don't fight over one file position.
+        # With a process pool the batches go there instead
+        if not jobs:
+            return []
+        try:
+            if sum(sizes) <= self.split_bytes or len(jobs) == 1:
+                return archive.scan_members(path, jobs)
+            workers = self.processes if self.processes and self.processes > 1 else self.archive_threads
+            batches = _split_by_size(jobs, sizes, workers * 4)
+            pool = self._get_pool() if self.processes and self.processes > 1 else self._get_member_threads()
+            results = []
+            for future in [pool.submit(archive.scan_members, path, batch) for batch in batches]:
+                results.extend(future.result())
+            return results
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Error reading archive {path}: {e}")
+            return [None] * len(jobs)
+
+    def _count(self, counts, bytes_read: int):
+        if self.metrics:
+            self.metrics.inc("scan_bytes_total", bytes_read)
+            for outcome, count in counts.items():
+                if count:
+                    self.metrics.inc("scan_files_total", count, {"outcome": outcome})
+
+    def scan_all(self, extensions: List[Extension], workers: Optional[int] = None) -> List[Extension]:
+        # Scans a whole list of extensions. With a process pool the threads here
+        # just keep the pool fed, the real work happens in the worker processes
+        workers = workers or max(1, self.processes or 1) * 2
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bera-scan") as pool:
+            list(pool.map(self.scan_extension, extensions))
+        return extensions
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._member_threads:
+            self._member_threads.shutdown(wait=True)
+            self._member_threads = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # I make this pool lazily from a pipeline thread while the other thread
+                # pools are running, and forking a process with threads can deadlock
+                # the child, so I never use fork here
+                self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=_process_context())
+            return self._pool
+
+    def _get_member_threads(self) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if self._member_threads is None:
+                self._member_threads = ThreadPoolExecutor(max_workers=self.archive_threads,
+                                                          thread_name_prefix="bera-archive")
+            return self._member_threads
+
+    def _scan_files(self, pending) -> List[Optional[FileScanResult]]:
+        jobs = [(path, limit) for path, _, limit, _ in pending]
+        if not jobs:
+            return []
+        if not self.processes or self.processes <= 1:
+            return _scan_files(jobs)
+
+        # Small extensions go to the pool as one job. Big ones get split up by
+        # size so all the cores can chew on the same extension at once
+        total = sum(min(stat.st_size, limit) if limit is not None else stat.st_size
+                    for _, stat, limit, _ in pending)
+        if total <= self.split_bytes or len(jobs) == 1:
+            batches = [jobs]
+        else:
+            batches = _split_by_size(jobs, [stat.st_size for _, stat, _, _ in pending], self.processes * 4)
+
+        pool = self._get_pool()
+        results = []
+        for future in [pool.submit(_scan_files, batch) for batch in batches]:
+            results.extend(future.result())
+        return results
+
+
+def _scan_files(jobs: List[Tuple[str, Optional[int]]]) -> List[Optional[FileScanResult]]:
+    # Lives at module level so the process pool can pickle it
+    return [engine.scan_file(path, limit) for path, limit in jobs]
+
+
+def _split_by_size(jobs, sizes, count: int):
+    # Cuts the (ordered) job list into roughly equal-sized runs. Keeping the
+    # order means results can just be concatenated back together
+    target = max(1, sum(sizes) // max(1, count))
+    batches, current, current_size = [], [], 0
+    for job, size in zip(jobs, sizes):
+        current.append(job)
+        current_size += size
+        if current_size >= target:
+            batches.append(current)
+            current, current_size = [], 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _process_context():
+    # forkserver forks from a clean single-threaded server; spawn is the
+    # fallback on platforms that don't have it (Windows)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
@@ -0,0 +1,160 @@
+import ipaddress
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+from src.models import Extension
+
+# A quick rule-based score that runs before the LLM. Lots of extensions are
+# obviously harmless (themes, no permissions, nothing embedded) and a few are
+# obviously scary, so only the ones in the middle need the expensive LLM call.
+
+# How much each permission adds to the score. Anything not listed adds 0
+PERMISSION_WEIGHTS = {
+    "debugger": 40,
+    "nativeMessaging": 30,
+    "proxy": 25,
+    "management": 20,
+    "webRequestBlocking": 20,
+    "webRequest": 15,
+    "cookies": 15,
+    "privacy": 15,
+    "tabCapture": 15,
+    "desktopCapture": 15,
+    "history": 10,
+    "scripting": 10,
+    "declarativeNetRequest": 10,
+    "clipboardRead": 10,
+    "contentSettings": 10,
+    "pageCapture": 10,
+    "webNavigation": 8,
+    "downloads": 8,
+    "identity": 8,
+    "geolocation": 8,
+    "tabs": 5,
+    "activeTab": 2,
+}
+
+# Host patterns that mean "every website"
+ALL_HOSTS = {"<all_urls>", "*://*/*", "http://*/*", "https://*/*", "*://*", "http://*/", "https://*/"}
+
+CSP_WEIGHTS = {
+    "'unsafe-eval'": 20,
+    "'unsafe-inline'": 10,
+    "'wasm-unsafe-eval'": 5,
+}
+
+
+@dataclass
+class TriageConfig:
+    # Scores at or below low_max are called Low without asking the LLM,
+    # scores at or above high_min are called High. Everything between goes to the LLM
+    low_max: int = 10
+    high_min: int = 90
+    permission_weights: Dict[str, int] = field(default_factory=lambda: dict(PERMISSION_WEIGHTS))
+
+
+class RiskScorer:
+    def __init__(self, config: TriageConfig = None):
+        self.config = config or TriageConfig()
+
+    def score(self, extension: Extension) -> Tuple[int, List[str]]:
+        # Returns the score plus a short list of what contributed to it
+        score = 0
+        reasons = []
+
+        # API permissions (host patterns can be mixed in here in MV2)
+        hosts = []
+        for perm in extension.permissions or []:
+            perm = str(perm)
+            if "://" in perm or perm == "<all_urls>":
+                hosts.append(perm)
+                continue
+            weight = self.config.permission_weights.get(perm, 0)
+            if weight:
+                score += weight
+                reasons.append(f"{perm} (+{weight})")
+
+        # Host access: all sites is the big one, otherwise a little per host
+        hosts.extend(extension.host_permissions)
+        hosts.extend(extension.content_script_matches)
+        if any(h in ALL_HOSTS for h in hosts):
+            score += 30
+            reasons.append("access to all sites (+30)")
+        elif hosts:
+            host_score = min(15, sum(3 if "*." in h else 1 for h in set(hosts)))
+            score += host_score
+            reasons.append(f"{len(set(hosts))} host patterns (+{host_score})")
+
+        # CSP relaxations
+        csp = extension.csp or ""
+        for token, weight in CSP_WEIGHTS.items():
+            if token in csp:
+                score += weight
+                reasons.append(f"CSP {token} (+{weight})")
+
+        # Embedded endpoints: public IPs and plain-http URLs are more interesting than lots of https
+        public_ips = [ip for ip in extension.extracted_ips if _is_public_ip(ip)]
+        if public_ips:
+            ip_score = min(30, 10 * len(public_ips))
+            score += ip_score
+            reasons.append(f"{len(public_ips)} public IPs (+{ip_score})")
+        plain_http = [u for u in extension.extracted_urls if u.startswith("http://") and not _is_local_url(u)]
+        if plain_http:
+            http_score = min(10, 2 * len(plain_http))
+            score += http_score
+            reasons.append(f"{len(plain_http)} plain-http URLs (+{http_score})")
+        if len(extension.extracted_urls) > 20:
+            score += 5
+            reasons.append(f"{len(extension.extracted_urls)} embedded URLs (+5)")
+
+        # Endpoints on a threat intel feed are about as strong a signal as there is
+        if extension.intel_hits:
+            intel_score = min(80, 40 * len(extension.intel_hits))
+            score += intel_score
+            reasons.append(f"{len(extension.intel_hits)} endpoints on threat intel feeds (+{intel_score})")
+
+        # Same ID and version as another install but different bytes: someone edited the files
+        if extension.digest_mismatch:
+            score += 40
+            reasons.append("files differ from other installs of this version (+40)")
+
+        return score, reasons
+
+    def tier(self, score: int) -> str:
+        if score <= self.config.low_max:
+            return "Low"
+        if score >= self.config.high_min:
+            return "High"
+        return "Ambiguous"
+
+    def triage(self, extension: Extension) -> bool:
+        # Scores the extension and, if it's clear-cut, gives it a verdict right away.
+        # Returns True when the LLM can be skipped
+        score, reasons = self.score(extension)
+        tier = self.tier(score)
+        extension.prescore = score
+        extension.prescore_tier = tier
+        if tier == "Ambiguous":
+            return False
+
+        extension.risk_score = tier
+        detail = ", ".join(reasons) if reasons else "no sensitive permissions, host access or embedded endpoints"
+        extension.risk_summary = f"Risk: {tier}\nReason: Local pre-score {score}: {detail}"
+        extension.verdict_source = "local"
+        return True
+
+
+def _is_public_ip(value: str) -> bool:
+    try:
+        return ipaddress.ip_address(value).is_global
+    except ValueError:
+        return False
+
+
+def _is_local_url(url: str) -> bool:
+    # The scanner pulls URLs out of minified code, so some don't parse ("http://a.com[0]")
+    try:
+        host = urlparse(url).hostname or ""
+    except ValueError:
+        return False
+    return host in ("localhost", "127.0.0.1") or host.endswith(".local")
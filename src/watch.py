@@ -0,0 +1,335 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from src.models import Extension
+from src.metrics import Metrics
+from src.analysis import Analyzer
+from src.discovery.chrome import ChromiumDiscovery, _subdirs
+from src.discovery.manager import DiscoveryManager, parse_root
+from src.discovery.dedup import InstallGroups
+from src.threat_intel.scan_index import ScanIndex
+from src.report import json_report, resolve_fields, write_json_report
+
+# "bera watch" keeps running, watches every Extensions folder discovery found and
+# only re-analyses the extensions that were installed, updated or removed.
+# The analyzer (caches, HTTP pool, LLM client) stays warm between rounds.
+
+# Returned by a watcher when it lost track of things and everything should be looked at again
+FULL_RESCAN = "*"
+
+# inotify flags from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT_HEADER = struct.Struct("iIII")
+
+# Every folder is watched: Extensions/, Extensions/<id>/, Extensions/<id>/<version>/ and
+# everything under that. Installs, updates and removals happen at the first two levels,
+# the rest catches a file (say js/background.js) being edited in place, which is
+# what tampering looks like. An extension has a handful of folders, so that's
+# still a few thousand watches for a big profile
+
+
+def _app_signature(app_path: str) -> Tuple:
+    # What the polling watcher compares: every version folder with the size and mtime
+    # of every file in it (the same signature the scan index uses), so an edit
+    # anywhere in the tree shows up. That's only stats, no file gets read
+    return tuple(sorted((version_dir.name, ScanIndex.version_signature(version_dir.path))
+                        for version_dir in _subdirs(app_path)))
+
+
+class PollingWatcher:
+    # Works everywhere: every interval it lists the Extensions folders and compares
+    # each extension's version folders with what it saw last time
+    def __init__(self, extensions_paths: List[str], interval: float = 30.0):
+        self.paths = list(extensions_paths)
+        self.interval = max(0.05, interval)
+        self._snapshot = self._take()
+        self._next_poll = time.monotonic() + self.interval
+
+    def _take(self) -> Dict[str, Tuple]:
+        snapshot = {}
+        for path in self.paths:
+            for app_dir in _subdirs(path):
+                snapshot[app_dir.path] = _app_signature(app_dir.path)
+        return snapshot
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        # Returns the extension folders that changed, or an empty set if nothing did before timeout
+        delay = max(0.0, self._next_poll - time.monotonic())
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(delay)
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._take()
+        changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(path) != self._snapshot.get(path)}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError(errno.ENOSYS, "inotify is not available")
+    return libc
+
+
+class InotifyWatcher:
+    # Linux only, through ctypes so there's nothing extra to install.
+    # The kernel tells me about changes straight away instead of me listing folders
+    def __init__(self, extensions_paths: List[str]):
+        self._libc = _libc()
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._watches: Dict[int, Tuple[str, int]] = {}  # watch descriptor -> (folder, depth)
+        try:
+            for path in extensions_paths:
+                self._add_tree(path, 0)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, path: str, depth: int):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                # Gone again before I got to it, the parent's event covers it
+                return
+            # ENOSPC means fs.inotify.max_user_watches is too low for this many folders
+            raise OSError(err, os.strerror(err), path)
+        self._watches[wd] = (path, depth)
+        for child in _subdirs(path):
+            self._add_tree(child.path, depth + 1)
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed: Set[str] = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            name = os.fsdecode(data[start:start + length].rstrip(b"\0"))
+            offset = start + length
+            self._handle(wd, mask, name, changed)
+        return changed
+
+    def _handle(self, wd: int, mask: int, name: str, changed: Set[str]):
+        if mask & IN_Q_OVERFLOW:
+            # The kernel dropped events, so I can't trust what I know any more
+            changed.add(FULL_RESCAN)
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        if wd not in self._watches:
+            return
+        path, depth = self._watches[wd]
+        if not name:
+            # Events about a watched folder itself. Only losing a whole Extensions folder matters,
+            # for the deeper ones the event in the parent folder already says what changed
+            if depth == 0 and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(FULL_RESCAN)
+            return
+
+        child = os.path.join(path, name)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            try:
+                self._add_tree(child, depth + 1)
+            except OSError:
+                # Out of watches. A full rescan builds a new watcher, which falls back to polling
+                changed.add(FULL_RESCAN)
+        # Whatever happened, it's the extension folder (Extensions/<id>) that needs another look
+        if depth == 0:
+            changed.add(child)
+            return
+        for _ in range(depth - 1):
+            path = os.path.dirname(path)
+        changed.add(path)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(extensions_paths: List[str], polling: bool = False, interval: float = 30.0):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(extensions_paths)
+        except OSError as e:
+            print(f"  inotify isn't usable ({e}), falling back to polling every {interval:g}s")
+    return PollingWatcher(extensions_paths, interval)
+
+
+class WatchSession:
+    def __init__(self, args):
+        self.args = args
+        self.metrics = Metrics()
+        self.analyzer = Analyzer(args, self.metrics)
+        self.roots = [parse_root(root) for root in args.root] if args.root else None
+        self.output_path = args.output
+        self.fields = resolve_fields(args.fields, slim=False)
+        # Extensions/<id> folder -> the extension installed there right now
+        self.installs: Dict[str, Extension] = {}
+        # Extensions folder -> the discoverer (browser and profile) it belongs to
+        self.discoverers: Dict[str, ChromiumDiscovery] = {}
+        self.cycles = 0
+        self.last_stats: Dict = {"dedup": {}, "errors": []}
+        self.run_id = datetime.now().strftime("watch-%Y%m%d%H%M%S")
+
+    def full_scan(self):
+        print("Discovering every extension...")
+        manager = DiscoveryManager(self.roots, workers=self.args.discovery_workers)
+        extensions = manager.run_discovery()
+        self.discoverers = {d.extensions_path: d for d in manager.discoverers}
+        self.installs = {os.path.dirname(ext.install_path): ext for ext in extensions}
+        print(f"  -> Found {len(extensions)} extensions in {len(self.discoverers)} profiles.")
+        self._analyse(extensions, changed=len(extensions))
+
+    def update(self, app_paths: Set[str]):
+        # Looks at just these extension folders again
+        todo = []
+        removed = 0
+        for app_path in sorted(app_paths):
+            discoverer = self.discoverers.get(os.path.dirname(app_path))
+            if not discoverer:
+                continue
+            ext = discoverer.scan_app(app_path)
+            if ext is None:
+                if self.installs.pop(app_path, None):
+                    print(f"  Removed: {os.path.basename(app_path)} ({discoverer.browser_name} {discoverer.profile or ''})")
+                    removed += 1
+                continue
+            self.installs[app_path] = ext
+            todo.append(ext)
+        self._analyse(todo, changed=len(todo) + removed)
+
+    def _analyse(self, extensions: List[Extension], changed: int):
+        self.cycles += 1
+        started = time.perf_counter()
+        # Identical copies among what changed are only analysed once
+        groups = InstallGroups(extensions, workers=self.args.discovery_workers, index=self.analyzer.index)
+        unique = extensions if self.args.no_dedup else groups.build()
+
+        def report_progress(ext: Extension):
+            print(f"  Done: {ext.name} ({ext.id}) -> {ext.risk_score}")
+            groups.fan_out(ext)
+
+        pipeline = self.analyzer.pipeline(on_result=report_progress)
+        pipeline.run(unique)
+        self.analyzer.save()
+        self.metrics.inc("watch_cycles_total")
+        self.metrics.inc("watch_changed_total", changed)
+        self.metrics.observe("watch_cycle_seconds", time.perf_counter() - started)
+        self.metrics.set("extensions", len(self.installs), {"kind": "installs"})
+        self.last_stats = {
+            "dedup": groups.stats() if not self.args.no_dedup else {},
+            "errors": [{"id": ext_id, "stage": stage, "error": message}
+                       for ext_id, stage, message in pipeline.errors],
+        }
+        self.write_report(changed)
+
+    def write_report(self, changed: int):
+        run_stats = {
+            **self.analyzer.cache_stats(),
+            "watch": {"cycles": self.cycles, "changed_last_cycle": changed},
+            "dedup": self.last_stats["dedup"],
+            "metrics": self.metrics.snapshot(),
+            "errors": self.last_stats["errors"],
+        }
+        write_json_report(self.output_path, json_report(self.run_id, datetime.now().isoformat(),
+                                                        list(self.installs.values()), run_stats, self.fields))
+        if self.args.metrics_textfile:
+            self.metrics.write_textfile(self.args.metrics_textfile)
+        print(f"Report updated: {self.output_path} ({len(self.installs)} extensions, {changed} changed)")
+
+    def _collect(self, watcher, stop: threading.Event, rediscover_at: Optional[float]) -> Set[str]:
+        # Blocks until something changes, then keeps collecting until things have been
+        # quiet for --debounce seconds (an update touches lots of files in a burst).
+        # A steady stream of events still gets handled after 10x the debounce time
+        changed: Set[str] = set()
+        while not changed:
+            if stop.is_set():
+                return set()
+            if rediscover_at is not None and time.monotonic() >= rediscover_at:
+                return {FULL_RESCAN}
+            changed = watcher.wait(1.0)
+
+        debounce = self.args.debounce
+        first = time.monotonic()
+        quiet_until = first + debounce
+        while not stop.is_set():
+            now = time.monotonic()
+            deadline = min(quiet_until, first + debounce * 10)
+            if now >= deadline:
+                break
+            more = watcher.wait(deadline - now)
+            if more:
+                changed |= more
+                quiet_until = time.monotonic() + debounce
+        return changed
+
+    def run(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        interval = self.args.rediscover_minutes * 60
+        self.full_scan()
+        watcher = make_watcher(list(self.discoverers), self.args.polling, self.args.poll_interval)
+        print(f"Watching {len(self.discoverers)} Extensions folders with {type(watcher).__name__}...")
+        rediscover_at = time.monotonic() + interval if interval else None
+        try:
+            while not stop.is_set():
+                changed = self._collect(watcher, stop, rediscover_at)
+                if not changed:
+                    continue
+                if FULL_RESCAN in changed:
+                    # New profiles, a lost Extensions folder or dropped events: start over (the caches stay warm)
+                    watcher.close()
+                    self.full_scan()
+                    watcher = make_watcher(list(self.discoverers), self.args.polling, self.args.poll_interval)
+                    rediscover_at = time.monotonic() + interval if interval else None
+                    continue
+                print(f"{len(changed)} extension folders changed, re-analysing...")
+                self.update(changed)
+        finally:
+            watcher.close()
+
+    def close(self):
+        self.analyzer.close()
+        self.analyzer.save()
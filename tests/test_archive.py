@@ -0,0 +1,108 @@
+import io
+import json
+import struct
+import zipfile
+from src.discovery.archive import ArchiveDiscovery, ArchiveLimits, crx_id, id_from_bytes
+from src.discovery.dedup import content_digest
+from src.metrics import Metrics
+from src.threat_intel.scanner import StaticScanner
+from src.threat_intel.scan_index import ScanIndex
+
+MANIFEST = {"name": "Packed", "version": "2.1.0", "permissions": ["tabs", "cookies"],
+            "content_security_policy": {"extension_pages": "script-src 'self'"}}
+
+
+def make_zip(members) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def proto_bytes(number: int, value: bytes) -> bytes:
+    def varint(n):
+        out = b""
+        while True:
+            byte, n = n & 0x7f, n >> 7
+            out += bytes([byte | (0x80 if n else 0)])
+            if not n:
+                return out
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def make_crx3(zip_bytes: bytes, raw_id: bytes) -> bytes:
+    # A proof field first (skipped), then the signed header data with the crx_id in it
+    header = proto_bytes(2, proto_bytes(1, b"public key") + proto_bytes(2, b"signature"))
+    header += proto_bytes(10000, proto_bytes(1, raw_id))
+    return b"Cr24" + struct.pack("<II", 3, len(header)) + header + zip_bytes
+
+
+def test_crx_is_discovered_and_scanned_in_place(tmp_path):
+    raw_id = bytes(range(16))
+    members = {
+        "manifest.json": json.dumps(MANIFEST),
+        "js/background.js": 'fetch("https://collect.example.net/beacon"); ping("8.8.4.4")',
+        "images/icon.png": b"\x89PNG\r\n\x1a\n" + b"https://not.scanned.example" * 10,
+    }
+    path = tmp_path / "packed.crx"
+    path.write_bytes(make_crx3(make_zip(members), raw_id))
+    (tmp_path / "notes.txt").write_text("not an archive")
+
+    assert crx_id(str(path)) == id_from_bytes(raw_id) == "aaabacadaeafagahaiajakalamanaoap"
+    extensions = ArchiveDiscovery([str(tmp_path)]).scan()
+    assert len(extensions) == 1
+    ext = extensions[0]
+    assert (ext.id, ext.name, ext.version, ext.browser) == ("aaabacadaeafagahaiajakalamanaoap", "Packed", "2.1.0", "Archive")
+    assert ext.install_path == str(path)
+    assert ext.permissions == ["tabs", "cookies"]
+    assert ext.manifest_content is None
+    assert ext.manifest() == MANIFEST
+    assert content_digest(str(path))
+
+    metrics = Metrics()
+    index = ScanIndex(str(tmp_path / "scan_index.json"))
+    StaticScanner(index=index, metrics=metrics).scan_extension(ext)
+    assert ext.extracted_urls == ["https://collect.example.net/beacon"]
+    assert ext.extracted_ips == ["8.8.4.4"]
+    assert not ext.scan_truncated
+    assert metrics.snapshot()["counters"]["scan_files_total"]["outcome=binary"] == 1
+    # Nothing was unpacked next to the archive
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["notes.txt", "packed.crx"]
+
+    # An unchanged archive is skipped as a whole next time
+    again = ArchiveDiscovery([str(path)]).scan()[0]
+    StaticScanner(index=index).scan_extension(again)
+    assert index.stats["versions_skipped"] == 1
+    assert again.extracted_urls == ext.extracted_urls
+
+
+def test_zip_bombs_are_skipped_and_big_archives_read_in_parallel(tmp_path):
+    members = {"manifest.json": json.dumps(MANIFEST), "bomb.js": b"\0" * (4 * 1024 * 1024)}
+    for n in range(12):
+        members[f"chunk{n}.js"] = f'load("https://cdn{n}.example.org/x.js");'.encode() + b" " * 4096
+    path = tmp_path / "bundle.zip"
+    path.write_bytes(make_zip(members))
+
+    ext = ArchiveDiscovery([str(path)]).scan()[0]
+    # No CRX header or key, so the file name stands in for the ID
+    assert ext.id == "bundle"
+
+    metrics = Metrics()
+    scanner = StaticScanner(metrics=metrics, split_bytes=1, archive_threads=3)
+    try:
+        scanner.scan_extension(ext)
+    finally:
+        scanner.close()
+    assert ext.extracted_urls == sorted(f"https://cdn{n}.example.org/x.js" for n in range(12))
+    assert ext.scan_truncated
+    files = metrics.snapshot()["counters"]["scan_files_total"]
+    assert files["outcome=bomb"] == 1
+    assert files["outcome=read"] == 13
+
+    # Too many members: the rest are left out
+    limited = StaticScanner(archive_limits=ArchiveLimits(max_members=3))
+    ext = ArchiveDiscovery([str(path)]).scan()[0]
+    limited.scan_extension(ext)
+    assert ext.scan_truncated
+    assert len(ext.extracted_urls) <= 3
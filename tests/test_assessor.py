@@ -0,0 +1,277 @@
+import re
+import json
+import time
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+from src.llm.assessor import RiskAssessor
+from src.llm.verdict_cache import VerdictCache
+from src.metrics import Metrics
+from src.models import Extension
+from src.ratelimit import RequestLimiter, parse_duration, rate_limit_wait
+
+def _fake_client(answer="Risk: High\nReason: Reads every page"):
+    client = MagicMock()
+    response = MagicMock()
+    response.choices = [MagicMock()]
+    response.choices[0].message.content = answer
+    client.chat.completions.create.return_value = response
+    return client
+
+def _assessor(cache, force=False):
+    assessor = RiskAssessor(cache=cache, force=force)
+    assessor.client = _fake_client()
+    assessor.model = "test-model"
+    return assessor
+
+def test_verdict_cache_reuses_unchanged_extensions(tmp_path):
+    cache_path = str(tmp_path / "verdicts.json")
+    ext = Extension(id="abc", version="1.0", permissions=["tabs"], extracted_urls=["https://x.example.com"])
+
+    assessor = _assessor(VerdictCache(cache_path))
+    assert assessor.assess(ext)[0] == "High"
+    assessor.save_cache()
+
+    # New run, same inputs: no LLM call at all
+    assessor = _assessor(VerdictCache(cache_path))
+    assert assessor.assess(ext) == ("High", "Risk: High\nReason: Reads every page")
+    assert assessor.client.chat.completions.create.call_count == 0
+
+    # A new permission changes the fingerprint
+    ext.permissions.append("<all_urls>")
+    assessor.assess(ext)
+    assert assessor.client.chat.completions.create.call_count == 1
+
+    # And --reassess always goes back to the LLM
+    assessor = _assessor(VerdictCache(cache_path), force=True)
+    assessor.assess(ext)
+    assert assessor.client.chat.completions.create.call_count == 1
+
+def test_verdict_cache_keeps_other_models_and_drops_expired(tmp_path):
+    cache_path = str(tmp_path / "verdicts.json")
+    ext = Extension(id="abc", version="1.0")
+
+    assessor = _assessor(VerdictCache(cache_path))
+    assessor.assess(ext)
+    assessor.save_cache()
+
+    # Switching models means a cache miss, but the first model's verdicts stay
+    assessor = _assessor(VerdictCache(cache_path))
+    assessor.model = "other-model"
+    assessor.assess(ext)
+    assert assessor.client.chat.completions.create.call_count == 1
+    assessor.save_cache()
+    assert len(VerdictCache(cache_path)._entries) == 2
+
+    # So switching back is free again
+    assessor = _assessor(VerdictCache(cache_path))
+    assessor.assess(ext)
+    assert assessor.client.chat.completions.create.call_count == 0
+
+    # Expired entries get cleaned out when the cache is saved
+    cache = VerdictCache(cache_path, max_age_seconds=-1)
+    cache.save()
+    assert VerdictCache(cache_path)._entries == {}
+
+    assessor = _assessor(VerdictCache(cache_path, max_age_seconds=-1))
+    assessor.assess(ext)
+    assert assessor.client.chat.completions.create.call_count == 1
+
+# A local OpenAI-compatible /chat/completions endpoint.
+# Batch requests get a JSON array back where #2 is malformed and the last one is missing
+class StubLLMHandler(BaseHTTPRequestHandler):
+    prompts = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][-1]["content"]
+        self.prompts.append(prompt)
+
+        refs = re.findall(r"\[Extension (\d+)\]", prompt)
+        if refs:
+            answers = [{"id": ref, "risk": "Low", "reason": f"batched {ref}"} for ref in refs[:-1]]
+            answers[1]["risk"] = "Severe"
+            content = json.dumps(answers)
+        else:
+            content = "Risk: Medium\nReason: single"
+
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_llm():
+    StubLLMHandler.prompts = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
+
+def test_batch_assessment_validates_and_retries_individually(stub_llm):
+    assessor = RiskAssessor(base_url=stub_llm, model="stub-model")
+    extensions = [Extension(id=f"ext{i}", permissions=["tabs"]) for i in range(5)]
+
+    results = assessor.assess_batch(extensions)
+
+    # One batch request, then one retry each for the malformed and the missing entry
+    assert len(StubLLMHandler.prompts) == 3
+    assert results[0] == ("Low", "Risk: Low\nReason: batched 1")
+    assert results[1] == ("Medium", "Risk: Medium\nReason: single")
+    assert results[2][0] == results[3][0] == "Low"
+    assert results[4] == ("Medium", "Risk: Medium\nReason: single")
+
+def test_batches_respect_token_budget(stub_llm):
+    # A tiny budget means every extension ends up in its own request
+    assessor = RiskAssessor(base_url=stub_llm, model="stub-model", batch_token_budget=1)
+    results = assessor.assess_batch([Extension(id="a"), Extension(id="b")])
+
+    assert len(StubLLMHandler.prompts) == 2
+    assert [r[0] for r in results] == ["Medium", "Medium"]
+
+class FlakyLLMHandler(StubLLMHandler):
+    # Every other request gets a 503
+    calls = 0
+
+    def do_POST(self):
+        FlakyLLMHandler.calls += 1
+        if FlakyLLMHandler.calls % 2 == 1:
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        super().do_POST()
+
+def test_llm_retries_latency_and_tokens_are_recorded():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        metrics = Metrics()
+        assessor = RiskAssessor(base_url=f"http://127.0.0.1:{server.server_port}/v1", model="stub-model",
+                                backoff_base=0.01, metrics=metrics)
+        assert assessor.assess(Extension(id="a"))[0] == "Medium"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["llm_retries_total"] == {"model=stub-model": 1}
+    assert snapshot["counters"]["llm_requests_total"] == {"model=stub-model,outcome=503": 1,
+                                                          "model=stub-model,outcome=ok": 1}
+    assert snapshot["counters"]["llm_tokens_total"] == {"kind=completion,model=stub-model": 1,
+                                                        "kind=prompt,model=stub-model": 1}
+    assert snapshot["histograms"]["llm_request_seconds"]["model=stub-model"]["count"] == 2
+
+class RateLimitedLLMHandler(StubLLMHandler):
+    # Sleeps a little so requests overlap, tracks how many are in flight, and
+    # answers the first `throttle` requests with a 429 like Groq/OpenAI do
+    lock = threading.Lock()
+    in_flight = 0
+    peak = 0
+    throttle = 0
+    retry_after_ms = "150"
+
+    def do_POST(self):
+        cls = RateLimitedLLMHandler
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+            limited = cls.throttle > 0
+            cls.throttle -= 1
+        try:
+            time.sleep(0.05)
+            if limited:
+                self.rfile.read(int(self.headers["Content-Length"]))
+                body = b'{"error": {"message": "Rate limit reached", "type": "tokens"}}'
+                self.send_response(429)
+                self.send_header("retry-after-ms", cls.retry_after_ms)
+                self.send_header("x-ratelimit-remaining-requests", "0")
+                self.send_header("x-ratelimit-reset-requests", "2s")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            super().do_POST()
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+@pytest.fixture
+def rate_limited_llm():
+    RateLimitedLLMHandler.in_flight = RateLimitedLLMHandler.peak = RateLimitedLLMHandler.throttle = 0
+    RateLimitedLLMHandler.retry_after_ms = "150"
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
+
+def test_concurrent_assessment_honours_in_flight_and_retry_after(rate_limited_llm):
+    RateLimitedLLMHandler.throttle = 2
+    metrics = Metrics()
+    assessor = RiskAssessor(base_url=rate_limited_llm, model="stub-model", metrics=metrics, max_retries=4,
+                            backoff_base=0.01, limiter=RequestLimiter(in_flight=3), deadline=30)
+    extensions = [Extension(id=f"ext{i}") for i in range(9)]
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=9) as pool:
+        results = list(pool.map(assessor.assess, extensions))
+    elapsed = time.monotonic() - started
+
+    # Nobody lost their verdict to the 429s, and they were retried no sooner than asked
+    assert [r[0] for r in results] == ["Medium"] * 9
+    assert RateLimitedLLMHandler.peak == 3
+    assert sum(ext.llm_retries for ext in extensions) == 2
+    assert elapsed >= 0.15
+    counters = metrics.snapshot()["counters"]
+    assert counters["llm_throttled_total"] == {"model=stub-model": 2}
+    assert counters["llm_retries_total"] == {"model=stub-model": 2}
+
+def test_rate_limited_request_gives_up_at_the_deadline(rate_limited_llm):
+    RateLimitedLLMHandler.throttle = 100
+    RateLimitedLLMHandler.retry_after_ms = "5000"
+    assessor = RiskAssessor(base_url=rate_limited_llm, model="stub-model", max_retries=10,
+                            limiter=RequestLimiter(in_flight=2), deadline=1)
+    ext = Extension(id="slow")
+
+    started = time.monotonic()
+    score, reason = assessor.assess(ext)
+    assert time.monotonic() - started < 1.5
+    assert score == "UNKNOWN" and "429" in reason
+    # Waiting 5 seconds wouldn't fit in the deadline, so it wasn't retried
+    assert ext.llm_retries == 0
+
+def test_rate_limit_headers_and_limiter():
+    assert rate_limit_wait({"retry-after-ms": "250", "retry-after": "9"}) == 0.25
+    assert rate_limit_wait({"retry-after": "3"}) == 3
+    assert rate_limit_wait({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m2.5s",
+                            "x-ratelimit-remaining-requests": "12", "x-ratelimit-reset-requests": "9s"}) == 62.5
+    assert rate_limit_wait({"x-ratelimit-remaining-requests": "5"}) is None
+    assert parse_duration("20ms") == 0.02
+
+    # 120 RPM = 2 per second after a burst of 20
+    limiter = RequestLimiter(requests_per_minute=120, tokens_per_minute=0, in_flight=50)
+    for _ in range(20):
+        assert limiter.acquire(100, deadline=time.monotonic() + 0.01)
+    assert not limiter.acquire(100, deadline=time.monotonic() + 0.1)
+    # A 429 halves the rate and makes everyone wait
+    limiter.throttled(0.2)
+    assert limiter.requests.rate == 1
+    started = time.monotonic()
+    assert limiter.acquire(100, deadline=time.monotonic() + 5)
+    assert time.monotonic() - started >= 0.2
@@ -0,0 +1,19 @@
+from benchmarks.run import compare, run_benchmarks
+
+def test_benchmark_harness_smoke():
+    # Tiny corpus and no latency, this only checks that the harness still runs end to end
+    params = {"extensions": 3, "versions": 2, "bundles": 1, "bundle_kb": 4, "urls": 3, "ips": 1,
+              "profiles": 2, "seed": 1, "network_items": 2, "store_latency": 0.0, "llm_latency": 0.0,
+              "workers": 2, "repeat": 1}
+    results = run_benchmarks(params)
+
+    assert set(results["benchmarks"]) == {"discovery.scan", "scanner.scan_extension", "enrichment.enrich",
+                                          "assessor.assess", "main.cold", "main.warm", "startup.help", "startup.import"}
+    assert results["benchmarks"]["discovery.scan"]["items"] == 3
+    # Two profiles of three extensions go through main()
+    assert results["benchmarks"]["main.cold"]["items"] == 6
+    assert results["meta"]["stub_requests"]["llm"] > 0
+
+    slower = {"benchmarks": {name: dict(r, seconds=r["seconds"] * 2 + 1) for name, r in results["benchmarks"].items()}}
+    assert {row["status"] for row in compare(slower, results)} == {"slower"}
+    assert {row["status"] for row in compare(results, {"benchmarks": {}})} == {"new"}
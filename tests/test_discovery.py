@@ -2,7 +2,8 @@ import os
 import json
 import pytest
 from unittest.mock import patch, MagicMock
-from src.discovery.chrome import ChromiumDiscovery
+from src.discovery.chrome import ChromiumDiscovery, version_key
+from src.discovery.manager import DiscoveryManager, expand_root, guess_browser, parse_root
 from src.models import Extension
 
 @pytest.fixture
@@ -44,3 +45,71 @@ def test_chromium_scan(mock_extension_fs):
     assert ext.version == "1.0.0"
     assert ext.browser == "TestBrowser"
     assert "tabs" in ext.permissions
+
+def _install(extensions_dir, app_id, version_dirs):
+    for version in version_dirs:
+        ver_dir = extensions_dir / app_id / version
+        ver_dir.mkdir(parents=True)
+        with open(ver_dir / "manifest.json", "w") as f:
+            json.dump({"name": app_id, "version": version.split("_")[0]}, f)
+
+def test_version_folders_compare_numerically(tmp_path):
+    _install(tmp_path, "abcdefg", ["1.9.0_0", "1.10.0_0", "1.10.0_1", "junk"])
+    extensions = ChromiumDiscovery("TestBrowser", str(tmp_path)).scan()
+    assert extensions[0].install_path.endswith("1.10.0_1")
+    assert version_key("2.0") > version_key("1.99.99") > version_key("not-a-version")
+
+def test_manager_finds_every_profile_under_every_root(tmp_path):
+    ext_id = "a" * 32
+    # A whole machine snapshot with two Windows users and a Linux home
+    host = tmp_path / "host"
+    chrome = host / "Users" / "alice" / "AppData" / "Local" / "Google" / "Chrome" / "User Data"
+    _install(chrome / "Default" / "Extensions", ext_id, ["1.0.0_0"])
+    _install(chrome / "Profile 3" / "Extensions", ext_id, ["2.0.0_0"])
+    (chrome / "ShaderCache").mkdir()
+    _install(host / "home" / "bob" / ".config" / "microsoft-edge" / "Default" / "Extensions", "b" * 32, ["1.0_0"])
+    # And a bare Extensions folder given straight away
+    loose = tmp_path / "loose"
+    _install(loose, "c" * 32, ["3.1_0"])
+
+    manager = DiscoveryManager([str(host), ("Chromium", str(loose)), str(host)], workers=4)
+    extensions = manager.run_discovery()
+
+    # The repeated root doesn't find anything twice
+    assert [(e.browser, e.profile, e.version) for e in extensions] == [
+        ("Chrome", "Default", "1.0.0"),
+        ("Chrome", "Profile 3", "2.0.0"),
+        ("Edge", "Default", "1.0"),
+        ("Chromium", None, "3.1"),
+    ]
+    assert manager.timings[str(host)]["profiles"] == 3
+    assert manager.timings[str(loose)]["extensions"] == 1
+    assert all(t["seconds"] >= 0 for t in manager.timings.values())
+
+def test_parse_root():
+    assert parse_root("Edge=/mnt/x") == ("Edge", "/mnt/x")
+    assert parse_root("/mnt/a=b") == (None, "/mnt/a=b")
+
+def test_guess_browser_matches_whole_folder_names():
+    assert guess_browser("/home/u/.config/microsoft-edge/Default") == "Edge"
+    assert guess_browser(r"C:\Users\u\AppData\Local\Google\Chrome\User Data") == "Chrome"
+    assert guess_browser("/home/knowledge/chrome-tools/Extensions") == "Chromium"
+
+def test_unrecognised_roots_are_skipped_unless_the_browser_is_given(tmp_path, capsys):
+    # A home folder with no browsers in it, and extension folders without 32 letter IDs
+    _install(tmp_path, "not-an-id", ["1.0_0"])
+    assert expand_root(str(tmp_path)) == []
+    assert "WARNING" in capsys.readouterr().out
+    [discoverer] = expand_root(str(tmp_path), "Chromium")
+    assert [e.id for e in discoverer.scan()] == ["not-an-id"]
+
+def test_home_folders_with_other_extensions_folders_still_find_browsers(tmp_path):
+    # VS Code keeps ~/.vscode/extensions, which is "Extensions" on a case-insensitive filesystem
+    home = tmp_path / "home"
+    _install(home / ".vscode" / "Extensions", "ms-python.python", ["2024.1.0"])
+    chrome = home / "AppData" / "Local" / "Google" / "Chrome" / "User Data"
+    _install(chrome / "Default" / "Extensions", "a" * 32, ["1.0_0"])
+
+    discoverers = expand_root(str(home))
+    assert [(d.browser_name, d.profile) for d in discoverers] == [("Chrome", "Default")]
+    assert [e.id for e in DiscoveryManager([str(home)]).run_discovery()] == ["a" * 32]
@@ -0,0 +1,172 @@
+import json
+import time
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.enrichment.meta_client import EnrichmentClient
+from src.enrichment.cache import EnrichmentCache
+from src.models import Extension
+
+# A tiny stand-in for the Chrome Web Store and AMO.
+# The first request for every extension gets a 429 so I can check the retries work
+class StubStoreHandler(BaseHTTPRequestHandler):
+    hits = {}
+    lock = threading.Lock()
+    retry_after = "0"
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            count = self.hits[self.path]
+
+        if count == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", self.retry_after)
+            self.end_headers()
+            return
+
+        if self.path.startswith("/detail/"):
+            ext_id = self.path.rsplit("/", 1)[-1]
+            body = f"<html><h1>Store Name {ext_id}</h1></html>".encode()
+            content_type = "text/html"
+        else:
+            body = json.dumps({
+                "name": {"en-US": "Fox Ext"},
+                "summary": {"en-US": "A firefox extension"},
+                "authors": [{"name": "Alice"}],
+            }).encode()
+            content_type = "application/json"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# Answers 304 when the client already has the current ETag
+class EtagStoreHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b"<html><h1>Cached Name</h1></html>"
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+@pytest.fixture
+def stub_store():
+    StubStoreHandler.hits = {}
+    server = _serve(StubStoreHandler)
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+def test_enrich_batch_retries_rate_limits(stub_store):
+    client = EnrichmentClient(
+        cws_url=stub_store + "/detail/{id}",
+        amo_url=stub_store + "/addon/{id}/",
+        backoff_base=0.01,
+        requests_per_second=200,
+    )
+    extensions = [Extension(id=f"ext{i}", browser="Chrome") for i in range(10)]
+    extensions.append(Extension(id="fox", browser="Firefox"))
+
+    client.enrich_batch(extensions, max_workers=8, time_budget=10)
+
+    for ext in extensions[:10]:
+        assert ext.name == f"Store Name {ext.id}"
+    assert extensions[-1].name == "Fox Ext"
+    assert extensions[-1].author == "Alice"
+    # Every URL needed exactly one retry after the 429
+    assert all(count == 2 for count in StubStoreHandler.hits.values())
+
+def test_packed_extensions_are_looked_up_in_the_chrome_store(stub_store):
+    client = EnrichmentClient(cws_url=stub_store + "/detail/{id}", backoff_base=0.01, requests_per_second=200)
+    crx = Extension(id="a" * 32, browser="Archive")
+    zipped = Extension(id="bundle", browser="Archive")
+
+    client.enrich_batch([crx, zipped], time_budget=10)
+
+    assert crx.name == f"Store Name {'a' * 32}"
+    assert zipped.name == "Unknown"
+    assert list(StubStoreHandler.hits) == [f"/detail/{'a' * 32}"]
+
+def test_enrich_gives_up_when_budget_is_spent(stub_store):
+    client = EnrichmentClient(cws_url=stub_store + "/detail/{id}", requests_per_second=200)
+    client.set_time_budget(0.000001)
+    ext = Extension(id="late", browser="Chrome")
+
+    client.enrich(ext)
+
+    assert ext.name == "Unknown"
+    assert StubStoreHandler.hits == {}
+
+def test_huge_retry_after_is_capped(stub_store, monkeypatch):
+    monkeypatch.setattr(StubStoreHandler, "retry_after", "86400")
+    client = EnrichmentClient(cws_url=stub_store + "/detail/{id}", requests_per_second=200, max_retry_after=0.05)
+    ext = Extension(id="patient", browser="Chrome")
+
+    started = time.monotonic()
+    client.enrich(ext)
+
+    assert ext.name == "Store Name patient"
+    assert time.monotonic() - started < 5
+
+def test_cache_hits_revalidates_and_serves_stale(tmp_path):
+    EtagStoreHandler.requests_seen = []
+    server = _serve(EtagStoreHandler)
+    url = f"http://127.0.0.1:{server.server_port}/detail/{{id}}"
+    cache_path = str(tmp_path / "enrichment.json")
+
+    try:
+        # First run goes to the network and fills the cache
+        client = EnrichmentClient(cws_url=url, cache=EnrichmentCache(cache_path), requests_per_second=100)
+        ext = Extension(id="abc", browser="Chrome")
+        client.enrich(ext)
+        client.save_cache()
+        assert ext.name == "Cached Name"
+        assert client.cache_stats()["misses"] == 1
+
+        # Second run with a fresh cache never touches the network
+        client = EnrichmentClient(cws_url=url, cache=EnrichmentCache(cache_path), requests_per_second=100)
+        client.enrich(Extension(id="abc", browser="Chrome"))
+        assert client.cache_stats()["hits"] == 1
+        assert len(EtagStoreHandler.requests_seen) == 1
+
+        # An expired entry gets revalidated with the ETag and the server says 304
+        client = EnrichmentClient(cws_url=url, cache=EnrichmentCache(cache_path, ttl_seconds=0), requests_per_second=100)
+        ext = Extension(id="abc", browser="Chrome")
+        client.enrich(ext)
+        assert ext.name == "Cached Name"
+        assert client.cache_stats()["revalidated"] == 1
+        assert EtagStoreHandler.requests_seen[-1] == '"v1"'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # With the server gone the expired entry is still better than nothing
+    client = EnrichmentClient(cws_url=url, cache=EnrichmentCache(cache_path, ttl_seconds=0),
+                              max_retries=0, requests_per_second=100)
+    ext = Extension(id="abc", browser="Chrome")
+    client.enrich(ext)
+    assert ext.name == "Cached Name"
+    assert client.cache_stats()["stale"] == 1
@@ -0,0 +1,107 @@
+from unittest.mock import MagicMock
+from src.llm.assessor import RiskAssessor
+from src.llm.evidence import compact_evidence, estimate_tokens, group_urls, is_exfil_host, registrable_domain, summarise_csp
+from src.metrics import Metrics
+from src.models import Extension
+
+
+def _noisy_extension():
+    urls = [f"https://cdn.jsdelivr.net/npm/lib{i}/dist.js" for i in range(400)]
+    urls += [f"https://www.w3.org/2000/svg#{i}" for i in range(100)]
+    urls += [f"https://api.vendor{i % 80}.com/v1/item/{i}" for i in range(2000)]
+    urls += ["http://collect.stats-beacon.xyz:8080/b", "https://c2.bad.example.net/x"]
+    ips = [f"45.{i // 250}.{i % 250}.7" for i in range(300)] + ["10.0.0.5"]
+    ext = Extension(id="abc", name="Helper", version="1.0", description="A helpful extension. " * 100,
+                    permissions=["storage", "cookies", "<all_urls>", "debugger", "storage"],
+                    csp="script-src 'self' 'unsafe-eval'; object-src 'self'; script-src 'self'",
+                    extracted_urls=sorted(set(urls)), extracted_ips=ips)
+    ext.intel_hits = [{"endpoint": "https://c2.bad.example.net/x", "rule": "bad.example.net", "feeds": ["c2"]}]
+    return ext
+
+
+def test_evidence_is_ranked_grouped_and_fits_the_budget():
+    ext = _noisy_extension()
+    text = compact_evidence(ext, token_budget=800)
+    assert estimate_tokens(text) <= 800
+
+    lines = text.splitlines()
+    domains = [line for line in lines if line.startswith("- ") and " e.g. " in line]
+    # The flagged domain first, then the one with every red flag, then the rest
+    assert domains[0].startswith("- example.net (1 URL; on threat intel feed")
+    assert domains[1].startswith("- stats-beacon.xyz (1 URL; suspicious TLD, plain http, non-standard port)")
+    assert "- vendor0.com (25 URLs) e.g. " in text
+    # CDN and spec URLs are only counted
+    assert "jsdelivr" not in text and "w3.org" not in text
+    assert "500 CDN/analytics URLs not listed" in text
+    assert "lower-ranked domains" in text and "IPs not shown" in text
+    assert "Permissions: sensitive: debugger, cookies; other: storage" in text
+    assert "Host Access: all sites" in text
+    assert "CSP: object-src 'self'; script-src 'self' 'unsafe-eval' [relaxed: 'unsafe-eval']" in text
+    assert len(next(line for line in lines if line.startswith("Description:"))) < 320
+    # Same inputs, same prompt
+    assert compact_evidence(ext, token_budget=800) == text
+
+
+def test_helpers():
+    assert registrable_domain("a.b.example.co.uk") == "example.co.uk"
+    assert registrable_domain("api.vendor.com") == "vendor.com"
+    assert registrable_domain("8.8.8.8") == "8.8.8.8"
+    assert is_exfil_host("abc.workers.dev") and is_exfil_host("webhook.site")
+    assert not is_exfil_host("notworkers.dev")
+    assert summarise_csp("") == "not set (browser default)"
+    assert summarise_csp('{"extension_pages": "script-src \'self\'"}') == "script-src 'self'"
+
+
+def test_exfil_hosts_are_flagged_and_code_hosts_are_not_noise():
+    groups, noise = group_urls(["https://steal.someone.workers.dev/x", "https://bot.glitch.me/in",
+                                "https://raw.githubusercontent.com/u/r/main/payload.js",
+                                "https://script.google.com/macros/s/abc/exec"], set())
+    assert noise == 0
+    flags = {g.domain: g.flags for g in groups}
+    assert all("paste/webhook/tunnel service" in f for f in flags.values()), flags
+
+
+def _assessor(metrics=None, **kwargs):
+    assessor = RiskAssessor(metrics=metrics, **kwargs)
+    assessor.client = MagicMock()
+    assessor.model = "test-model"
+    return assessor
+
+
+def test_batch_fallback_counts_evidence_once_and_budget_changes_the_key(tmp_path):
+    from src.llm.verdict_cache import VerdictCache
+    metrics = Metrics()
+    assessor = _assessor(metrics, cache=VerdictCache(str(tmp_path / "v.json")), prompt_token_budget=600)
+    # Not JSON, so both extensions get asked again on their own
+    assessor.client.chat.completions.create.return_value.choices = [MagicMock()]
+    assessor.client.chat.completions.create.return_value.choices[0].message.content = "Risk: Low\nReason: x"
+    extensions = [_noisy_extension(), Extension(id="small", name="Small", version="1.0")]
+    assert [r[0] for r in assessor.assess_batch(extensions)] == ["Low", "Low"]
+    assert assessor.client.chat.completions.create.call_count == 3
+
+    counters = metrics.snapshot()["counters"]["llm_prompt_tokens_estimated_total"]
+    compacted = counters["model=test-model,prompt=compacted"]
+    assert compacted == sum(estimate_tokens(compact_evidence(ext, 600)) for ext in extensions)
+
+    # Another evidence budget shows the LLM something else, so the cached verdict doesn't count
+    other = _assessor(cache=assessor.cache, prompt_token_budget=1200)
+    assert other._cached(extensions[1]) == (other._cached(extensions[1])[0], None)
+    assert other._cached(extensions[1])[0] != assessor._cached(extensions[1])[0]
+
+
+def test_assessor_records_tokens_before_and_after():
+    metrics = Metrics()
+    assessor = RiskAssessor(metrics=metrics, prompt_token_budget=600)
+    assessor.client = MagicMock()
+    assessor.client.chat.completions.create.return_value.choices = [MagicMock()]
+    assessor.client.chat.completions.create.return_value.choices[0].message.content = "Risk: High\nReason: x"
+    assessor.model = "test-model"
+
+    assert assessor.assess(_noisy_extension())[0] == "High"
+    prompt = assessor.client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+    assert "stats-beacon.xyz" in prompt
+
+    counters = metrics.snapshot()["counters"]["llm_prompt_tokens_estimated_total"]
+    full = counters["model=test-model,prompt=full"]
+    compacted = counters["model=test-model,prompt=compacted"]
+    assert compacted <= 600 < 10 * compacted < full
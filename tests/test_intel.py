@@ -0,0 +1,57 @@
+import pytest
+from src.models import Extension
+from src.threat_intel.intel import IntelIndex, compile_feeds, parse_indicator
+from src.triage.prescore import RiskScorer
+
+@pytest.fixture
+def intel(tmp_path):
+    (tmp_path / "blocklist.txt").write_text("\n".join([
+        "# comments and junk are skipped",
+        "evil.com",
+        "0.0.0.0 tracker.example.net  # hosts file line",
+        "||ads.badcdn.io^",
+        "*.wild.org",
+        "http://phish.example.com/login",
+        "10.0.0.0/8",
+        "2001:db8::/32",
+        "not a domain!",
+    ]))
+    (tmp_path / "c2.txt").write_text("10.1.0.0/16\n8.8.8.8\nevil.com\n")
+    header = compile_feeds([("blocklist", str(tmp_path / "blocklist.txt")), ("c2", str(tmp_path / "c2.txt"))],
+                           str(tmp_path / "intel.bin"))
+    assert [feed["indicators"] for feed in header["feeds"]] == [8, 3]
+    index = IntelIndex(str(tmp_path / "intel.bin"))
+    yield index
+    index.close()
+
+def test_domains_match_themselves_and_subdomains(intel):
+    assert intel.match_host("evil.com") == ("evil.com", ("blocklist", "c2"))
+    assert intel.match_host("CDN.Evil.COM.") == ("evil.com", ("blocklist", "c2"))
+    assert intel.match_host("notevil.com") is None
+    # Suffix rules only cover subdomains
+    assert intel.match_host("wild.org") is None
+    assert intel.match_host("x.wild.org") == ("*.wild.org", ("blocklist",))
+    assert intel.match_url("https://phish.example.com:8443/a?b") == ("phish.example.com", ("blocklist",))
+    assert intel.match_url("https://example.com/") is None
+
+def test_overlapping_ranges_report_every_feed(intel):
+    assert intel.match_ip("10.1.2.3") == ("10.1.0.0-10.1.255.255", ("blocklist", "c2"))
+    assert intel.match_ip("10.200.0.1") == ("10.2.0.0-10.255.255.255", ("blocklist",))
+    assert intel.match_ip("8.8.8.8") == ("8.8.8.8-8.8.8.8", ("c2",))
+    assert intel.match_ip("8.8.4.4") is None
+    assert intel.match_ip("2001:db8::1")[1] == ("blocklist",)
+    assert intel.match_url("http://10.9.9.9/x")[1] == ("blocklist",)
+
+def test_every_endpoint_is_checked_and_scored(intel):
+    ext = Extension(id="x", extracted_urls=[f"https://ok{i}.example.org" for i in range(50)] + ["https://a.evil.com/c"],
+                    extracted_ips=["1.1.1.1", "8.8.8.8"])
+    hits = intel.annotate(ext)
+    assert [hit["endpoint"] for hit in hits] == ["https://a.evil.com/c", "8.8.8.8"]
+    score, reasons = RiskScorer().score(ext)
+    assert "2 endpoints on threat intel feeds (+80)" in reasons
+
+def test_parse_indicator_formats():
+    assert parse_indicator("||ads.example.com^$third-party") == ("domain", "com.example.ads")
+    assert parse_indicator(".example.com") == ("suffix", "com.example")
+    assert parse_indicator("! adblock comment") is None
+    assert parse_indicator("bad_host!.com") is None
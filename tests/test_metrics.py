@@ -0,0 +1,37 @@
+from src.metrics import Metrics
+from src.models import Extension
+from src.pipeline import Pipeline, Stage
+from src.threat_intel.scanner import StaticScanner
+
+def test_prometheus_text_format():
+    metrics = Metrics()
+    metrics.inc("http_responses_total", labels={"host": "example.com", "status": 200})
+    metrics.inc("http_responses_total", labels={"host": "example.com", "status": 200})
+    metrics.observe("stage_seconds", 0.02, {"stage": "scan"})
+    metrics.observe("stage_seconds", 3, {"stage": "scan"})
+
+    text = metrics.to_prometheus()
+    assert 'bera_http_responses_total{host="example.com",status="200"} 2' in text
+    assert 'bera_stage_seconds_bucket{stage="scan",le="0.025"} 1' in text
+    assert 'bera_stage_seconds_bucket{stage="scan",le="+Inf"} 2' in text
+    assert 'bera_stage_seconds_count{stage="scan"} 2' in text
+
+    snapshot = metrics.snapshot()
+    assert snapshot["histograms"]["stage_seconds"]["stage=scan"]["max"] == 3
+
+def test_pipeline_and_scanner_record_metrics(tmp_path):
+    install = tmp_path / "ext"
+    install.mkdir()
+    (install / "bg.js").write_text("fetch('https://a.example.com')")
+    (install / "icon.png").write_bytes(b"\x89PNG\r\n\x1a\n" + b"\0" * 100)
+
+    metrics = Metrics()
+    scanner = StaticScanner(metrics=metrics)
+    ext = Extension(id="x", install_path=str(install))
+    Pipeline([Stage("scan", scanner.scan_extension, 1)], metrics=metrics).run([ext])
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["scan_files_total"] == {"outcome=binary": 1, "outcome=read": 1}
+    assert snapshot["counters"]["scan_bytes_total"][""] == len("fetch('https://a.example.com')")
+    assert snapshot["histograms"]["stage_seconds"]["stage=scan"]["count"] == 1
+    assert set(ext.timings) == {"scan", "total"}
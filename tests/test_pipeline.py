@@ -0,0 +1,55 @@
+import time
+import random
+from src.pipeline import Pipeline, Stage
+from src.models import Extension
+
+def test_pipeline_keeps_order_and_survives_errors():
+    extensions = [Extension(id=f"ext{i}") for i in range(20)]
+    finished = []
+
+    def slow_enrich(ext):
+        time.sleep(random.uniform(0, 0.02))
+        ext.name = ext.id.upper()
+
+    def flaky_scan(ext):
+        if ext.id == "ext3":
+            raise RuntimeError("boom")
+        ext.extracted_urls = [f"https://{ext.id}.example.com"]
+
+    def assess(ext):
+        ext.risk_score = "Low"
+
+    pipeline = Pipeline([
+        Stage("enrich", slow_enrich, 8),
+        Stage("scan", flaky_scan, 2),
+        Stage("assess", assess, 4),
+    ], on_result=finished.append)
+
+    results = pipeline.run(extensions)
+
+    # Same order as discovery, no matter which finished first
+    assert [e.id for e in results] == [f"ext{i}" for i in range(20)]
+    assert len(finished) == 20
+    # The broken extension still made it through the later stages
+    assert all(e.risk_score == "Low" for e in results)
+    assert results[3].extracted_urls == []
+    assert pipeline.errors == [("ext3", "scan", "boom")]
+
+def test_pipeline_batches_stage_input():
+    extensions = [Extension(id=f"ext{i}") for i in range(7)]
+    batch_sizes = []
+
+    def assess_batch(batch):
+        batch_sizes.append(len(batch))
+        for ext in batch:
+            ext.risk_score = "Low"
+
+    pipeline = Pipeline([
+        Stage("scan", lambda ext: None, 3),
+        Stage("assess", assess_batch, 2, batch_size=3),
+    ])
+    results = pipeline.run(extensions)
+
+    # 7 extensions in batches of 3: the leftover one is flushed once everything has arrived
+    assert sorted(batch_sizes) == [1, 3, 3]
+    assert all(e.risk_score == "Low" for e in results)
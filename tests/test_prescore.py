@@ -0,0 +1,42 @@
+import pytest
+from src.triage.prescore import RiskScorer, TriageConfig
+from src.models import Extension
+
+def test_theme_only_extension_is_low_locally():
+    theme = Extension(id="theme", manifest_content={"theme": {"colors": {"frame": [0, 0, 0]}}})
+
+    assert RiskScorer().triage(theme)
+    assert theme.risk_score == "Low"
+    assert theme.verdict_source == "local"
+    assert theme.prescore == 0
+
+def test_clear_cut_and_ambiguous_extensions():
+    scary = Extension(
+        id="scary",
+        permissions=["debugger", "nativeMessaging", "webRequest", "<all_urls>"],
+        csp="script-src 'self' 'unsafe-eval'",
+        extracted_ips=["8.8.8.8"],
+    )
+    middling = Extension(id="mid", permissions=["tabs", "storage", "cookies"],
+                         host_permissions=["https://*.example.com/*"])
+    scorer = RiskScorer()
+
+    assert scorer.triage(scary)
+    assert scary.risk_score == "High"
+    assert "debugger (+40)" in scary.risk_summary
+
+    assert not scorer.triage(middling)
+    assert middling.prescore_tier == "Ambiguous"
+    assert middling.verdict_source is None
+    assert middling.risk_score == "UNKNOWN"
+
+def test_thresholds_are_configurable():
+    ext = Extension(id="tabs", permissions=["tabs", "cookies"])
+    assert not RiskScorer().triage(ext)
+    assert RiskScorer(TriageConfig(low_max=25)).triage(ext)
+    assert ext.risk_score == "Low"
+
+def test_urls_that_do_not_parse_still_score():
+    ext = Extension(id="odd", extracted_urls=["http://a.com[0]", "http://evil.example.com]", "http://localhost/x"])
+    score, reasons = RiskScorer().score(ext)
+    assert "2 plain-http URLs (+4)" in reasons
@@ -0,0 +1,44 @@
+import pytest
+from src.report import NdjsonReportWriter, read_ndjson, resolve_fields
+from src.models import Extension
+
+def _ext(i, risk="Low"):
+    return Extension(id=f"ext{i}", version="1.0", install_path=f"/x/ext{i}", risk_score=risk,
+                     manifest_content={"key": "A" * 100})
+
+@pytest.mark.parametrize("name", ["report.ndjson", "report.ndjson.gz"])
+def test_interrupted_report_can_be_resumed(tmp_path, name):
+    path = str(tmp_path / name)
+    writer = NdjsonReportWriter(path, "run1", "now", resolve_fields(None, slim=True)).open()
+    writer.write(_ext(1, "High"))
+    writer.write(_ext(2))
+    writer._file.flush()
+    # Simulate a crash halfway through the third line
+    writer._file.write('{"id": "ext3", "na')
+    writer._file.flush()
+    writer._file = None
+
+    writer = NdjsonReportWriter(path, "run2", "later", resolve_fields(None, slim=True)).open(resume=True)
+    assert writer.run_id == "run1"
+    assert writer.is_done(_ext(1)) and writer.is_done(_ext(2))
+    assert not writer.is_done(_ext(3))
+    # The installs from before the crash come back too, for the results store
+    assert [(e.id, e.risk_score) for e in writer.resumed] == [("ext1", "High"), ("ext2", "Low")]
+    writer.write(_ext(3, "Critical"))
+    summary = writer.write_summary()
+    writer.close()
+
+    assert summary["total"] == 3
+    assert summary["high_risk_count"] == 2
+    header, records = read_ndjson(path)
+    assert header["run_id"] == "run1"
+    assert [r["id"] for r in records] == ["ext1", "ext2", "ext3"]
+    # The slim records leave the raw manifest out
+    assert "manifest_content" not in records[0]
+
+def test_field_selection_keeps_resume_keys():
+    assert resolve_fields("risk_score", slim=True) == ["id", "version", "install_path", "risk_score"]
+    assert resolve_fields("all", slim=True) is None
+    assert resolve_fields(None, slim=False) is None
+    with pytest.raises(ValueError):
+        resolve_fields("nope", slim=True)
@@ -1,6 +1,9 @@
 import pytest
+import io
 import os
 from src.threat_intel.scanner import StaticScanner
+from src.threat_intel.scan_index import ScanIndex
+from src.threat_intel import engine
 from src.models import Extension
 
 @pytest.fixture
@@ -25,3 +28,115 @@ def test_static_scanner(mock_extension_path):
     
     assert "https://api.evil.com/v1/collect" in ext.extracted_urls
     assert "8.8.8.8" in ext.extracted_ips
+
+def test_scan_index_skips_unchanged_files(tmp_path):
+    ext_dir = tmp_path / "abc" / "1.0.0"
+    ext_dir.mkdir(parents=True)
+    (ext_dir / "manifest.json").write_text('{"name": "x"}', encoding='utf-8')
+    (ext_dir / "a.js").write_text('fetch("https://a.example.com/x")', encoding='utf-8')
+    (ext_dir / "b.js").write_text('ping("10.1.2.3")', encoding='utf-8')
+    index_path = str(tmp_path / "scan_index.json")
+
+    index = ScanIndex(index_path)
+    StaticScanner(index=index).scan_extension(Extension(id="abc", install_path=str(ext_dir)))
+    index.save()
+    assert index.stats["files_scanned"] == 3
+
+    # Same version again: skipped without opening a single file
+    index = ScanIndex(index_path)
+    ext = Extension(id="abc", install_path=str(ext_dir))
+    StaticScanner(index=index).scan_extension(ext)
+    assert index.stats == {"versions_skipped": 1, "files_reused": 0, "files_scanned": 0,
+                           "digests_reused": 0, "digests_computed": 0}
+    assert ext.extracted_urls == ["https://a.example.com/x"]
+    assert ext.extracted_ips == ["10.1.2.3"]
+
+    # A new file changes the folder, so only that file gets read
+    (ext_dir / "c.js").write_text('go("https://c.example.com")', encoding='utf-8')
+    ext = Extension(id="abc", install_path=str(ext_dir))
+    StaticScanner(index=index).scan_extension(ext)
+    assert index.stats["files_reused"] == 3
+    assert index.stats["files_scanned"] == 1
+    assert "https://c.example.com" in ext.extracted_urls
+
+    # Once the version is uninstalled, compaction forgets about it
+    for f in ext_dir.iterdir():
+        f.unlink()
+    ext_dir.rmdir()
+    assert index.compact() == (1, 4)
+
+def test_chunked_stream_matches_whole_buffer_scan():
+    # Put URLs and IPs right across every possible chunk boundary
+    filler = b"x" * 9000
+    data = b" ".join([filler, b"https://boundary.example.com/path?q=1", filler, b"10.20.30.40", filler] * 5)
+
+    whole_urls, whole_ips = set(), set()
+    engine.scan_buffer(data, whole_urls, whole_ips)
+
+    stream_urls, stream_ips = set(), set()
+    read = engine.scan_stream(io.BytesIO(data), len(data), stream_urls, stream_ips, chunk_size=8192)
+
+    assert read == len(data)
+    assert stream_urls == whole_urls == {"https://boundary.example.com/path?q=1"}
+    assert stream_ips == whole_ips == {"10.20.30.40"}
+
+def test_scanner_sniffs_content_and_respects_budgets(tmp_path):
+    ext_dir = tmp_path / "sniff"
+    ext_dir.mkdir()
+    # An "image" that is really JavaScript, and a "script" that is really a PNG
+    (ext_dir / "logo.png").write_bytes(b'fetch("https://hidden.example.com/beacon")')
+    (ext_dir / "app.js").write_bytes(b'\x89PNG\r\n\x1a\nhttps://not-code.example.com')
+    (ext_dir / "big.js").write_bytes(b"y" * 1000 + b" https://late.example.com")
+
+    ext = Extension(id="sniff", install_path=str(ext_dir))
+    StaticScanner(max_file_bytes=500).scan_extension(ext)
+
+    assert ext.extracted_urls == ["https://hidden.example.com/beacon"]
+    assert ext.scan_truncated
+
+def test_process_pool_matches_serial_scan(tmp_path):
+    extensions = []
+    for i in range(3):
+        ext_dir = tmp_path / f"ext{i}"
+        ext_dir.mkdir()
+        for j in range(6):
+            (ext_dir / f"f{j}.js").write_text(
+                f'a("https://h{i}-{j}.example.com/x"); b("10.0.{i}.{j}");' + "z" * 2000, encoding='utf-8')
+        extensions.append(ext_dir)
+
+    serial = [Extension(id=d.name, install_path=str(d)) for d in extensions]
+    StaticScanner().scan_all(serial)
+
+    # split_bytes is tiny so every extension gets split across the pool file by file
+    scanner = StaticScanner(processes=2, split_bytes=1024)
+    parallel = [Extension(id=d.name, install_path=str(d)) for d in extensions]
+    try:
+        scanner.scan_all(parallel)
+    finally:
+        scanner.close()
+
+    for a, b in zip(serial, parallel):
+        assert a.extracted_urls == b.extracted_urls == sorted(b.extracted_urls)
+        assert a.extracted_ips == b.extracted_ips
+        assert len(b.extracted_urls) == 6
+
+def test_scan_index_notices_files_rewritten_in_place(tmp_path):
+    # Rewriting a nested file changes neither the version folder's mtime nor the
+    # manifest, but the next scan still has to see the new contents
+    ext_dir = tmp_path / "abc" / "1.0.0"
+    (ext_dir / "js").mkdir(parents=True)
+    (ext_dir / "manifest.json").write_text('{"name": "x"}', encoding='utf-8')
+    bg = ext_dir / "js" / "bg.js"
+    bg.write_text('fetch("https://good.example.org/")', encoding='utf-8')
+    index = ScanIndex(str(tmp_path / "scan_index.json"))
+    StaticScanner(index=index).scan_extension(Extension(id="abc", install_path=str(ext_dir)))
+
+    dir_mtime = os.stat(ext_dir).st_mtime_ns
+    bg.write_text('fetch("https://evil-c2.example.net/")', encoding='utf-8')
+    os.utime(bg, ns=(os.stat(bg).st_atime_ns, os.stat(bg).st_mtime_ns + 10**9))
+    os.utime(ext_dir, ns=(dir_mtime, dir_mtime))
+
+    ext = Extension(id="abc", install_path=str(ext_dir))
+    StaticScanner(index=index).scan_extension(ext)
+    assert ext.extracted_urls == ["https://evil-c2.example.net/"]
+    assert index.stats["versions_skipped"] == 0
